@@ -0,0 +1,402 @@
+#!/usr/bin/env python3
+# Offline replay and benchmark harness
+# Streams recorded or synthetic RedisQ responses through the real Killmail, feed and alert pipeline
+# using stub ESI and Discord backends, so no network access is required.
+import argparse
+import json
+import logging
+import os
+import random
+import tempfile
+import threading
+import time
+
+from zkillmon.alerts import DiscordDelivery, DiscordWebhookStatsTracker
+from zkillmon.configuration import configurationFilePath, loadConfig
+from zkillmon.esi import ESICacheDatabase, ESILookup, ESIMemoryCache
+from zkillmon.feeds import FeedIndex
+from zkillmon.killmail import Killmail
+from zkillmon.processor import KillmailProcessor
+from zkillmon.sharding import ShardedFeedIndex
+from zkillmon.universe import UniverseMap
+
+# Class StubResponse - Minimal stand in for requests.Response
+class StubResponse(object):
+    def __init__(self, statusCode: int, data, headers: dict = None):
+        self.status_code = statusCode
+        self.text = json.dumps(data)
+        self.headers = headers or {}
+        self.reason = "Stub"
+
+    def json(self):
+        return json.loads(self.text)
+
+# Class StubESILookup - ESILookup answering every request with synthetic data after an injected latency
+class StubESILookup(ESILookup):
+    def __init__(self, esiCacheDatabase, latency: float = 0.0):
+        super().__init__("https://esi.invalid/latest/", "?datasource=tranquility", "zKillboardMonitor/benchmark", esiCacheDatabase)
+        self.latency = latency
+
+    def _request(self, fullURL: str, headers: str, queryType: str = "other"):
+        self._updateStatistics(queryType)
+        if self.latency:
+            time.sleep(self.latency)
+        path = fullURL[len(self.config['baseurl']):].split("?")[0].strip("/").split("/")
+        if path[-1] == "factions":
+            return StubResponse(200, [{"faction_id": factionID, "name": "Faction " + str(factionID)} for factionID in range(500001, 500025)])
+        queryValue = int(path[-1])
+        data = {"name": path[-2] + " " + str(queryValue)}
+        if path[-2] == "systems":
+            data['constellation_id'] = syntheticConstellation(queryValue)
+        elif path[-2] == "constellations":
+            data['region_id'] = syntheticRegion(queryValue)
+        elif path[-2] == "types":
+            data['group_id'] = syntheticGroup(queryValue)
+        return StubResponse(200, data)
+
+    def _post(self, fullURL: str, headers: str, body, queryType: str = "names"):
+        self._updateStatistics(queryType)
+        if self.latency:
+            time.sleep(self.latency)
+        return StubResponse(200, [{"id": queryValue, "name": "Name " + str(queryValue), "category": "stub"} for queryValue in body])
+
+# Class StubDiscordSession - Accepts webhook posts after an injected latency
+class StubDiscordSession(object):
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.posts = 0
+        self.lock = threading.Lock()
+
+    def post(self, url: str, data=None, json=None, headers: dict = None, timeout: float = None):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.posts+=1
+        return StubResponse(204, {}, {"X-RateLimit-Bucket": url, "X-RateLimit-Remaining": "5", "X-RateLimit-Reset-After": "1"})
+
+    def close(self):
+        pass
+
+# Synthetic universe topology, systems map onto 1000 constellations and 100 regions
+def syntheticConstellation(systemID: int):
+    return 20000000 + systemID % 1000
+
+def syntheticRegion(constellationID: int):
+    return 10000000 + constellationID % 100
+
+# Ship types map onto 5 groups, security statuses range from -1.0 to 1.0
+def syntheticGroup(typeID: int):
+    return 25 + typeID % 5
+
+def syntheticSecurity(systemID: int):
+    return round((systemID * 7919 % 21 - 10) / 10, 1)
+
+def generateUniverseMap():
+    universeMap = UniverseMap()
+    for systemID in range(30000001, 30005001):
+        constellationID = syntheticConstellation(systemID)
+        regionID = syntheticRegion(constellationID)
+        universeMap.add_system(systemID, constellationID, regionID, syntheticSecurity(systemID), "systems " + str(systemID))
+        universeMap.names[constellationID] = "constellations " + str(constellationID)
+        universeMap.names[regionID] = "regions " + str(regionID)
+    universeMap._index()
+    return universeMap
+
+def syntheticEntity(rng):
+    return {
+        "character_id": rng.randint(90000000, 90099999),
+        "corporation_id": rng.randint(98000000, 98004999),
+        "alliance_id": rng.randint(99000000, 99000999)
+    }
+
+def generatePackages(count: int, attackers: int, seed: int = 1):
+    rng = random.Random(seed)
+    labels = ["pvp", "solo", "5+", "nullsec", "lowsec", "highsec", "capital", "npc", "awox"]
+    packages = []
+    for killID in range(1, count + 1):
+        victim = syntheticEntity(rng)
+        victim['ship_type_id'] = rng.choice([670, 587, 11198, 17738, 23919])
+        attackerList = []
+        for attacker in range(attackers):
+            attackerData = syntheticEntity(rng)
+            attackerData['ship_type_id'] = rng.choice([587, 11198, 17738, 23919])
+            attackerData['final_blow'] = attacker == 0
+            attackerList.append(attackerData)
+        packages.append({
+            "package": {
+                "killID": killID,
+                "killmail": {
+                    "killmail_id": killID,
+                    "killmail_time": "2023-12-27T12:00:00Z",
+                    "solar_system_id": rng.randint(30000001, 30005000),
+                    "victim": victim,
+                    "attackers": attackerList
+                },
+                "zkb": {
+                    "totalValue": rng.choice([10000, rng.randint(1000000, 20000000000)]),
+                    "npc": False,
+                    "labels": rng.sample(labels, 3)
+                }
+            }
+        })
+    return packages
+
+def syntheticFilter(rng, depth: int = 0):
+    # Random filter expression, mostly conditions batch matching evaluates as arrays with some needing the universe map or ESI
+    conditionKind = rng.random()
+    if depth < 2 and conditionKind < 0.3:
+        return {rng.choice(["all", "any"]): [syntheticFilter(rng, depth + 1) for child in range(rng.randint(2, 3))]}
+    if depth < 2 and conditionKind < 0.4:
+        return {"not": syntheticFilter(rng, depth + 1)}
+    match rng.choice(["entity", "entity", "location", "label", "value", "attackers", "solo", "victim_ship_type", "security", "victim_ship_group"]):
+        case "entity":
+            entityType, entityID = rng.choice(list(syntheticEntity(rng).items()))
+            entity = {"entity_type": entityType, "entity_id": entityID}
+            role = rng.choice([None, "victim", "attacker"])
+            if role is not None:
+                entity['role'] = role
+            return {"entity": entity}
+        case "location":
+            systemID = rng.randint(30000001, 30005000)
+            return {"location": rng.choice([
+                {"location_type": "system_id", "location_id": systemID},
+                {"location_type": "constellation_id", "location_id": syntheticConstellation(systemID)},
+                {"location_type": "region_id", "location_id": syntheticRegion(syntheticConstellation(systemID))}
+            ])}
+        case "label":
+            return {"label": rng.choice(["pvp", "solo", "5+", "nullsec", "capital", "awox"])}
+        case "value":
+            return {"value": rng.choice([{"min": rng.randint(1000000, 10000000000)}, {"max": rng.randint(1000000, 10000000000)}])}
+        case "attackers":
+            return {"attackers": {"min": rng.randint(1, 5), "max": rng.randint(5, 50)}}
+        case "solo":
+            return {"solo": rng.random() < 0.5}
+        case "victim_ship_type":
+            return {"victim_ship_type": rng.sample([670, 587, 11198, 17738, 23919], 2)}
+        case "security":
+            return {"security": rng.choice([{"min": 0.5}, {"max": 0.0}, {"min": 0.1, "max": 0.4}])}
+        case "victim_ship_group":
+            return {"victim_ship_group": rng.sample(range(25, 30), 2)}
+
+def generateFeeds(count: int, seed: int = 1, filterFraction: float = 0.1):
+    rng = random.Random(seed)
+    feeds = []
+    for feedNumber in range(count):
+        feed = {
+            "name": "Synthetic " + str(feedNumber),
+            "webhook": "https://discord.invalid/api/webhooks/{}/benchmark".format(feedNumber % 50),
+            "include_empty_pods": rng.random() < 0.5
+        }
+        # Filter feeds make up filterFraction, the rest are 70% entity, 20% location and 10% label feeds
+        feedKind = rng.random()
+        if feedKind < filterFraction:
+            feed['feed_type'] = "filter"
+            feed['filter'] = syntheticFilter(rng)
+            feeds.append(feed)
+            continue
+        feedKind = (feedKind - filterFraction) / (1 - filterFraction)
+        if feedKind < 0.7:
+            entityType, entityID = rng.choice(list(syntheticEntity(rng).items()))
+            feed['feed_type'] = "entity"
+            feed['entity'] = {"entity_type": entityType, "entity_id": entityID}
+        elif feedKind < 0.9:
+            feed['feed_type'] = "location"
+            feed['location'] = rng.choice([
+                {"location_type": "system_id", "location_id": rng.randint(30000001, 30005000)},
+                {"location_type": "constellation_id", "location_id": syntheticConstellation(rng.randint(30000001, 30005000))},
+                {"location_type": "region_id", "location_id": syntheticRegion(syntheticConstellation(rng.randint(30000001, 30005000)))}
+            ])
+        else:
+            feed['feed_type'] = "label"
+            feed['label'] = {"zkb_label": rng.choice(["capital", "solo", "awox", "lowsec"])}
+        feeds.append(feed)
+    return feeds
+
+def percentile(values, fraction: float):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def runBenchmark(packages, feeds, esiLatency: float = 0.0, discordLatency: float = 0.0, universeMap=None, shards: int = 0):
+    # Returns throughput and latency statistics for processing packages against feeds with a cold cache
+    with tempfile.TemporaryDirectory() as temporaryDirectory:
+        esiCacheDatabase = ESICacheDatabase(os.path.join(temporaryDirectory, "cachedb.sqlite"))
+        esiLookup = StubESILookup(ESIMemoryCache(esiCacheDatabase), esiLatency)
+        esiLookup.universe_map = universeMap
+        discordSession = StubDiscordSession(discordLatency)
+        discordWebhookStatsTracker = DiscordWebhookStatsTracker()
+        discordDelivery = DiscordDelivery(discordWebhookStatsTracker, queueSize=len(packages) * 10 + 10, session=discordSession)
+        compileStarted = time.perf_counter()
+        feedIndex = ShardedFeedIndex(feeds, shards) if shards > 1 else FeedIndex(feeds)
+        compileTime = time.perf_counter() - compileStarted
+        killmailProcessor = KillmailProcessor(feedIndex, esiLookup, discordWebhookStatsTracker, discordDelivery)
+
+        latencies = []
+        relevant = 0
+        started = time.perf_counter()
+        for responseJson in packages:
+            killStarted = time.perf_counter()
+            killmail = killmailProcessor.process(responseJson)
+            latencies.append(time.perf_counter() - killStarted)
+            if killmail.kill_feeds_relevant:
+                relevant+=1
+        processingTime = time.perf_counter() - started
+        discordDelivery.close()
+        esiCacheDatabase.close()
+        if shards > 1:
+            feedIndex.close()
+
+    kills = len(packages)
+    return {
+        'kills': kills,
+        'relevant': relevant,
+        'compile_ms': compileTime * 1000,
+        'kills_per_second': kills / processingTime if processingTime else 0.0,
+        'p50_ms': percentile(latencies, 0.50) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'esi_calls_per_kill': esiLookup.get_statistics()['query_count'] / kills if kills else 0.0,
+        'discord_posts': discordSession.posts
+    }
+
+def runBatchBenchmark(packages, feeds, batchSizes, universeMap=None):
+    # Returns matching throughput for each batch size against matching each kill in turn, checking the results are identical
+    from zkillmon.batch import BatchFeedMatcher
+    with tempfile.TemporaryDirectory() as temporaryDirectory:
+        esiCacheDatabase = ESICacheDatabase(os.path.join(temporaryDirectory, "cachedb.sqlite"))
+        esiLookup = StubESILookup(ESIMemoryCache(esiCacheDatabase))
+        esiLookup.universe_map = universeMap
+        feedIndex = FeedIndex(feeds)
+        batchFeedMatcher = BatchFeedMatcher(feedIndex)
+
+        def relevantFeeds(killmails):
+            return [(killmail.kill_id, killmail.kill_feeds_to_alert) for killmail in killmails]
+
+        # An untimed pass warms the ESI cache so every timed pass below runs against the same warm cache
+        killmails = [Killmail(responseJson) for responseJson in packages]
+        expected = relevantFeeds([killmail for killmail in killmails if killmail.add_relevant_feeds(feedIndex, esiLookup)])
+        warmQueries = esiLookup.get_statistics()['query_count']
+        # Killmails are built before timing so only matching is measured
+        killmails = [Killmail(responseJson) for responseJson in packages]
+        started = time.perf_counter()
+        relevant = [killmail for killmail in killmails if killmail.add_relevant_feeds(feedIndex, esiLookup)]
+        results = [("scalar", len(packages) / (time.perf_counter() - started), relevantFeeds(relevant) == expected)]
+        for batchSize in batchSizes:
+            killmails = [Killmail(responseJson) for responseJson in packages]
+            relevant = []
+            started = time.perf_counter()
+            for first in range(0, len(killmails), batchSize):
+                relevant.extend(batchFeedMatcher.add_relevant_feeds(killmails[first:first + batchSize], esiLookup))
+            results.append(("batch " + str(batchSize), len(packages) / (time.perf_counter() - started), relevantFeeds(relevant) == expected))
+        if esiLookup.get_statistics()['query_count'] != warmQueries:
+            raise Exception("Timed passes made " + str(esiLookup.get_statistics()['query_count'] - warmQueries) + " ESI requests, the cache was not warm")
+        esiCacheDatabase.close()
+    return results
+
+def runShardBenchmark(packages, feeds, shardCounts, universeMap=None):
+    # Returns matching throughput for each shard count against matching in this process, checking the results are identical
+    with tempfile.TemporaryDirectory() as temporaryDirectory:
+        esiCacheDatabase = ESICacheDatabase(os.path.join(temporaryDirectory, "cachedb.sqlite"))
+        esiLookup = StubESILookup(ESIMemoryCache(esiCacheDatabase))
+        esiLookup.universe_map = universeMap
+        feedIndex = FeedIndex(feeds)
+        # An untimed pass warms the ESI cache so every timed pass below runs against the same warm cache
+        expected = [feedIndex.match(Killmail(responseJson), esiLookup) for responseJson in packages]
+        results = []
+        for shards in [0] + shardCounts:
+            index = feedIndex if shards <= 1 else ShardedFeedIndex(feeds, shards)
+            # Killmails are built before timing so only matching is measured
+            killmails = [Killmail(responseJson) for responseJson in packages]
+            started = time.perf_counter()
+            matches = [index.match(killmail, esiLookup) for killmail in killmails]
+            results.append(("in process" if shards <= 1 else str(shards) + " shards", len(packages) / (time.perf_counter() - started), matches == expected))
+            if shards > 1:
+                index.close()
+        esiCacheDatabase.close()
+    return results
+
+def formatResult(label: str, result):
+    return "{:<28} kills: {:>6}  relevant: {:>6}  kills/s: {:>10.1f}  p50: {:>8.3f}ms  p99: {:>8.3f}ms  esi/kill: {:>6.2f}  discord posts: {:>6}  compile: {:>8.2f}ms".format(
+        label,
+        result['kills'],
+        result['relevant'],
+        result['kills_per_second'],
+        result['p50_ms'],
+        result['p99_ms'],
+        result['esi_calls_per_kill'],
+        result['discord_posts'],
+        result['compile_ms']
+    )
+
+def loadPackages(replayPath: str):
+    packages = []
+    with open(replayPath) as replayFile:
+        for line in replayFile:
+            line = line.strip()
+            if line:
+                responseJson = json.loads(line)
+                if responseJson.get('package') is not None:
+                    packages.append(responseJson)
+    return packages
+
+def parseScales(value: str):
+    return [int(scale) for scale in value.split(",") if scale]
+
+if __name__ == '__main__':
+    argumentParser = argparse.ArgumentParser(description="zKillboardMonitor replay and benchmark harness")
+    argumentParser.add_argument("--esi-latency", type=float, default=0.0, help="Injected latency in milliseconds for each stub ESI request")
+    argumentParser.add_argument("--discord-latency", type=float, default=0.0, help="Injected latency in milliseconds for each stub Discord webhook call")
+    argumentParser.add_argument("--universe-map", action="store_true", help="Use a preloaded universe map for location data instead of stub ESI lookups")
+    argumentParser.add_argument("--shards", type=int, default=0, help="Match feeds in this many worker processes")
+    argumentParser.add_argument("--verbose", action="store_true", help="Log at INFO level instead of WARNING")
+    subparsers = argumentParser.add_subparsers(dest="command", required=True)
+    replayParser = subparsers.add_parser("replay", help="Replay a JSONL file of recorded RedisQ responses")
+    replayParser.add_argument("path", help="JSONL file, e.g. written by the zkillboard record_path option")
+    replayParser.add_argument("--config", default=configurationFilePath, help="Configuration file to take feeds from")
+    syntheticParser = subparsers.add_parser("synthetic", help="Benchmark synthetic killmails across feed and attacker scales")
+    syntheticParser.add_argument("--feeds", type=parseScales, default=[10, 100, 1000, 10000], help="Comma separated feed counts")
+    syntheticParser.add_argument("--attackers", type=parseScales, default=[1, 10, 100, 2000], help="Comma separated attacker counts")
+    syntheticParser.add_argument("--kills", type=int, default=200, help="Killmails per scenario")
+    batchParser = subparsers.add_parser("batch", help="Compare batch feed matching across block sizes with matching each kill in turn")
+    batchParser.add_argument("--feeds", type=parseScales, default=[100, 1000, 10000], help="Comma separated feed counts")
+    batchParser.add_argument("--attackers", type=int, default=10, help="Attackers per killmail")
+    batchParser.add_argument("--kills", type=int, default=10000, help="Killmails per scenario")
+    batchParser.add_argument("--batch-sizes", type=parseScales, default=[1, 10, 100, 1000, 10000], help="Comma separated block sizes")
+    shardParser = subparsers.add_parser("shards", help="Compare feed matching split across worker processes with matching in this process")
+    shardParser.add_argument("--feeds", type=parseScales, default=[1000, 10000], help="Comma separated feed counts")
+    shardParser.add_argument("--filter-fractions", type=lambda value: [float(fraction) for fraction in value.split(",") if fraction], default=[0.1, 0.5], help="Comma separated fractions of feeds which are filter feeds")
+    shardParser.add_argument("--attackers", type=int, default=10, help="Attackers per killmail")
+    shardParser.add_argument("--kills", type=int, default=2000, help="Killmails per scenario")
+    shardParser.add_argument("--shard-counts", type=parseScales, default=[2, 4], help="Comma separated worker process counts")
+    arguments = argumentParser.parse_args()
+
+    logging.basicConfig(
+        format = "[%(asctime)s] [%(levelname)8s] (%(module)s LN %(lineno)s): %(message)s",
+        level = logging.INFO if arguments.verbose else logging.WARNING,
+    )
+    esiLatency = arguments.esi_latency / 1000
+    discordLatency = arguments.discord_latency / 1000
+    universeMap = generateUniverseMap() if arguments.universe_map else None
+
+    match arguments.command:
+        case "replay":
+            feeds = loadConfig(arguments.config)['feeds']
+            packages = loadPackages(arguments.path)
+            print(formatResult("replay " + str(len(feeds)) + " feeds", runBenchmark(packages, feeds, esiLatency, discordLatency, universeMap, arguments.shards)))
+        case "synthetic":
+            for attackers in arguments.attackers:
+                packages = generatePackages(arguments.kills, attackers)
+                for feedCount in arguments.feeds:
+                    label = "feeds: {} attackers: {}".format(feedCount, attackers)
+                    print(formatResult(label, runBenchmark(packages, generateFeeds(feedCount), esiLatency, discordLatency, universeMap, arguments.shards)))
+        case "batch":
+            packages = generatePackages(arguments.kills, arguments.attackers)
+            for feedCount in arguments.feeds:
+                for label, killsPerSecond, identical in runBatchBenchmark(packages, generateFeeds(feedCount), arguments.batch_sizes, universeMap):
+                    print("feeds: {:<8} {:<14} kills/s: {:>10.1f}  identical: {}".format(feedCount, label, killsPerSecond, identical))
+        case "shards":
+            packages = generatePackages(arguments.kills, arguments.attackers)
+            for feedCount in arguments.feeds:
+                for filterFraction in arguments.filter_fractions:
+                    for label, killsPerSecond, identical in runShardBenchmark(packages, generateFeeds(feedCount, filterFraction=filterFraction), arguments.shard_counts, universeMap):
+                        print("feeds: {:<8} filters: {:<5} {:<12} kills/s: {:>10.1f}  identical: {}".format(feedCount, filterFraction, label, killsPerSecond, identical))
@@ -0,0 +1,33 @@
+# zKillboardMonitor - Shared test fixtures, ESI is answered by the stub backend benchmark.py uses
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmark import StubESILookup, generatePackages, generateUniverseMap
+from zkillmon.esi import ESICacheDatabase, ESIMemoryCache
+
+@pytest.fixture
+def esiCacheDatabase(tmp_path):
+    esiCacheDatabase = ESICacheDatabase(str(tmp_path / "cachedb.sqlite"))
+    yield esiCacheDatabase
+    esiCacheDatabase.close()
+
+@pytest.fixture
+def esiLookup(esiCacheDatabase):
+    return StubESILookup(ESIMemoryCache(esiCacheDatabase))
+
+@pytest.fixture(scope="session")
+def universeMap():
+    return generateUniverseMap()
+
+def randomPackages(count: int, attackers: int = 10, seed: int = 1):
+    # Synthetic RedisQ responses, some marked solo so solo filters can match
+    rng = random.Random(seed)
+    packages = generatePackages(count, attackers, seed)
+    for responseJson in packages:
+        responseJson['package']['zkb']['solo'] = rng.random() < 0.2
+    return packages
@@ -0,0 +1,137 @@
+# zKillboardMonitor - ESI cache schema migration, memory tier, circuit breaker and lookups
+import sqlite3
+import time
+
+import pytest
+
+from benchmark import StubESILookup, StubResponse
+from zkillmon.esi import CircuitBreaker, ESICacheDatabase, ESILookupError, ESIMemoryCache
+
+def test_migrates_version_1_cache(tmp_path):
+    path = str(tmp_path / "cachedb.sqlite")
+    sqlite_connection = sqlite3.connect(path)
+    sqlite_connection.execute("""
+        CREATE TABLE cache_data (
+            ID                   INTEGER NOT NULL  PRIMARY KEY,
+            Name                 VARCHAR(100) NOT NULL,
+            ParentID             INTEGER,
+            CHECK ( ID >= 0 ),
+            CHECK ( ID <= 2147483647 )
+        )
+    """)
+    sqlite_connection.executemany("INSERT INTO cache_data VALUES(?, ?, ?)", [
+        (30000142, "Jita", 20000020),
+        (98000001, "Corporation", None),
+        (587, "Rifter", 25)
+    ])
+    sqlite_connection.commit()
+    sqlite_connection.close()
+
+    esiCacheDatabase = ESICacheDatabase(path)
+    try:
+        assert esiCacheDatabase.get(30000142, "system_id")['parent'] == 20000020
+        assert esiCacheDatabase.get(98000001, "corporation_id")['name'] == "Corporation"
+        # IDs outside the ranges EVE keeps distinct are migrated untyped and match any query type
+        assert esiCacheDatabase.get(587, "type_id")['name'] == "Rifter"
+        # Migrated entries have no expiry so they are revalidated when next used
+        assert esiCacheDatabase.get(30000142, "system_id")['expires'] == 0
+        sqlite_connection = esiCacheDatabase._connection()
+        assert sqlite_connection.execute("PRAGMA user_version").fetchone()[0] == ESICacheDatabase.schema_version
+        assert sqlite_connection.execute("SELECT name FROM sqlite_master WHERE name = 'cache_data'").fetchone() is None
+    finally:
+        esiCacheDatabase.close()
+
+def test_typed_entries_take_precedence_over_untyped(esiCacheDatabase):
+    esiCacheDatabase.create(587, "Untyped", None, None)
+    esiCacheDatabase.create(587, "Rifter", 25, "type_id")
+    esiCacheDatabase.flush()
+    assert esiCacheDatabase.get(587, "type_id")['name'] == "Rifter"
+    assert esiCacheDatabase.get_many([587], "type_id")[587]['name'] == "Rifter"
+    assert esiCacheDatabase.get(587, "character_id")['name'] == "Untyped"
+
+def test_memory_tier_evicts_least_recently_used(esiCacheDatabase):
+    esiMemoryCache = ESIMemoryCache(esiCacheDatabase, maxEntries=2)
+    for id in (1, 2, 3):
+        esiMemoryCache.create(id, "Name " + str(id), None, "type_id")
+    assert esiMemoryCache.get_statistics()['memory_eviction'] == 1
+    assert esiMemoryCache._get_memory(1, "type_id") is None
+    # Evicted entries are still answered from SQLite, and brought back into memory
+    assert esiMemoryCache.get(1, "type_id")['name'] == "Name 1"
+    assert esiMemoryCache._get_memory(1, "type_id") is not None
+
+def test_memory_tier_expires_by_query_type(esiCacheDatabase, monkeypatch):
+    esiMemoryCache = ESIMemoryCache(esiCacheDatabase, ttls={"character_id": 60})
+    esiMemoryCache.create(90000001, "Character", None, "character_id")
+    esiMemoryCache.create(587, "Rifter", 25, "type_id")
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 61)
+    assert esiMemoryCache._get_memory(90000001, "character_id") is None
+    assert esiMemoryCache._get_memory(587, "type_id") is not None
+    assert esiMemoryCache.get_statistics()['memory_expired'] == 1
+
+def test_circuit_breaker_opens_and_probes(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(time, "monotonic", lambda: now[0])
+    circuitBreaker = CircuitBreaker(failureThreshold=2, resetTimeout=10)
+    assert circuitBreaker.record_failure() == 0
+    assert circuitBreaker.allow()
+    resetTimeout = circuitBreaker.record_failure()
+    assert 5 <= resetTimeout <= 10
+    assert not circuitBreaker.allow()
+    now[0]+=resetTimeout
+    # A single trial request once the reset timeout has passed
+    assert circuitBreaker.allow()
+    assert not circuitBreaker.allow()
+    # A failed trial opens it again for longer
+    assert 10 <= circuitBreaker.record_failure() <= 20
+    now[0]+=20
+    assert circuitBreaker.allow()
+    circuitBreaker.record_success()
+    assert circuitBreaker.allow()
+    assert circuitBreaker.allow()
+
+# Class FailingESILookup - Stub ESI answering every request with a server error
+class FailingESILookup(StubESILookup):
+    def _request(self, fullURL: str, headers: str, queryType: str = "other"):
+        self._updateStatistics(queryType)
+        return StubResponse(503, {"error": "Service Unavailable"})
+
+def test_failing_endpoint_is_rejected_once_the_circuit_opens(esiCacheDatabase):
+    esiLookup = FailingESILookup(ESIMemoryCache(esiCacheDatabase))
+    esiLookup.failure_threshold = 3
+    esiLookup.placeholder_names = False
+    for queryValue in range(3):
+        with pytest.raises(ESILookupError):
+            esiLookup.lookup("system_id", 30000001 + queryValue)
+    queries = esiLookup.get_statistics()['query_count']
+    with pytest.raises(ESILookupError):
+        esiLookup.lookup("system_id", 30000010)
+    assert esiLookup.get_statistics()['query_count'] == queries
+    assert esiLookup.get_statistics()['circuit_rejected'] == 1
+    # Placeholders stand in for names while ESI is failing
+    esiLookup.placeholder_names = True
+    assert esiLookup.lookup("system_id", 30000011)['name'] == "Unknown (30000011)"
+
+def test_lookups_are_cached(esiLookup):
+    system = esiLookup.lookup("system_id", 30000001)
+    assert system['parent'] is not None
+    queries = esiLookup.get_statistics()['query_count']
+    assert esiLookup.lookup("system_id", 30000001)['name'] == system['name']
+    assert esiLookup.lookup_parent("type_id", 587)['parent'] is not None
+    assert esiLookup.lookup_parent("type_id", 587)['parent'] is not None
+    assert esiLookup.get_statistics()['query_count'] == queries + 1
+
+def test_prefetch_names_resolves_in_bulk(esiLookup):
+    queries = [("character_id", 90000001), ("corporation_id", 98000001), ("system_id", 30000001)]
+    resolved = esiLookup.prefetch_names(queries)
+    # Locations need their parents and are not resolved by name
+    assert set(resolved) == {("character_id", 90000001), ("corporation_id", 98000001)}
+    assert esiLookup.get_statistics()['query_count'] == 1
+    assert esiLookup.cache.get(90000001, "character_id")['name'] == "Name 90000001"
+
+def test_store_clears_negative_entries(esiLookup):
+    esiLookup._add_negative("faction", 500001)
+    esiLookup.store("faction", 500001, "Faction")
+    assert esiLookup.lookup("faction", 500001)['name'] == "Faction"
+    assert esiLookup.get_statistics()['query_count'] == 0
+    assert esiLookup.cache.get(500001, "faction")['expires'] > time.time()
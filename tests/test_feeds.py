@@ -0,0 +1,140 @@
+# zKillboardMonitor - Feed matching: FeedIndex against a per-feed reference, and batch and sharded matching against FeedIndex
+import pytest
+
+from benchmark import generateFeeds
+from conftest import randomPackages
+from zkillmon.batch import BatchFeedMatcher
+from zkillmon.feeds import FeedFilter, FeedIndex
+from zkillmon.killmail import Killmail
+from zkillmon.sharding import ShardedFeedIndex
+
+# Each feed checked in turn by its documented rules, the behaviour FeedIndex must reproduce
+def referenceRelationship(killmail, feed, esiLookup):
+    if feed['include_empty_pods'] == False and killmail.is_empty_pod():
+        return "None"
+    raw = killmail.kill_raw_data
+    match feed['feed_type']:
+        case "entity":
+            entityType = feed['entity']['entity_type']
+            entityID = feed['entity']['entity_id']
+            relationship = "None"
+            if raw['victim'].get(entityType) == entityID:
+                relationship = "Loss"
+            # Even if the entity is also the victim an attacker match is classed as a kill
+            if any(attacker.get(entityType) == entityID for attacker in raw['attackers']):
+                relationship = "Kill"
+            return relationship
+        case "location":
+            locationID = feed['location']['location_id']
+            match feed['location']['location_type']:
+                case "system_id":
+                    matched = raw['solar_system_id'] == locationID
+                case "constellation_id":
+                    killmail.get_location_data(esiLookup)
+                    matched = killmail.kill_location_data['locationConstellationID'] == locationID
+                case "region_id":
+                    killmail.get_location_data(esiLookup)
+                    matched = killmail.kill_location_data['locationRegionID'] == locationID
+            return "Kill" if matched else "None"
+        case "label":
+            return "Kill" if feed['label']['zkb_label'] in killmail.labels else "None"
+        case "filter":
+            return FeedFilter(feed['filter']).relationship(killmail, esiLookup)
+
+def referenceMatch(responseJson, feeds, esiLookup):
+    killmail = Killmail(responseJson)
+    matches = {}
+    for position, feed in enumerate(feeds):
+        relationship = referenceRelationship(killmail, feed, esiLookup)
+        if relationship != "None":
+            matches[position] = relationship
+    return matches
+
+@pytest.mark.parametrize("withUniverseMap", [False, True])
+def test_feed_index_matches_reference(esiLookup, universeMap, withUniverseMap):
+    if withUniverseMap:
+        esiLookup.universe_map = universeMap
+    feeds = generateFeeds(500, seed=3, filterFraction=0.3)
+    feedIndex = FeedIndex(feeds)
+    matched = 0
+    for responseJson in randomPackages(300, seed=4):
+        expected = referenceMatch(responseJson, feeds, esiLookup)
+        assert feedIndex.match(Killmail(responseJson), esiLookup) == expected
+        matched+=bool(expected)
+    # The comparison is only meaningful if kills do match
+    assert matched > 100
+
+def test_feed_index_excludes_empty_pods(esiLookup):
+    responseJson = randomPackages(1, seed=2)[0]
+    package = responseJson['package']
+    package['killmail']['victim']['ship_type_id'] = 670
+    package['zkb']['totalValue'] = 10000
+    systemID = package['killmail']['solar_system_id']
+    feeds = [
+        {"name": "Pods", "webhook": "https://discord.invalid/1", "include_empty_pods": True, "feed_type": "location", "location": {"location_type": "system_id", "location_id": systemID}},
+        {"name": "No Pods", "webhook": "https://discord.invalid/2", "include_empty_pods": False, "feed_type": "location", "location": {"location_type": "system_id", "location_id": systemID}}
+    ]
+    assert FeedIndex(feeds).match(Killmail(responseJson), esiLookup) == {0: "Kill"}
+
+def test_feed_filter_relationship(esiLookup):
+    responseJson = randomPackages(1, seed=5)[0]
+    victim = responseJson['package']['killmail']['victim']
+    attacker = responseJson['package']['killmail']['attackers'][0]
+    killmail = Killmail(responseJson)
+    loss = FeedFilter({"entity": {"entity_type": "corporation_id", "entity_id": victim['corporation_id'], "role": "victim"}})
+    assert loss.relationship(killmail, esiLookup) == "Loss"
+    kill = FeedFilter({"any": [{"entity": {"entity_type": "character_id", "entity_id": attacker['character_id']}}, {"value": {"min": 0}}]})
+    assert kill.relationship(killmail, esiLookup) == "Kill"
+    negated = FeedFilter({"not": {"entity": {"entity_type": "character_id", "entity_id": attacker['character_id']}}})
+    assert negated.relationship(killmail, esiLookup) == "None"
+
+def test_feed_filter_lookups():
+    assert not FeedFilter({"all": [{"value": {"min": 1}}, {"location": {"location_type": "system_id", "location_id": 30000001}}]}).lookups
+    assert FeedFilter({"any": [{"value": {"min": 1}}, {"security": {"min": 0.5}}]}).lookups
+    assert FeedFilter({"not": {"victim_ship_group": [25]}}).lookups
+    assert FeedFilter({"location": {"location_type": "region_id", "location_id": 10000001}}).lookups
+
+@pytest.mark.parametrize("expression", [
+    {"all": []},
+    {"value": {"min": "1"}},
+    {"entity": {"entity_type": "character_id"}},
+    {"location": {"location_type": "planet_id", "location_id": 1}},
+    {"unknown": 1},
+    {"label": "solo", "value": {"min": 1}}
+])
+def test_feed_filter_rejects_invalid_expressions(expression):
+    with pytest.raises(ValueError):
+        FeedFilter(expression)
+
+@pytest.mark.parametrize("batchSize", [1, 7, 100])
+def test_batch_matching_matches_scalar(esiLookup, universeMap, batchSize):
+    esiLookup.universe_map = universeMap
+    feeds = generateFeeds(400, seed=6, filterFraction=0.5)
+    feedIndex = FeedIndex(feeds)
+    packages = randomPackages(300, seed=7)
+    expected = []
+    for responseJson in packages:
+        killmail = Killmail(responseJson)
+        if killmail.add_relevant_feeds(feedIndex, esiLookup):
+            expected.append((killmail.kill_id, killmail.kill_feeds_to_alert))
+    batchFeedMatcher = BatchFeedMatcher(feedIndex)
+    killmails = [Killmail(responseJson) for responseJson in packages]
+    relevant = []
+    for first in range(0, len(killmails), batchSize):
+        relevant.extend(batchFeedMatcher.add_relevant_feeds(killmails[first:first + batchSize], esiLookup))
+    assert [(killmail.kill_id, killmail.kill_feeds_to_alert) for killmail in relevant] == expected
+
+def test_sharded_matching_matches_feed_index(esiLookup, universeMap):
+    esiLookup.universe_map = universeMap
+    feeds = generateFeeds(600, seed=8, filterFraction=0.3)
+    feedIndex = FeedIndex(feeds)
+    shardedFeedIndex = ShardedFeedIndex(feeds, 2)
+    try:
+        # Filters needing lookups stay in this process, the rest are shared by the workers
+        assert shardedFeedIndex.local_positions
+        assert all(feeds[position]['feed_type'] == "filter" for position in shardedFeedIndex.local_positions)
+        assert sum(feeds[position]['feed_type'] == "filter" for positions in shardedFeedIndex.positions for position in positions)
+        for responseJson in randomPackages(150, seed=9):
+            assert shardedFeedIndex.match(Killmail(responseJson), esiLookup) == feedIndex.match(Killmail(responseJson), esiLookup)
+    finally:
+        shardedFeedIndex.close()
@@ -0,0 +1,102 @@
+# zKillboardMonitor - Spool journaling, replay and acknowledgement once alerts and digests are delivered
+import pytest
+
+import zkillmon.alerts
+import zkillmon.digest
+from benchmark import generateFeeds
+from conftest import randomPackages
+from zkillmon.alerts import DiscordWebhookStatsTracker
+from zkillmon.feeds import FeedIndex
+from zkillmon.processor import KillmailProcessor
+from zkillmon.spool import KillmailSpool, SpoolAcknowledgement
+
+# Class StubPost - Stands in for discordPost, answering every send as accepted or failed
+class StubPost(object):
+    class Response(object):
+        def __init__(self, ok: bool):
+            self.ok = ok
+
+    def __init__(self, ok: bool):
+        self.ok = ok
+        self.posts = 0
+
+    def __call__(self, webhookURL: str, embeds):
+        self.posts+=1
+        return self.Response(self.ok)
+
+@pytest.fixture
+def killmailSpool(tmp_path):
+    killmailSpool = KillmailSpool(str(tmp_path / "spool.sqlite"), maxPending=100, maxAttempts=2)
+    yield killmailSpool
+    killmailSpool.close()
+
+def test_spool_replays_unacknowledged_killmails(tmp_path):
+    path = str(tmp_path / "spool.sqlite")
+    killmailSpool = KillmailSpool(path)
+    packages = randomPackages(3)
+    sequences = [killmailSpool.append(responseJson) for responseJson in packages]
+    killmailSpool.acknowledge(sequences[1])
+    killmailSpool.close()
+    # Survives a restart
+    killmailSpool = KillmailSpool(path)
+    assert killmailSpool.replay() == [(sequences[0], packages[0]), (sequences[2], packages[2])]
+    killmailSpool.close()
+
+def test_spool_discards_after_max_attempts(killmailSpool):
+    killmailSpool.append(randomPackages(1)[0])
+    assert len(killmailSpool.replay()) == 1
+    assert len(killmailSpool.replay()) == 1
+    assert killmailSpool.replay() == []
+    assert killmailSpool.get_statistics()['discarded'] == 1
+
+def test_spool_discards_oldest_beyond_max_pending(tmp_path):
+    killmailSpool = KillmailSpool(str(tmp_path / "spool.sqlite"), maxPending=2)
+    packages = randomPackages(3)
+    for responseJson in packages:
+        killmailSpool.append(responseJson)
+    assert [responseJson for sequence, responseJson in killmailSpool.replay()] == packages[1:]
+    killmailSpool.close()
+
+def test_acknowledgement_waits_for_every_alert(killmailSpool):
+    sequence = killmailSpool.append(randomPackages(1)[0])
+    spoolAcknowledgement = SpoolAcknowledgement(killmailSpool, sequence, 2)
+    spoolAcknowledgement.delivered(True)
+    assert killmailSpool.get_statistics()['pending'] == 1
+    spoolAcknowledgement.delivered(True)
+    assert killmailSpool.get_statistics()['pending'] == 0
+
+def test_acknowledgement_keeps_killmail_after_a_failed_alert(killmailSpool):
+    sequence = killmailSpool.append(randomPackages(1)[0])
+    spoolAcknowledgement = SpoolAcknowledgement(killmailSpool, sequence, 2)
+    spoolAcknowledgement.delivered(False)
+    spoolAcknowledgement.delivered(True)
+    assert killmailSpool.get_statistics()['pending'] == 1
+
+def processKills(killmailSpool, esiLookup, monkeypatch, sent: bool, digest: bool):
+    stubPost = StubPost(sent)
+    monkeypatch.setattr(zkillmon.alerts, "discordPost", stubPost)
+    monkeypatch.setattr(zkillmon.digest, "discordPost", stubPost)
+    feeds = generateFeeds(50, seed=3)
+    if digest:
+        for feed in feeds[::2]:
+            feed['digest'] = {"window": 3600}
+    killmailProcessor = KillmailProcessor(FeedIndex(feeds), esiLookup, DiscordWebhookStatsTracker(), None, killmailSpool)
+    relevant = sum(bool(killmailProcessor.process(responseJson).kill_feeds_relevant) for responseJson in randomPackages(20, seed=4))
+    return killmailProcessor, stubPost, relevant
+
+@pytest.mark.parametrize("sent", [True, False])
+def test_direct_alerts_acknowledge_only_when_sent(killmailSpool, esiLookup, monkeypatch, sent):
+    killmailProcessor, stubPost, relevant = processKills(killmailSpool, esiLookup, monkeypatch, sent, False)
+    killmailProcessor.close()
+    assert relevant and stubPost.posts
+    assert killmailSpool.get_statistics()['pending'] == (0 if sent else relevant)
+
+@pytest.mark.parametrize("sent", [True, False])
+def test_digest_kills_stay_spooled_until_the_digest_is_sent(killmailSpool, esiLookup, monkeypatch, sent):
+    killmailProcessor, stubPost, relevant = processKills(killmailSpool, esiLookup, monkeypatch, True, True)
+    # The hour long digest windows are still open, so kills with a digest feed cannot be acknowledged yet
+    pending = killmailSpool.get_statistics()['pending']
+    assert pending
+    stubPost.ok = sent
+    killmailProcessor.close()
+    assert killmailSpool.get_statistics()['pending'] == (0 if sent else pending)
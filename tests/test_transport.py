@@ -0,0 +1,141 @@
+# zKillboardMonitor - Shared HTTP transport retry policies and connection reuse against a local server
+import http.server
+import socket
+import socketserver
+import threading
+
+import pytest
+import requests
+
+from zkillmon.transport import HTTPTransport
+
+# Class RecordingHandler - Answers /ok with 200, /unavailable with 503 and /drop by closing the connection mid response
+class RecordingHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *arguments):
+        pass
+
+    def _handle(self):
+        self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        self.server.requests.append((self.command, self.path))
+        match self.path:
+            case "/ok":
+                self.send_response(200)
+                self.send_header("Content-Length", "2")
+                self.end_headers()
+                self.wfile.write(b"ok")
+            case "/unavailable":
+                self.send_response(503)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+            case _:
+                self.close_connection = True
+
+    do_GET = _handle
+    do_POST = _handle
+
+class RecordingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+@pytest.fixture
+def server():
+    recordingServer = RecordingServer(("127.0.0.1", 0), RecordingHandler)
+    recordingServer.requests = []
+    threading.Thread(target=recordingServer.serve_forever, daemon=True).start()
+    yield recordingServer
+    recordingServer.shutdown()
+    recordingServer.server_close()
+
+def transportFor(policy):
+    httpTransport = HTTPTransport()
+    httpTransport.configure({"127.0.0.1": dict(policy, backoff_factor=0)})
+    return httpTransport
+
+def url(server, path: str):
+    return "http://127.0.0.1:" + str(server.server_port) + path
+
+redisqPolicy = HTTPTransport.host_policies["redisq.zkillboard.com"]
+esiPolicy = HTTPTransport.host_policies["esi.evetech.net"]
+
+def test_connections_are_reused(server):
+    httpTransport = transportFor({})
+    for request in range(5):
+        assert httpTransport.get(url(server, "/ok")).text == "ok"
+    statistics = httpTransport.get_statistics()["127.0.0.1"]
+    httpTransport.close()
+    assert statistics == {'requests': 5, 'errors': 0, 'new_connections': 1, 'reused_connections': 4}
+
+def test_esi_retries_gateway_errors_including_names_posts(server):
+    httpTransport = transportFor(esiPolicy)
+    assert httpTransport.post(url(server, "/unavailable"), data=b"[1]").status_code == 503
+    assert httpTransport.get(url(server, "/unavailable")).status_code == 503
+    httpTransport.close()
+    assert server.requests == [("POST", "/unavailable")] * 3 + [("GET", "/unavailable")] * 3
+
+def test_redisq_polls_are_never_resent(server):
+    # RedisQ removes a killmail from its queue when it answers, a poll whose answer is lost must not be repeated
+    httpTransport = transportFor(dict(redisqPolicy, retry_statuses=[503]))
+    assert httpTransport.get(url(server, "/unavailable")).status_code == 503
+    with pytest.raises(requests.exceptions.RequestException):
+        httpTransport.get(url(server, "/drop"))
+    statistics = httpTransport.get_statistics()["127.0.0.1"]
+    httpTransport.close()
+    assert server.requests == [("GET", "/unavailable"), ("GET", "/drop")]
+    assert statistics['errors'] == 1
+
+def test_redisq_read_timeouts_are_not_resent():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(5)
+    accepted = []
+
+    def accept():
+        while True:
+            try:
+                accepted.append(listener.accept()[0])
+            except OSError:
+                return
+
+    threading.Thread(target=accept, daemon=True).start()
+    httpTransport = transportFor(dict(redisqPolicy, timeout=0.2))
+    with pytest.raises(requests.exceptions.RequestException):
+        httpTransport.get("http://127.0.0.1:" + str(listener.getsockname()[1]) + "/listen.php")
+    httpTransport.close()
+    listener.close()
+    assert len(accepted) == 1
+
+def test_redisq_retries_connection_errors():
+    # Nothing listens on the port, so the poll never reached RedisQ and is safe to retry
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    port = listener.getsockname()[1]
+    listener.close()
+    httpTransport = transportFor(redisqPolicy)
+    with pytest.raises(requests.exceptions.ConnectionError):
+        httpTransport.get("http://127.0.0.1:" + str(port) + "/")
+    httpTransport.close()
+
+def test_default_policy_does_not_retry_posts(server):
+    httpTransport = transportFor({'retries': 2, 'retry_statuses': [503]})
+    assert httpTransport.post(url(server, "/unavailable"), data=b"{}").status_code == 503
+    assert httpTransport.get(url(server, "/unavailable")).status_code == 503
+    httpTransport.close()
+    assert server.requests == [("POST", "/unavailable")] + [("GET", "/unavailable")] * 3
+
+def test_statistics_are_not_lost_under_contention(server):
+    httpTransport = transportFor({'pool_size': 8})
+
+    def poll():
+        for request in range(50):
+            httpTransport.get(url(server, "/ok"))
+
+    threads = [threading.Thread(target=poll) for thread in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    statistics = httpTransport.get_statistics()["127.0.0.1"]
+    httpTransport.close()
+    assert statistics['requests'] == 400
+    assert statistics['new_connections'] + statistics['reused_connections'] == 400
@@ -0,0 +1,2 @@
+# zKillboardMonitor
+# Modules are imported by zkillmon.cli only when the configured mode needs them, so nothing is imported here.
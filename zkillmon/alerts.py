@@ -0,0 +1,356 @@
+# zKillboardMonitor - Discord alert rendering and delivery
+import queue
+import json
+import logging
+import requests
+import threading
+import time
+
+import humanize
+
+from zkillmon.metrics import metrics
+from zkillmon.transport import transport
+
+# Extend DiscordWebhook to allow URL to be set by method
+class DiscordWebhookStatsTracker(object):
+    # Upper bounds in seconds of the send latency histogram buckets, the last bucket catches everything slower
+    latency_buckets = [0.1, 0.25, 0.5, 1, 2.5, 5, 10]
+
+    def __init__(self):
+        self.statistics = {
+            'execution_count': 0
+        }
+        self.webhooks = {}
+        self.lock = threading.Lock()
+    def increment_execution(self):
+        self.statistics['execution_count']+=1
+    def _webhook(self, webhookURL: str):
+        # Webhook URLs contain their token, statistics are keyed by the webhook ID only
+        webhookID = webhookLabel(webhookURL)
+        if webhookID not in self.webhooks:
+            self.webhooks[webhookID] = {
+                'sent': 0,
+                'batched': 0,
+                'rate_limited': 0,
+                'dropped': 0,
+                'latency_buckets': [0] * (len(self.latency_buckets) + 1),
+                'latency_sum': 0.0,
+                'latency_count': 0
+            }
+        return self.webhooks[webhookID]
+    def increment_webhook(self, webhookURL: str, counter: str, count: int = 1):
+        with self.lock:
+            self._webhook(webhookURL)[counter]+=count
+    def observe_latency(self, webhookURL: str, seconds: float):
+        with self.lock:
+            webhook = self._webhook(webhookURL)
+            bucket = 0
+            while bucket < len(self.latency_buckets) and seconds > self.latency_buckets[bucket]:
+                bucket+=1
+            webhook['latency_buckets'][bucket]+=1
+            webhook['latency_sum']+=seconds
+            webhook['latency_count']+=1
+        metrics.observe("zkillmon_discord_send_seconds", seconds, {"webhook": webhookLabel(webhookURL)})
+    def get_statistics(self):
+        return self.statistics
+    def get_webhook_statistics(self):
+        with self.lock:
+            return {webhookID: dict(webhook, latency_buckets=list(webhook['latency_buckets'])) for webhookID, webhook in self.webhooks.items()}
+
+# Returns a loggable label for a webhook URL without its token
+def webhookLabel(webhookURL: str):
+    parts = webhookURL.rstrip("/").split("/")
+    if len(parts) >= 2 and parts[-2].isdigit():
+        return parts[-2]
+    return "unknown"
+
+# Returns the body of a webhook message holding the given RenderedEmbeds
+def embedsBody(embeds):
+    return b'{"embeds":[' + b",".join(embed.body for embed in embeds) + b']}'
+
+# Sends RenderedEmbeds to a webhook in one message without queueing, returns the response or None on a request error
+def discordPost(webhookURL: str, embeds):
+    try:
+        return transport.post(webhookURL, data=embedsBody(embeds), headers={"Content-Type": "application/json"})
+    except requests.exceptions.RequestException:
+        logging.error("discordPost: Request error for webhook " + webhookLabel(webhookURL))
+        logging.exception("discordPost:")
+        return None
+
+# Class RenderedEmbed - A Discord embed with its JSON serialized once, reused for every webhook it is sent to
+class RenderedEmbed(object):
+    __slots__ = ('embed', 'body', 'characters')
+
+    def __init__(self, embed):
+        # Unset fields are left out of the serialized embed
+        self.embed = {key: value for key, value in embed.items() if value is not None and value != []}
+        self.body = json.dumps(self.embed, separators=(",", ":")).encode("utf-8")
+        # Characters counted towards the Discord limit per message
+        self.characters = len(embed.get('title') or "") + len(embed.get('description') or "")
+        if embed.get('footer'):
+            self.characters+=len(embed['footer'].get('text') or "")
+        if embed.get('author'):
+            self.characters+=len(embed['author'].get('name') or "")
+        for field in embed.get('fields') or ():
+            self.characters+=len(field.get('name') or "") + len(field.get('value') or "")
+
+# Class AlertPayload - Discord alert content for one kill, rendered once and shared by every relevant feed
+class AlertPayload(object):
+    # Relationship -> (embed color, author name), the only parts of an alert that differ between feeds
+    relationships = {
+        "Loss": (15158332, "Loss"),
+        "Kill": (3066993, "Kill")
+    }
+
+    def __init__(self, alertData):
+        # ToDo: Define Format
+        self.alert_information = alertData
+        # Relationship -> RenderedEmbed, each built on first use
+        self.variants = {}
+
+        self.discord_title = "{} destroyed in {}({})".format(
+            self.alert_information['victim_ship_name'],
+            self.alert_information['kill_location_system'],
+            self.alert_information['kill_location_region']
+        )
+
+        self.discord_description_victim_link = "[{}]({})".format(
+            self.alert_information['victim_name'],
+            self.alert_information['victim_zkillboard_URL']
+        )
+        
+        self.discord_description_killer_link = "[{}]({})".format(
+            self.alert_information['killer_character_name'],
+            self.alert_information['killer_zkillboard_URL']
+        )
+
+        if self.alert_information['killer_count'] == 1:
+            self.discord_description_end = "**Solo!**"
+        elif self.alert_information['killer_count'] == 2:
+            self.discord_description_end = "and **one** other."
+        else:
+            self.discord_description_end = "and **{}** others.".format(
+                self.alert_information['killer_count']
+            )
+
+        self.discord_description = "**{}({})** lost their **{}** to **{}({})** flying in a **{}** {}".format(
+            self.discord_description_victim_link,
+            self.alert_information['victim_group_name'],
+            self.alert_information['victim_ship_name'],
+            self.discord_description_killer_link,
+            self.alert_information['killer_group_name'],
+            self.alert_information['killer_ship_name'],
+            self.discord_description_end
+        )
+        self.human_kill_value = humanize.intword(self.alert_information['kill_zkillboard_value'])
+
+        # discord_webhook also imports asyncio, so it is left until the first alert rather than slowing startup
+        from discord_webhook import DiscordEmbed
+        self.discord_embed = DiscordEmbed(
+            title = self.discord_title,
+            description = self.discord_description,
+            url = self.alert_information['kill_zkillboard_URL']
+        )
+        self.discord_embed.set_thumbnail(url=self.alert_information['victim_ship_image_URL'])
+        self.discord_embed.set_footer(text = self.human_kill_value)
+        self.discord_embed.set_timestamp()
+
+    def variant(self, relationship: str):
+        rendered = self.variants.get(relationship)
+        if rendered is None:
+            # Anything other than a Loss is alerted as a Kill
+            color, authorName = self.relationships.get(relationship, self.relationships["Kill"])
+            embed = dict(self.discord_embed.__dict__)
+            embed['color'] = color
+            embed['author'] = {
+                "name": authorName,
+                "url": self.alert_information['kill_zkillboard_URL'],
+                "icon_url": self.alert_information['victim_group_image_URL']
+            }
+            rendered = self.variants[relationship] = RenderedEmbed(embed)
+        return rendered
+
+# Class DiscordAlert - Used to send a Discord Alert directly
+class DiscordAlert(object):
+    def __init__(self, feedData, alertData, discordWebhookStatsTracker, alertPayload=None):
+        self.feed_information = feedData
+        self.discord_webhook_stats = discordWebhookStatsTracker
+        if alertPayload is None:
+            alertPayload = AlertPayload(alertData)
+        self.rendered_embed = alertPayload.variant(self.feed_information['relationship'])
+
+    def get_embed(self):
+        return self.rendered_embed
+
+    def alert(self):
+        # Returns whether Discord accepted the alert
+        response = discordPost(self.feed_information['webhook'], [self.rendered_embed])
+        self.discord_webhook_stats.increment_execution()
+        logging.info("alert: Discord Response: " + str(response))
+        return response is not None and response.ok
+
+# Class DiscordDelivery - One queue and worker per webhook URL, honouring Discord rate limits and batching embeds when backlogged
+class DiscordDelivery(object):
+    # Discord accepts at most 10 embeds and 6000 embed characters per message
+    max_embeds = 10
+    max_embed_characters = 6000
+
+    def __init__(self, discordWebhookStatsTracker, queueSize: int = 100, maxRetries: int = 3, timeout: float = 10, session=None):
+        self.discord_webhook_stats = discordWebhookStatsTracker
+        self.queue_size = queueSize
+        self.max_retries = maxRetries
+        self.timeout = timeout
+        # Any object with a requests compatible post method may be supplied, e.g. a stub for benchmarking,
+        # otherwise webhooks are sent through the shared transport's pooled connections
+        self.session = session if session is not None else transport
+        self.headers = {"Content-Type": "application/json"}
+        self.queues = {}
+        self.workers = {}
+        self.lock = threading.Lock()
+        # Rate limit state shared between workers, webhook URL -> bucket and bucket -> monotonic time it resets
+        self.webhook_buckets = {}
+        self.bucket_blocked_until = {}
+        self.global_blocked_until = 0.0
+        logging.info("DiscordDelivery: Initialized.")
+
+    def submit(self, webhookURL: str, embed, callback=None):
+        # embed is a RenderedEmbed, callback, if given, is called with True once the alert is sent or False if it is dropped
+        with self.lock:
+            webhookQueue = self.queues.get(webhookURL)
+            if webhookQueue is None:
+                webhookQueue = queue.Queue(self.queue_size)
+                self.queues[webhookURL] = webhookQueue
+                worker = threading.Thread(target=self._worker, args=(webhookURL, webhookQueue), name="discord-" + webhookLabel(webhookURL), daemon=True)
+                self.workers[webhookURL] = worker
+                worker.start()
+        try:
+            webhookQueue.put_nowait((embed, callback))
+            return True
+        except queue.Full:
+            self.discord_webhook_stats.increment_webhook(webhookURL, 'dropped')
+            logging.error("DiscordDelivery: Queue full for webhook " + webhookLabel(webhookURL) + ", alert dropped.")
+            if callback is not None:
+                callback(False)
+            return False
+
+    def _worker(self, webhookURL: str, webhookQueue):
+        # None on the queue asks the worker to stop, pending holds an item taken from the queue but not yet sent
+        pending = []
+        while True:
+            item = pending.pop() if pending else webhookQueue.get()
+            if item is None:
+                return
+            embed, callback = item
+            embeds = [embed]
+            callbacks = [callback]
+            characters = embed.characters
+            # Coalesce any backlog into a single webhook call
+            while len(embeds) < self.max_embeds and not webhookQueue.empty():
+                nextItem = webhookQueue.get_nowait()
+                if nextItem is None or characters + nextItem[0].characters > self.max_embed_characters:
+                    pending.append(nextItem)
+                    break
+                embeds.append(nextItem[0])
+                callbacks.append(nextItem[1])
+                characters+=nextItem[0].characters
+            sent = self._send(webhookURL, embeds)
+            for callback in callbacks:
+                if callback is not None:
+                    callback(sent)
+
+    def _wait_for_rate_limit(self, webhookURL: str):
+        with self.lock:
+            blockedUntil = max(self.global_blocked_until, self.bucket_blocked_until.get(self.webhook_buckets.get(webhookURL), 0.0))
+        delay = blockedUntil - time.monotonic()
+        if delay > 0:
+            logging.info("DiscordDelivery: Waiting " + str(round(delay, 2)) + "s for rate limit on webhook " + webhookLabel(webhookURL))
+            time.sleep(delay)
+
+    def _update_rate_limit(self, webhookURL: str, response):
+        bucket = response.headers.get("X-RateLimit-Bucket", webhookURL)
+        remaining = response.headers.get("X-RateLimit-Remaining")
+        resetAfter = response.headers.get("X-RateLimit-Reset-After")
+        with self.lock:
+            self.webhook_buckets[webhookURL] = bucket
+            if remaining is not None and resetAfter is not None and int(remaining) == 0:
+                self.bucket_blocked_until[bucket] = time.monotonic() + float(resetAfter)
+
+    def _retry_after(self, response):
+        try:
+            return float(response.json()['retry_after'])
+        except (ValueError, KeyError, TypeError):
+            return float(response.headers.get("Retry-After", 1))
+
+    def _send(self, webhookURL: str, embeds):
+        # Embeds are already serialized, the message body only joins them
+        body = embedsBody(embeds)
+        attempt = 0
+        while attempt <= self.max_retries:
+            self._wait_for_rate_limit(webhookURL)
+            started = time.monotonic()
+            try:
+                response = self.session.post(webhookURL, data=body, headers=self.headers, timeout=self.timeout)
+            except requests.exceptions.RequestException:
+                metrics.inc("zkillmon_discord_responses_total", {"webhook": webhookLabel(webhookURL), "status": "error"})
+                logging.error("DiscordDelivery: Request error for webhook " + webhookLabel(webhookURL))
+                logging.exception("DiscordDelivery:")
+                attempt+=1
+                time.sleep(min(2 ** attempt, 30))
+                continue
+            self.discord_webhook_stats.observe_latency(webhookURL, time.monotonic() - started)
+            metrics.inc("zkillmon_discord_responses_total", {"webhook": webhookLabel(webhookURL), "status": response.status_code})
+            self._update_rate_limit(webhookURL, response)
+            if response.status_code in (200, 204):
+                self.discord_webhook_stats.increment_execution()
+                self.discord_webhook_stats.increment_webhook(webhookURL, 'sent', len(embeds))
+                if len(embeds) > 1:
+                    self.discord_webhook_stats.increment_webhook(webhookURL, 'batched', len(embeds))
+                logging.info("DiscordDelivery: Sent " + str(len(embeds)) + " alerts to webhook " + webhookLabel(webhookURL))
+                return True
+            elif response.status_code == 429:
+                # Rate limited retries do not count towards max_retries
+                retryAfter = self._retry_after(response)
+                self.discord_webhook_stats.increment_webhook(webhookURL, 'rate_limited')
+                logging.warning("DiscordDelivery: Rate limited on webhook " + webhookLabel(webhookURL) + ", retrying in " + str(retryAfter) + "s")
+                with self.lock:
+                    if response.headers.get("X-RateLimit-Global"):
+                        self.global_blocked_until = time.monotonic() + retryAfter
+                    else:
+                        self.bucket_blocked_until[self.webhook_buckets[webhookURL]] = time.monotonic() + retryAfter
+            elif response.status_code >= 500:
+                attempt+=1
+                logging.error("DiscordDelivery: Webhook " + webhookLabel(webhookURL) + " returned " + str(response.status_code))
+                time.sleep(min(2 ** attempt, 30))
+            else:
+                logging.error("DiscordDelivery: Webhook " + webhookLabel(webhookURL) + " returned " + str(response.status_code) + " Data: " + str(response.text))
+                break
+        self.discord_webhook_stats.increment_webhook(webhookURL, 'dropped', len(embeds))
+        logging.error("DiscordDelivery: Dropped " + str(len(embeds)) + " alerts for webhook " + webhookLabel(webhookURL))
+        return False
+
+    def close(self, timeout: float = 30):
+        # Deliver anything already queued before shutting down
+        with self.lock:
+            workers = list(self.workers.items())
+        for webhookURL, worker in workers:
+            self.queues[webhookURL].put(None)
+        deadline = time.monotonic() + timeout
+        for webhookURL, worker in workers:
+            worker.join(max(0, deadline - time.monotonic()))
+        if self.session is not transport:
+            self.session.close()
+        logging.info("DiscordDelivery: Closed")
+
+# Discord alerting function
+def discordAlert(alertData, relevantFeed, discordWebhookStatsTracker, discordDelivery=None, callback=None, alertPayload=None):
+    # alertPayload is shared between the feeds alerted for one kill so it is only rendered once.
+    # Returns whether a direct alert was sent, queued alerts report through callback once sent and always return True.
+    if alertPayload is None:
+        alertPayload = AlertPayload(alertData)
+    if discordDelivery is not None:
+        discordDelivery.submit(relevantFeed['webhook'], alertPayload.variant(relevantFeed['relationship']), callback)
+        return True
+    sent = DiscordAlert(relevantFeed, alertData, discordWebhookStatsTracker, alertPayload).alert()
+    if callback is not None:
+        callback(sent)
+    return sent
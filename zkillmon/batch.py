@@ -0,0 +1,295 @@
+# zKillboardMonitor - Columnar batch feed matching for replayed and historical killmails
+import itertools
+
+import numpy
+
+from zkillmon.killmail import Killmail
+
+# Relationship codes, a kill outranks a loss when both match the same feed
+LOSS = 1
+KILL = 2
+relationships = {LOSS: "Loss", KILL: "Kill"}
+
+def idColumn(values):
+    # Returns an int64 array of the ids and a mask of those present, missing ids are stored as 0
+    present = numpy.fromiter((isinstance(value, int) for value in values), dtype=bool, count=len(values))
+    column = numpy.fromiter((value if isinstance(value, int) else 0 for value in values), dtype=numpy.int64, count=len(values))
+    return column, present
+
+def lookupTable(index):
+    # Compiles a FeedIndex hash index of id -> feed positions into sorted keys with feed positions in CSR layout
+    keys = sorted(key for key in index if isinstance(key, int))
+    offsets = numpy.zeros(len(keys) + 1, dtype=numpy.int64)
+    offsets[1:] = numpy.cumsum([len(index[key]) for key in keys])
+    positions = numpy.fromiter(itertools.chain.from_iterable(index[key] for key in keys), dtype=numpy.int64, count=int(offsets[-1]))
+    return numpy.array(keys, dtype=numpy.int64), offsets, positions
+
+# Class KillBatch - A block of killmails as columnar arrays, attacker ids in CSR layout and labels as bitsets
+class KillBatch(object):
+    def __init__(self, killmails, entityTypes, labels, locations: bool = False, locationsForPods: bool = False, esiLookup=None):
+        self.killmails = killmails
+        self.size = len(killmails)
+        self.system_ids = numpy.fromiter((killmail.system_id for killmail in killmails), dtype=numpy.int64, count=self.size)
+        self.total_values = numpy.fromiter((killmail.total_value for killmail in killmails), dtype=numpy.float64, count=self.size)
+        self.attacker_counts = numpy.fromiter((len(killmail.kill_raw_data['attackers']) for killmail in killmails), dtype=numpy.int64, count=self.size)
+        self.solo = numpy.fromiter((bool(killmail.kill_zkill_data.get('solo', False)) for killmail in killmails), dtype=bool, count=self.size)
+        self.victim_ship_type_ids = numpy.fromiter((killmail.victim_ship_type_id for killmail in killmails), dtype=numpy.int64, count=self.size)
+        self.empty_pods = numpy.fromiter((killmail.is_empty_pod() for killmail in killmails), dtype=bool, count=self.size)
+        # Entity type -> (ids, present) for the victims and (offsets, ids, rows) for the distinct attacker ids of each kill
+        self.victim_ids = {}
+        self.attacker_ids = {}
+        for entityType in entityTypes:
+            self.victim_ids[entityType] = idColumn([self._victim_id(killmail, entityType) for killmail in killmails])
+            attackerIDs = [self._attacker_ids(killmail, entityType) for killmail in killmails]
+            counts = numpy.fromiter((len(entityIDs) for entityIDs in attackerIDs), dtype=numpy.int64, count=self.size)
+            offsets = numpy.zeros(self.size + 1, dtype=numpy.int64)
+            numpy.cumsum(counts, out=offsets[1:])
+            flat = numpy.fromiter(itertools.chain.from_iterable(attackerIDs), dtype=numpy.int64, count=int(offsets[-1]))
+            self.attacker_ids[entityType] = (offsets, flat, numpy.repeat(numpy.arange(self.size), counts))
+        # One bit per label named by a feed, in words of 64
+        self.label_bits = {label: bit for bit, label in enumerate(labels)}
+        self.labels = numpy.zeros((self.size, (len(labels) + 63) // 64), dtype=numpy.uint64)
+        for row, killmail in enumerate(killmails):
+            for label in killmail.labels:
+                bit = self.label_bits.get(label)
+                if bit is not None:
+                    self.labels[row, bit // 64]|=numpy.uint64(1 << (bit % 64))
+        # Constellations and regions are only resolved for the kills FeedIndex.match would resolve them for
+        self.constellation_ids = self.region_ids = None
+        if locations:
+            constellationIDs = []
+            regionIDs = []
+            for row, killmail in enumerate(killmails):
+                if not self.empty_pods[row] or locationsForPods:
+                    killmail.get_location_data(esiLookup)
+                    constellationIDs.append(killmail.kill_location_data['locationConstellationID'])
+                    regionIDs.append(killmail.kill_location_data['locationRegionID'])
+                else:
+                    constellationIDs.append(None)
+                    regionIDs.append(None)
+            self.constellation_ids = idColumn(constellationIDs)
+            self.region_ids = idColumn(regionIDs)
+
+    @staticmethod
+    def _victim_id(killmail, entityType: str):
+        if entityType in killmail.victim_ids:
+            return killmail.victim_ids[entityType]
+        return killmail.kill_raw_data['victim'].get(entityType)
+
+    @staticmethod
+    def _attacker_ids(killmail, entityType: str):
+        attackerIDs = killmail.attacker_ids.get(entityType)
+        if attackerIDs is not None:
+            return attackerIDs
+        attackerIDs = {attacker.get(entityType) for attacker in killmail.kill_raw_data['attackers']}
+        return [entityID for entityID in attackerIDs if isinstance(entityID, int)]
+
+    def victim_is(self, entityType: str, entityID: int):
+        victimIDs, present = self.victim_ids[entityType]
+        return present & (victimIDs == entityID)
+
+    def attacker_is(self, entityType: str, entityID: int):
+        offsets, flat, rows = self.attacker_ids[entityType]
+        mask = numpy.zeros(self.size, dtype=bool)
+        mask[rows[flat == entityID]] = True
+        return mask
+
+    def has_label(self, label: str):
+        bit = self.label_bits[label]
+        return (self.labels[:, bit // 64] & numpy.uint64(1 << (bit % 64))) != 0
+
+# Class BatchFeedMatcher - Matches blocks of killmails against a FeedIndex with array set membership and bitmask operations
+class BatchFeedMatcher(object):
+    # Filter conditions evaluated as arrays, any other condition needs ESI or the universe map and is matched per kill
+    vectorized_conditions = {"all", "any", "not", "entity", "location", "label", "value", "attackers", "solo", "victim_ship_type"}
+
+    def __init__(self, feedIndex):
+        self.feed_index = feedIndex
+        self.feeds = feedIndex.feeds
+        self.entity_tables = {entityType: lookupTable(entityIndex) for entityType, entityIndex in feedIndex.entity_index.items()}
+        self.system_table = lookupTable(feedIndex.system_index)
+        self.constellation_table = lookupTable(feedIndex.constellation_index)
+        self.region_table = lookupTable(feedIndex.region_index)
+        self.label_positions = {label: numpy.array(positions, dtype=numpy.int64) for label, positions in feedIndex.label_index.items()}
+        self.pod_excluded = numpy.zeros(len(self.feeds), dtype=bool)
+        self.pod_excluded[list(feedIndex.pod_excluded)] = True
+        # Feed position -> number of its webhook
+        webhooks = {}
+        self.webhook_numbers = numpy.array([webhooks.setdefault(feed['webhook'], len(webhooks)) for feed in self.feeds], dtype=numpy.int64)
+        self.entity_types = set(feedIndex.entity_index)
+        self.labels = set(feedIndex.label_index)
+        # (position, FeedFilter) split into filters evaluated as arrays and those evaluated per kill
+        self.vectorized_filters = []
+        self.scalar_filters = []
+        for position, feedFilter in feedIndex.filter_feeds:
+            if self._vectorizable(self.feeds[position]['filter']):
+                self.vectorized_filters.append((position, feedFilter))
+            else:
+                self.scalar_filters.append((position, feedFilter))
+
+    def _vectorizable(self, node):
+        # Records the entity types and labels a filter reads, as a side effect
+        operator, value = next(iter(node.items()))
+        if operator not in self.vectorized_conditions:
+            return False
+        match operator:
+            case "all" | "any":
+                return all([self._vectorizable(child) for child in value])
+            case "not":
+                return self._vectorizable(value)
+            case "entity":
+                self.entity_types.add(value['entity_type'])
+            case "location":
+                return value['location_type'] == "system_id"
+            case "label":
+                self.labels.add(value)
+        return True
+
+    def batch(self, killmails, esiLookup):
+        return KillBatch(
+            killmails,
+            sorted(self.entity_types),
+            sorted(self.labels),
+            self.feed_index.location_lookup_required,
+            self.feed_index.location_lookup_required_for_pods,
+            esiLookup
+        )
+
+    @staticmethod
+    def _expand(rows, values, table):
+        # Returns the (row, feed position) pairs of every value found in a lookup table
+        keys, offsets, positions = table
+        if not len(keys) or not len(rows):
+            return rows[:0], rows[:0]
+        indexes = numpy.searchsorted(keys, values)
+        indexes[indexes == len(keys)] = 0
+        found = keys[indexes] == values
+        rows = rows[found]
+        indexes = indexes[found]
+        counts = offsets[indexes + 1] - offsets[indexes]
+        starts = numpy.repeat(offsets[indexes] - numpy.cumsum(counts) + counts, counts)
+        return numpy.repeat(rows, counts), positions[starts + numpy.arange(int(counts.sum()))]
+
+    def _mask(self, killBatch, node):
+        operator, value = next(iter(node.items()))
+        match operator:
+            case "all":
+                return numpy.logical_and.reduce([self._mask(killBatch, child) for child in value])
+            case "any":
+                return numpy.logical_or.reduce([self._mask(killBatch, child) for child in value])
+            case "not":
+                return ~self._mask(killBatch, value)
+            case "entity":
+                role = value.get('role')
+                mask = numpy.zeros(killBatch.size, dtype=bool)
+                if role != "attacker":
+                    mask|=killBatch.victim_is(value['entity_type'], value['entity_id'])
+                if role != "victim":
+                    mask|=killBatch.attacker_is(value['entity_type'], value['entity_id'])
+                return mask
+            case "location":
+                return killBatch.system_ids == value['location_id']
+            case "label":
+                return killBatch.has_label(value)
+            case "value":
+                return (value.get('min', float("-inf")) <= killBatch.total_values) & (killBatch.total_values <= value.get('max', float("inf")))
+            case "attackers":
+                return (value.get('min', float("-inf")) <= killBatch.attacker_counts) & (killBatch.attacker_counts <= value.get('max', float("inf")))
+            case "solo":
+                return killBatch.solo == value
+            case "victim_ship_type":
+                return numpy.isin(killBatch.victim_ship_type_ids, value)
+
+    def _filter_relationships(self, killBatch, feedFilter, matched):
+        # As FeedFilter.relationship, a loss when a filtered entity is the victim and none is among the attackers
+        attacker = numpy.zeros(killBatch.size, dtype=bool)
+        victim = numpy.zeros(killBatch.size, dtype=bool)
+        for entityType, entityID, role in feedFilter.entities:
+            if role != "victim":
+                attacker|=killBatch.attacker_is(entityType, entityID)
+            if role != "attacker":
+                victim|=killBatch.victim_is(entityType, entityID)
+        return numpy.where(matched & victim & ~attacker, LOSS, KILL)[matched]
+
+    def match_batch(self, killBatch, esiLookup):
+        # Returns (row, feed position, relationship code) arrays sorted by row then feed position, as FeedIndex.match for each kill
+        allRows = numpy.arange(killBatch.size)
+        pairs = []
+        for entityType, table in self.entity_tables.items():
+            victimIDs, present = killBatch.victim_ids[entityType]
+            rows, positions = self._expand(allRows[present], victimIDs[present], table)
+            pairs.append((rows, positions, LOSS))
+            offsets, flat, attackerRows = killBatch.attacker_ids[entityType]
+            rows, positions = self._expand(attackerRows, flat, table)
+            pairs.append((rows, positions, KILL))
+        pairs.append(self._expand(allRows, killBatch.system_ids, self.system_table) + (KILL,))
+        if killBatch.constellation_ids is not None:
+            for locationIDs, table in ((killBatch.constellation_ids, self.constellation_table), (killBatch.region_ids, self.region_table)):
+                locationIDs, present = locationIDs
+                pairs.append(self._expand(allRows[present], locationIDs[present], table) + (KILL,))
+        for label, positions in self.label_positions.items():
+            rows = numpy.flatnonzero(killBatch.has_label(label))
+            pairs.append((numpy.repeat(rows, len(positions)), numpy.tile(positions, len(rows)), KILL))
+        for position, feedFilter in self.vectorized_filters:
+            matched = self._mask(killBatch, self.feeds[position]['filter'])
+            rows = numpy.flatnonzero(matched)
+            pairs.append((rows, numpy.full(len(rows), position), self._filter_relationships(killBatch, feedFilter, matched)))
+        for position, feedFilter in self.scalar_filters:
+            rows = []
+            codes = []
+            for row, killmail in enumerate(killBatch.killmails):
+                if killBatch.empty_pods[row] and self.pod_excluded[position]:
+                    continue
+                relationship = feedFilter.relationship(killmail, esiLookup)
+                if relationship != "None":
+                    rows.append(row)
+                    codes.append(LOSS if relationship == "Loss" else KILL)
+            pairs.append((numpy.array(rows, dtype=numpy.int64), numpy.full(len(rows), position), numpy.array(codes, dtype=numpy.int64)))
+
+        rows = numpy.concatenate([rows for rows, positions, codes in pairs])
+        positions = numpy.concatenate([positions for rows, positions, codes in pairs])
+        codes = numpy.concatenate([numpy.broadcast_to(codes, len(rows)) for rows, positions, codes in pairs])
+        # Empty pods are dropped from feeds excluding them, then one pair is kept per kill and feed, a kill over a loss
+        keep = ~(killBatch.empty_pods[rows] & self.pod_excluded[positions])
+        rows, positions, codes = rows[keep], positions[keep], codes[keep]
+        order = numpy.lexsort((codes, positions, rows))
+        rows, positions, codes = rows[order], positions[order], codes[order]
+        last = numpy.ones(len(rows), dtype=bool)
+        last[:-1] = (rows[1:] != rows[:-1]) | (positions[1:] != positions[:-1])
+        return rows[last], positions[last], codes[last]
+
+    def match(self, killmails, esiLookup):
+        # Returns a list of (killmail, feed position, relationship) triples for the block
+        rows, positions, codes = self.match_batch(self.batch(killmails, esiLookup), esiLookup)
+        return [(killmails[row], position, relationships[code]) for row, position, code in zip(rows.tolist(), positions.tolist(), codes.tolist())]
+
+    def add_relevant_feeds(self, killmails, esiLookup):
+        # Batch equivalent of Killmail.add_relevant_feeds, returns the relevant killmails in order.
+        # Only the first matching feed per webhook is applied to each kill, the rest would be discarded as duplicates.
+        rows, positions, codes = self.match_batch(self.batch(killmails, esiLookup), esiLookup)
+        webhookKeys = rows * len(self.webhook_numbers) + self.webhook_numbers[positions]
+        first = numpy.sort(numpy.unique(webhookKeys, return_index=True)[1])
+        rows, positions, codes = rows[first].tolist(), positions[first].tolist(), codes[first].tolist()
+        relevant = []
+        start = 0
+        while start < len(rows):
+            row = rows[start]
+            end = start + 1
+            while end < len(rows) and rows[end] == row:
+                end+=1
+            killmail = killmails[row]
+            killmail.add_matched_feeds(self.feeds, zip(positions[start:end], [relationships[code] for code in codes[start:end]]))
+            relevant.append(killmail)
+            start = end
+        return relevant
+
+# Iterates killmails in blocks of batchSize
+def killmailBlocks(responses, batchSize: int):
+    block = []
+    for responseJson in responses:
+        block.append(Killmail(responseJson))
+        if len(block) >= batchSize:
+            yield block
+            block = []
+    if block:
+        yield block
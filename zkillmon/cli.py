@@ -0,0 +1,365 @@
+# zKillboardMonitor - Command line entry point
+import argparse
+import logging
+import os
+import sys
+import time
+
+from zkillmon.configuration import ConfigurationReloader, configurationFilePath, configureLogging, loadConfig, loglevel, readConfig
+from zkillmon.feeds import FeedIndex
+
+# Class StartupTimer - Time taken by each startup stage, reported before the first poll as RedisQ only holds our queue for a limited time
+class StartupTimer(object):
+    def __init__(self, started: float = None):
+        self.started = started if started is not None else time.monotonic()
+        self.last = self.started
+        self.statistics = {}
+
+    def mark(self, stage: str):
+        # Records the time since the previous mark against stage
+        now = time.monotonic()
+        self.statistics[stage] = now - self.last
+        self.last = now
+
+    def get_statistics(self):
+        return self.statistics
+
+    def get_statistics_line(self):
+        stages = ", ".join("{}: {:.1f}ms".format(stage, seconds * 1000) for stage, seconds in self.statistics.items())
+        return "{:.1f}ms ({})".format((self.last - self.started) * 1000, stages)
+
+def checkConfiguration(configurationFilePath):
+    # Validate the configuration and compile its feeds without network or ESI cache access, returns the exit status
+    started = time.perf_counter()
+    try:
+        configuration = readConfig(configurationFilePath)
+        FeedIndex(configuration['feeds'])
+    except Exception as e:
+        print(configurationFilePath + ": " + str(e))
+        return 1
+    print("{}: OK, {} feeds compiled in {:.1f}ms".format(configurationFilePath, len(configuration['feeds']), (time.perf_counter() - started) * 1000))
+    return 0
+
+def main(started: float = None):
+    # started is when the process began importing, so the timings include module imports
+    startupTimer = StartupTimer(started)
+    # Command line arguments
+    argumentParser = argparse.ArgumentParser(description="zKillboardMonitor")
+    argumentParser.add_argument("--async", dest="async_mode", action="store_true", help="Run the asyncio pipeline instead of the synchronous poll loop")
+    argumentParser.add_argument("--import-universe", choices=["esi", "sde"], help="Build the static universe map from ESI or an SDE CSV dump then exit")
+    argumentParser.add_argument("--sde-path", default=".", help="Directory containing the SDE mapSolarSystems.csv, mapConstellations.csv and mapRegions.csv")
+    argumentParser.add_argument("--warm-cache", action="store_true", help="Fill the ESI cache with feed entities and locations, ship types and factions then exit")
+    argumentParser.add_argument("--warm-recording", action="append", default=[], help="Also fill the ESI cache with the IDs in a recorded JSONL kill stream, may be repeated")
+    argumentParser.add_argument("--warm-workers", type=int, default=8, help="Concurrent ESI lookups while warming the cache")
+    argumentParser.add_argument("--export-cache", help="Write a snapshot of the ESI cache to this file then exit")
+    argumentParser.add_argument("--import-cache", help="Merge a snapshot of the ESI cache from this file then exit")
+    argumentParser.add_argument("--history-query", metavar="FEED", help="List the kills in the history the named feed matches then exit")
+    argumentParser.add_argument("--backfill", metavar="FEED", help="Send alerts for the kills in the history the named feed matches then exit")
+    argumentParser.add_argument("--hours", type=float, default=1, help="Hours of history searched by --history-query and --backfill")
+    argumentParser.add_argument("--check-config", action="store_true", help="Validate the configuration and compile its feeds then exit, without network or database access")
+    argumentParser.add_argument("--config", default=configurationFilePath, help="Configuration file to use")
+    arguments = argumentParser.parse_args()
+
+    if arguments.check_config:
+        sys.exit(checkConfiguration(arguments.config))
+
+    # Modules needed by only some modes are imported where they are used
+    from zkillmon.alerts import DiscordDelivery, DiscordWebhookStatsTracker
+    from zkillmon.esi import ESICacheDatabase, ESILookup, ESIMemoryCache
+    from zkillmon.metrics import MetricsServer, metrics
+    from zkillmon.processor import KillmailProcessor
+    from zkillmon.sources import KillmailStream, Poller, ZKillboardWebsocket
+    from zkillmon.transport import transport
+    startupTimer.mark("imports")
+
+    # Configure Logging
+    configureLogging(loglevel)
+    logging.info("main: Logging Initialized")
+
+    # Load Configuration
+    configuration = loadConfig(arguments.config)
+    startupTimer.mark("configuration")
+
+    # Set some vars for later use
+    version = configuration['application']['version']
+    logging.info("main: zKillboardMonitor Version: " + str(version))
+
+    applicationIdentity = configuration['application']['name'] + "/" + configuration['application']['version'] + "by " + configuration['application']['author']
+
+    # Shared HTTP transport, discord.pool_size sizes the Discord pool unless the transport section sets it
+    hostPolicies = {"discord.com": {"pool_size": configuration.get('discord', {}).get('pool_size', 10)}}
+    for host, policy in configuration.get('transport', {}).get('hosts', {}).items():
+        hostPolicies.setdefault(host, {}).update(policy)
+    transport.configure(hostPolicies)
+
+    # Create required objects
+    zkillboardConfiguration = configuration['zkillboard']
+    redisqURLs = [zkillboardConfiguration['redisq_url']] + zkillboardConfiguration.get('redisq_urls', [])
+    idleBackoffMax = zkillboardConfiguration.get('idle_backoff_max', 10)
+    if len(redisqURLs) == 1 and zkillboardConfiguration.get('websocket_url') is None:
+        poller = Poller(redisqURLs[0], zkillboardConfiguration.get('record_path'), idleBackoffMax)
+    else:
+        # Several sources are merged into one stream, each kill is only processed the first time it is seen
+        sources = [Poller(redisqURL, None, idleBackoffMax) for redisqURL in redisqURLs]
+        if zkillboardConfiguration.get('websocket_url') is not None:
+            sources.append(ZKillboardWebsocket(zkillboardConfiguration['websocket_url']))
+        poller = KillmailStream(sources, zkillboardConfiguration.get('dedup_window', 10000), zkillboardConfiguration.get('record_path'))
+    discordWebhookStatsTracker = DiscordWebhookStatsTracker()
+    startupTimer.mark("sources")
+    esiCacheDatabase = ESICacheDatabase(
+        configuration['esicachedb']['cache_db_path'],
+        configuration['esicachedb'].get('write_batch_size', 50),
+        configuration['esicachedb'].get('write_flush_interval', 5),
+        configuration['esicachedb'].get('max_db_entries', 500000)
+    )
+    esiMemoryCache = ESIMemoryCache(
+        esiCacheDatabase,
+        configuration['esicachedb'].get('memory_cache_entries', 10000),
+        configuration['esicachedb'].get('memory_cache_ttl', {})
+    )
+    esiMemoryCache.warm()
+    esiLookup = ESILookup(
+        configuration['eveesi']['esi_url'],
+        configuration['eveesi']['esi_datasource'],
+        applicationIdentity,
+        esiMemoryCache,
+        configuration['eveesi'].get('negative_cache_ttl', 300),
+        configuration['eveesi'].get('circuit_failure_threshold', 5),
+        configuration['eveesi'].get('circuit_reset_timeout', 30),
+        configuration['eveesi'].get('placeholder_names', True),
+        configuration['eveesi'].get('min_ttl', 3600)
+    )
+    startupTimer.mark("esi_cache")
+
+    # Static universe map
+    universeConfiguration = configuration.get('universe', {})
+    universeMapPath = universeConfiguration.get('map_path')
+    if arguments.import_universe is not None:
+        from zkillmon.universe import UniverseMap
+        if universeMapPath is None:
+            logging.critical("main: universe.map_path must be set to import the universe map")
+            sys.exit(1)
+        if arguments.import_universe == "sde":
+            universeMap = UniverseMap.import_sde(arguments.sde_path)
+        else:
+            universeMap = UniverseMap.import_esi(esiLookup)
+        universeMap.save(universeMapPath)
+        esiCacheDatabase.close()
+        sys.exit(0)
+    if universeMapPath is not None and os.path.exists(universeMapPath):
+        from zkillmon.universe import UniverseMap
+        esiLookup.universe_map = UniverseMap.load(universeMapPath)
+    else:
+        logging.warning("main: No universe map loaded, location data will be looked up through ESI")
+    startupTimer.mark("universe_map")
+
+    # ESI cache maintenance
+    if arguments.import_cache is not None or arguments.warm_cache or arguments.warm_recording or arguments.export_cache is not None:
+        if arguments.import_cache is not None:
+            esiCacheDatabase.import_snapshot(arguments.import_cache)
+        if arguments.warm_cache or arguments.warm_recording:
+            from zkillmon.warming import CacheWarmer
+            started = time.monotonic()
+            cacheWarmer = CacheWarmer(esiLookup, arguments.warm_workers)
+            queries = set()
+            if arguments.warm_cache:
+                cacheWarmer.warm_factions()
+                cacheWarmer.warm_ship_types()
+                queries.update(cacheWarmer.feed_queries(configuration['feeds']))
+            for recordPath in arguments.warm_recording:
+                queries.update(cacheWarmer.recording_queries(recordPath))
+            cacheWarmer.warm(queries)
+            logging.info("main: Cache warmed in " + str(round(time.monotonic() - started, 1)) + "s: " + str(cacheWarmer.get_statistics()) + " ESI: " + str(esiLookup.get_statistics()))
+        if arguments.export_cache is not None:
+            esiCacheDatabase.export_snapshot(arguments.export_cache)
+        esiCacheDatabase.close()
+        sys.exit(0)
+    pipelineConfiguration = configuration.get('pipeline', {})
+    feedShards = pipelineConfiguration.get('feed_shards', 0)
+    if feedShards > 1:
+        from zkillmon.sharding import ShardedFeedIndex
+        feedIndexFactory = lambda feeds: ShardedFeedIndex(feeds, feedShards)
+    else:
+        feedIndexFactory = FeedIndex
+    feedIndex = feedIndexFactory(configuration['feeds'])
+    startupTimer.mark("feeds")
+    discordDelivery = None
+    discordConfiguration = configuration.get('discord', {})
+    if discordConfiguration.get('queued_delivery', True):
+        discordDelivery = DiscordDelivery(
+            discordWebhookStatsTracker,
+            discordConfiguration.get('queue_size', 100),
+            discordConfiguration.get('max_retries', 3),
+            discordConfiguration.get('timeout', 10)
+        )
+    killmailHistory = None
+    historyConfiguration = configuration.get('history', {})
+    if historyConfiguration.get('history_path') is not None:
+        from zkillmon.history import KillmailHistory
+        killmailHistory = KillmailHistory(
+            historyConfiguration['history_path'],
+            historyConfiguration.get('retention_hours', 72),
+            historyConfiguration.get('write_batch_size', 100),
+            historyConfiguration.get('write_flush_interval', 5),
+            historyConfiguration.get('compact_interval', 3600),
+            historyConfiguration.get('queue_size', 10000)
+        )
+
+    # Killmail history queries
+    if arguments.history_query is not None or arguments.backfill is not None:
+        if killmailHistory is None:
+            logging.critical("main: history.history_path must be set to query the killmail history")
+            sys.exit(1)
+        feedName = arguments.history_query if arguments.history_query is not None else arguments.backfill
+        feeds = [feed for feed in configuration['feeds'] if feed['name'] == feedName]
+        if not feeds:
+            logging.critical("main: No feed named " + feedName)
+            sys.exit(1)
+        queryStarted = time.monotonic()
+        backfillProcessor = KillmailProcessor(FeedIndex(feeds), esiLookup, discordWebhookStatsTracker, discordDelivery)
+        matched = 0
+        for killmail in killmailHistory.matches(backfillProcessor.feed_index, time.time() - arguments.hours * 3600, esiLookup):
+            matched+=1
+            if arguments.backfill is not None:
+                killmail.get_additional_data(esiLookup)
+                backfillProcessor.deliver(killmail)
+            else:
+                print("{} {} {:>18,.0f} {:<4} https://zkillboard.com/kill/{}/".format(
+                    killmail.kill_id,
+                    killmail.kill_raw_data['killmail_time'],
+                    killmail.total_value,
+                    killmail.get_relevant_feed_information()[0]['relationship'],
+                    killmail.kill_id
+                ))
+        logging.info("main: " + str(matched) + " kills in the last " + str(arguments.hours) + " hours matched " + feedName + " in " + str(round(time.monotonic() - queryStarted, 2)) + "s")
+        backfillProcessor.close()
+        if discordDelivery is not None:
+            discordDelivery.close()
+        killmailHistory.close()
+        esiCacheDatabase.close()
+        sys.exit(0)
+    killmailSpool = None
+    spoolConfiguration = configuration.get('spool', {})
+    if spoolConfiguration.get('spool_path') is not None:
+        from zkillmon.spool import KillmailSpool
+        killmailSpool = KillmailSpool(
+            spoolConfiguration['spool_path'],
+            spoolConfiguration.get('max_pending', 10000),
+            spoolConfiguration.get('max_attempts', 5),
+            spoolConfiguration.get('compact_interval', 300)
+        )
+    esiPrefetcher = None
+    prefetchConfiguration = configuration.get('prefetch', {})
+    if prefetchConfiguration.get('calls_per_minute', 0) > 0:
+        from zkillmon.prefetch import ESIPrefetcher
+        esiPrefetcher = ESIPrefetcher(
+            esiLookup,
+            prefetchConfiguration.get('calls_per_minute', 0),
+            prefetchConfiguration.get('max_recent', 2000)
+        )
+        esiPrefetcher.prefetch_feeds(configuration['feeds'])
+        poller.on_idle = esiPrefetcher.idle
+    killmailProcessor = KillmailProcessor(feedIndex, esiLookup, discordWebhookStatsTracker, discordDelivery, killmailSpool, killmailHistory, esiPrefetcher)
+    configurationReloader = ConfigurationReloader(
+        arguments.config,
+        configuration,
+        killmailProcessor,
+        configuration.get('reload', {}).get('watch_interval', 30),
+        feedIndexFactory
+    )
+    configurationReloader.start()
+    startupTimer.mark("pipeline")
+
+    # Select the pipeline mode, the synchronous pipeline remains the default
+    pipelineMode = "async" if arguments.async_mode else pipelineConfiguration.get('mode', "sync")
+    pipeline = None
+    if pipelineMode == "async":
+        from zkillmon.pipeline import AsyncPipeline
+        pipeline = AsyncPipeline(
+            poller,
+            killmailProcessor,
+            pipelineConfiguration.get('enrichment_workers', 4),
+            pipelineConfiguration.get('delivery_workers', 1),
+            pipelineConfiguration.get('ingest_queue_size', 100),
+            pipelineConfiguration.get('delivery_queue_size', 100),
+            pipelineConfiguration.get('backpressure', "block"),
+            pipelineConfiguration.get('stats_interval', 300)
+        )
+
+    # Optional Prometheus metrics endpoint, statistics held by other objects are exposed as gauges
+    metricsServer = None
+    metricsConfiguration = configuration.get('metrics', {})
+    if metricsConfiguration.get('enabled', False):
+        metrics.register_collector(lambda: [("zkillmon_esi_memory_cache", {"counter": key}, value) for key, value in esiMemoryCache.get_statistics().items()])
+        metrics.register_collector(lambda: [("zkillmon_esi_cache_database", {"counter": key}, value) for key, value in esiCacheDatabase.get_statistics().items()])
+        metrics.register_collector(lambda: [("zkillmon_configuration", {"counter": key}, value) for key, value in configurationReloader.get_statistics().items()])
+        metrics.register_collector(lambda: [("zkillmon_digest", {"counter": key}, value) for key, value in killmailProcessor.digest.get_statistics().items()])
+        if killmailSpool is not None:
+            metrics.register_collector(lambda: [("zkillmon_spool", {"counter": key}, value) for key, value in killmailSpool.get_statistics().items()])
+        if killmailHistory is not None:
+            metrics.register_collector(lambda: [("zkillmon_history", {"counter": key}, value) for key, value in killmailHistory.get_statistics().items()])
+        metrics.register_collector(lambda: [("zkillmon_http", {"host": host, "counter": key}, value) for host, hostStatistics in list(transport.get_statistics().items()) for key, value in hostStatistics.items()])
+        if esiPrefetcher is not None:
+            metrics.register_collector(lambda: [("zkillmon_esi_prefetch", {"counter": key}, value) for key, value in esiPrefetcher.get_statistics().items()])
+        if pipeline is not None:
+            metrics.register_collector(lambda: [("zkillmon_pipeline", {"statistic": key}, value) for key, value in pipeline.get_statistics().items()])
+        metrics.register_collector(lambda: [("zkillmon_startup_seconds", {"stage": stage}, seconds) for stage, seconds in startupTimer.get_statistics().items()])
+        metricsServer = MetricsServer(metrics, metricsConfiguration.get('host', "127.0.0.1"), metricsConfiguration.get('port', 9150))
+        metricsServer.start()
+    startupTimer.mark("metrics")
+
+    # Try to run the poller
+    try:
+        if pipeline is not None:
+            logging.info("main: Startup took " + startupTimer.get_statistics_line())
+            pipeline.run()
+        else:
+            for sequence, response in killmailProcessor.recover():
+                killmailProcessor.process(response, sequence)
+            startupTimer.mark("recovery")
+            logging.info("main: Startup took " + startupTimer.get_statistics_line())
+            for response in poller.run():
+                killmailProcessor.process(response)
+    except (KeyboardInterrupt, Exception) as e:
+        if not isinstance(e, KeyboardInterrupt):
+            logging.error(str(e))
+        poller.exit_gracefully()
+
+    configurationReloader.stop()
+    if metricsServer is not None:
+        metricsServer.stop()
+    # Digests are flushed before delivery closes so they are still sent
+    killmailProcessor.close()
+    if discordDelivery is not None:
+        discordDelivery.close()
+    if killmailSpool is not None:
+        killmailSpool.close()
+    if killmailHistory is not None:
+        killmailHistory.close()
+    if esiPrefetcher is not None:
+        esiPrefetcher.close()
+    if hasattr(killmailProcessor.feed_index, 'close'):
+        killmailProcessor.feed_index.close()
+
+    killmailsProcessed = poller.get_statistics()['killmails_recieved']
+    discordAlertsSent = discordWebhookStatsTracker.get_statistics()['execution_count']
+    esiLookups = esiLookup.get_statistics()['query_count']
+    cacheHits = esiLookup.get_statistics()['cache_hit']
+    cacheMisses = esiLookup.get_statistics()['cache_miss']
+    memoryCacheHits = esiMemoryCache.get_statistics()['memory_hit']
+    memoryCacheEvictions = esiMemoryCache.get_statistics()['memory_eviction']
+    statistics = "Killmails: {}, Alerts: {}, ESI Lookups: {}, Cache Hits: {}, Cache Misses: {}, Memory Cache Hits: {}, Memory Cache Evictions: {}".format(killmailsProcessed,discordAlertsSent,esiLookups,cacheHits,cacheMisses,memoryCacheHits,memoryCacheEvictions)
+    esiCacheDatabase.close()
+    transport.close()
+    logging.info("main: Application Exiting. Statistics: " + statistics)
+    if pipeline is not None:
+        logging.info("main: Pipeline Statistics: " + pipeline.get_statistics_line())
+    for webhookID, webhookStatistics in discordWebhookStatsTracker.get_webhook_statistics().items():
+        logging.info("main: Webhook {} Statistics: Sent: {}, Batched: {}, Rate Limited: {}, Dropped: {}".format(
+            webhookID,
+            webhookStatistics['sent'],
+            webhookStatistics['batched'],
+            webhookStatistics['rate_limited'],
+            webhookStatistics['dropped']
+        ))
+
@@ -0,0 +1,234 @@
+# zKillboardMonitor - Configuration loading, validation and reloading
+import os
+import json
+import logging
+import signal
+import threading
+
+from zkillmon.feeds import FeedFilter, FeedIndex
+
+# Configurables
+configurationFilePath = "configuration.json"
+loglevel = "INFO"
+# End Configurables
+
+def readConfig(configurationFilePath):
+    # Read and validate the configuration file, raises an exception describing the problem if it is not usable
+    with open(configurationFilePath) as f:
+        configuration = json.load(f)
+    errors = validateConfiguration(configuration)
+    if errors:
+        raise Exception("Invalid configuration: " + "; ".join(errors))
+    return configuration
+
+def validateConfiguration(configuration):
+    # Returns a list of problems with the configuration, empty if it is valid
+    errors = []
+    if not isinstance(configuration, dict):
+        return ["configuration must be a JSON object"]
+    requiredSections = {
+        'application': ['version', 'name', 'author'],
+        'zkillboard': ['redisq_url'],
+        'eveesi': ['esi_url', 'esi_datasource'],
+        'esicachedb': ['cache_db_path']
+    }
+    for section, keys in requiredSections.items():
+        if not isinstance(configuration.get(section), dict):
+            errors.append("missing section " + section)
+            continue
+        for key in keys:
+            if key not in configuration[section]:
+                errors.append("missing " + section + "." + key)
+    redisqURLs = configuration.get('zkillboard', {}).get('redisq_urls', []) if isinstance(configuration.get('zkillboard'), dict) else []
+    if not isinstance(redisqURLs, list) or not all(isinstance(redisqURL, str) for redisqURL in redisqURLs):
+        errors.append("zkillboard.redisq_urls must be a list of URLs")
+    feeds = configuration.get('feeds')
+    if not isinstance(feeds, list):
+        errors.append("feeds must be a list")
+        return errors
+    for number, feed in enumerate(feeds):
+        errors.extend(validateFeed(feed, number))
+    return errors
+
+def validateFeed(feed, number: int):
+    if not isinstance(feed, dict):
+        return ["feed " + str(number) + " must be a JSON object"]
+    errors = []
+    feedName = "feed " + str(number) + " (" + str(feed.get('name')) + ")"
+    if not isinstance(feed.get('name'), str):
+        errors.append(feedName + ": name must be a string")
+    if not isinstance(feed.get('webhook'), str):
+        errors.append(feedName + ": webhook must be a string")
+    if not isinstance(feed.get('include_empty_pods'), bool):
+        errors.append(feedName + ": include_empty_pods must be true or false")
+    match feed.get('feed_type'):
+        case "entity":
+            entity = feed.get('entity')
+            if not isinstance(entity, dict) or not isinstance(entity.get('entity_type'), str) or not isinstance(entity.get('entity_id'), int):
+                errors.append(feedName + ": entity feeds require entity.entity_type and an integer entity.entity_id")
+        case "location":
+            location = feed.get('location')
+            if not isinstance(location, dict) or location.get('location_type') not in ("system_id", "constellation_id", "region_id") or not isinstance(location.get('location_id'), int):
+                errors.append(feedName + ": location feeds require location.location_type of [system_id, constellation_id, region_id] and an integer location.location_id")
+        case "label":
+            label = feed.get('label')
+            if not isinstance(label, dict) or not isinstance(label.get('zkb_label'), str):
+                errors.append(feedName + ": label feeds require label.zkb_label")
+        case "filter":
+            try:
+                FeedFilter(feed.get('filter'))
+            except ValueError as e:
+                errors.append(feedName + ": " + str(e))
+        case _:
+            errors.append(feedName + ": feed_type must be one of [entity, location, label, filter]")
+    digest = feed.get('digest')
+    if digest is not None:
+        if not isinstance(digest, dict) or not digest.keys() <= {"window", "max_kills", "top"}:
+            errors.append(feedName + ": digest must be an object with any of window, max_kills and top")
+        elif not all(isinstance(digest.get(key, 1), (int, float)) and not isinstance(digest.get(key, 1), bool) and digest.get(key, 1) > 0 for key in ("window", "max_kills", "top")):
+            errors.append(feedName + ": digest window, max_kills and top must be positive numbers")
+        elif not 1 <= digest.get('top', 5) <= 10:
+            errors.append(feedName + ": digest top must be between 1 and 10")
+    return errors
+
+def loadConfig(configurationFilePath):
+    try:
+        configuration = readConfig(configurationFilePath)
+        # ToDo: Ensure defaults are sanely set before proceeding
+        logging.info("loadConfig: Configuration File Loaded")
+        return configuration
+    except Exception as e:
+        logging.critical("loadConfig: Fatal Error Reading Configuration File! " + str(e))
+        os._exit(1)
+
+# Class ConfigurationReloader - Reloads feeds on SIGHUP or when the configuration file changes, without interrupting polling
+class ConfigurationReloader(object):
+    def __init__(self, configurationFilePath: str, configuration, killmailProcessor, watchInterval: float = 30, feedIndexFactory=None):
+        self.path = configurationFilePath
+        self.configuration = configuration
+        self.killmail_processor = killmailProcessor
+        # Builds the index for reloaded feeds, e.g. a ShardedFeedIndex
+        self.feed_index_factory = feedIndexFactory or FeedIndex
+        # Seconds between checks of the file modification time, 0 only reloads on SIGHUP
+        self.watch_interval = watchInterval
+        self.mtime = self._mtime()
+        self.reload_requested = threading.Event()
+        self.is_running = False
+        self.statistics = {
+            'reloads': 0,
+            'rejected': 0
+        }
+        signal.signal(signal.SIGHUP, self.handle_sighup)
+
+    def _mtime(self):
+        try:
+            return os.stat(self.path).st_mtime_ns
+        except OSError:
+            return None
+
+    def handle_sighup(self, signum, frame):
+        logging.info("ConfigurationReloader: SIGHUP recieved")
+        self.reload_requested.set()
+
+    def start(self):
+        self.is_running = True
+        threading.Thread(target=self._watch, name="configuration-reloader", daemon=True).start()
+
+    def stop(self):
+        self.is_running = False
+        self.reload_requested.set()
+
+    def _watch(self):
+        while self.is_running:
+            requested = self.reload_requested.wait(self.watch_interval if self.watch_interval else None)
+            self.reload_requested.clear()
+            if not self.is_running:
+                return
+            mtime = self._mtime()
+            if requested or mtime != self.mtime:
+                self.mtime = mtime
+                self.reload()
+
+    def _feed_keys(self, feeds):
+        # Feeds are identified by name, repeated names are numbered in order
+        keyed = {}
+        for feed in feeds:
+            key = feed['name']
+            number = 1
+            while key in keyed:
+                number+=1
+                key = feed['name'] + "#" + str(number)
+            keyed[key] = feed
+        return keyed
+
+    def reload(self):
+        try:
+            configuration = readConfig(self.path)
+            feedIndex = self.feed_index_factory(configuration['feeds'])
+        except Exception as e:
+            self.statistics['rejected']+=1
+            logging.error("ConfigurationReloader: Configuration rejected, keeping the running feeds. " + str(e))
+            return False
+
+        oldFeeds = self._feed_keys(self.configuration['feeds'])
+        newFeeds = self._feed_keys(configuration['feeds'])
+        added = [name for name in newFeeds if name not in oldFeeds]
+        removed = [name for name in oldFeeds if name not in newFeeds]
+        changed = [name for name in newFeeds if name in oldFeeds and newFeeds[name] != oldFeeds[name]]
+
+        # Swapping the reference is atomic, killmails already being processed finish against the previous index
+        previousFeedIndex = self.killmail_processor.feed_index
+        self.killmail_processor.feed_index = feedIndex
+        if hasattr(previousFeedIndex, 'close'):
+            # Worker processes of a sharded index are left a grace period for killmails still being matched
+            retire = threading.Timer(60, previousFeedIndex.close)
+            retire.daemon = True
+            retire.start()
+        for section in configuration:
+            if section != 'feeds' and configuration.get(section) != self.configuration.get(section):
+                logging.warning("ConfigurationReloader: Changes to " + section + " require a restart to take effect")
+        self.configuration = configuration
+        self.statistics['reloads']+=1
+        logging.info("ConfigurationReloader: Reloaded {} feeds. Added: {} Removed: {} Changed: {}".format(
+            len(configuration['feeds']),
+            added or "none",
+            removed or "none",
+            changed or "none"
+        ))
+        return True
+
+    def get_statistics(self):
+        return self.statistics
+
+def configureLogging(logLevel):
+    match logLevel:
+        case "INFO":
+            logging.basicConfig(
+			format = "[%(asctime)s] [%(levelname)8s] (%(module)s LN %(lineno)s): %(message)s",
+			level = logging.INFO,
+		)
+        case "DEBUG":
+            logging.basicConfig(
+			format = "[%(asctime)s] [%(levelname)8s] (%(module)s LN %(lineno)s): %(message)s",
+			level = logging.DEBUG,
+		)
+        case "WARNING":
+            logging.basicConfig(
+			format = "[%(asctime)s] [%(levelname)8s] (%(module)s LN %(lineno)s): %(message)s",
+			level = logging.WARNING,
+		)
+        case "ERROR":
+            logging.basicConfig(
+			format = "[%(asctime)s] [%(levelname)8s] (%(module)s LN %(lineno)s): %(message)s",
+			level = logging.ERROR,
+		)
+        case "CRITICAL":
+            logging.basicConfig(
+			format = "[%(asctime)s] [%(levelname)8s] (%(module)s LN %(lineno)s): %(message)s",
+			level = logging.CRITICAL,
+		)
+        case _:
+            logging.basicConfig(
+			format = "[%(asctime)s] [%(levelname)8s] (%(module)s LN %(lineno)s): %(message)s",
+			level = logging.INFO,
+		)
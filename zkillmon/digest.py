@@ -0,0 +1,168 @@
+# zKillboardMonitor - Digests summarising the kills of high volume feeds
+import heapq
+import logging
+import threading
+import time
+
+from collections import Counter
+from datetime import datetime, timezone
+
+import humanize
+
+from zkillmon.alerts import AlertPayload, RenderedEmbed, discordPost
+from zkillmon.metrics import metrics
+
+# Class DigestWindow - Kills matched by one digest feed during a window, bounded to the top kills by value and per system and ship counts
+class DigestWindow(object):
+    # Systems and ships listed in each breakdown
+    breakdown_size = 5
+
+    def __init__(self, feedName: str, webhookURL: str, settings):
+        self.feed_name = feedName
+        self.webhook = webhookURL
+        self.window = settings.get('window', 300)
+        self.max_kills = settings.get('max_kills', 500)
+        self.top = settings.get('top', 5)
+        self.started = time.monotonic()
+        self.deadline = self.started + self.window
+        self.count = 0
+        self.losses = 0
+        self.total_value = 0
+        # Min heap of (value, count, line) holding the most valuable kills
+        self.top_kills = []
+        self.systems = Counter()
+        self.ships = Counter()
+        self.callbacks = []
+
+    def add(self, alertData, relationship: str, callback=None):
+        self.count+=1
+        if relationship == "Loss":
+            self.losses+=1
+        value = alertData['kill_zkillboard_value'] or 0
+        self.total_value+=value
+        self.systems[alertData['kill_location_system']]+=1
+        self.ships[alertData['victim_ship_name']]+=1
+        if len(self.top_kills) < self.top or value > self.top_kills[0][0]:
+            line = "[{}]({}) {} ({}) in {} ({}), {}".format(
+                alertData['victim_ship_name'],
+                alertData['kill_zkillboard_URL'],
+                alertData['victim_name'],
+                alertData['victim_group_name'],
+                alertData['kill_location_system'],
+                alertData['kill_location_region'],
+                humanize.intword(value)
+            )
+            if len(self.top_kills) < self.top:
+                heapq.heappush(self.top_kills, (value, self.count, line))
+            else:
+                heapq.heapreplace(self.top_kills, (value, self.count, line))
+        if callback is not None:
+            self.callbacks.append(callback)
+
+    def is_full(self):
+        return self.count >= self.max_kills
+
+    def _breakdown(self, counts):
+        return "\n".join("{} x{}".format(name, count) for name, count in counts.most_common(self.breakdown_size))
+
+    def render(self):
+        relationship = "Loss" if self.losses == self.count else "Kill"
+        embed = {
+            "title": "{}: {} kills in {}".format(self.feed_name, self.count, humanize.naturaldelta(max(1, time.monotonic() - self.started))),
+            "description": "\n".join(line for value, count, line in sorted(self.top_kills, reverse=True)),
+            "color": AlertPayload.relationships[relationship][0],
+            "fields": [
+                {"name": "Total Value", "value": humanize.intword(self.total_value), "inline": True},
+                {"name": "Kills / Losses", "value": "{} / {}".format(self.count - self.losses, self.losses), "inline": True},
+                {"name": "Systems", "value": self._breakdown(self.systems), "inline": False},
+                {"name": "Ships", "value": self._breakdown(self.ships), "inline": False}
+            ],
+            "footer": {"text": "Digest"},
+            "timestamp": datetime.now(timezone.utc).isoformat()
+        }
+        return RenderedEmbed(embed)
+
+# Class DigestAggregator - Buffers kills for feeds with a digest, sending one summary per feed each window or once max_kills is reached
+class DigestAggregator(object):
+    def __init__(self, discordWebhookStatsTracker, discordDelivery=None):
+        self.discord_webhook_stats = discordWebhookStatsTracker
+        self.discord_delivery = discordDelivery
+        # (feed name, webhook URL) -> DigestWindow
+        self.windows = {}
+        self.condition = threading.Condition()
+        self.thread = None
+        self.is_running = True
+        self.statistics = {
+            'kills': 0,
+            'digests': 0
+        }
+
+    def add(self, relevantFeed, alertData, callback=None):
+        # callback, if given, is called with whether the digest holding this kill was sent
+        key = (relevantFeed['name'], relevantFeed['webhook'])
+        with self.condition:
+            window = self.windows.get(key)
+            if window is None:
+                window = self.windows[key] = DigestWindow(relevantFeed['name'], relevantFeed['webhook'], relevantFeed['digest'])
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self._worker, name="digest", daemon=True)
+                    self.thread.start()
+                self.condition.notify()
+            window.add(alertData, relevantFeed['relationship'], callback)
+            self.statistics['kills']+=1
+            if window.is_full():
+                del self.windows[key]
+            else:
+                window = None
+        if window is not None:
+            self._send(window)
+
+    def _worker(self):
+        while True:
+            with self.condition:
+                if not self.is_running:
+                    return
+                now = time.monotonic()
+                due = [key for key, window in self.windows.items() if window.deadline <= now]
+                if not due:
+                    nextDeadline = min((window.deadline for window in self.windows.values()), default=None)
+                    self.condition.wait(None if nextDeadline is None else nextDeadline - now)
+                    continue
+                windows = [self.windows.pop(key) for key in due]
+            for window in windows:
+                self._send(window)
+
+    def _send(self, window):
+        rendered = window.render()
+        callbacks = window.callbacks
+
+        def delivered(sent: bool):
+            for callback in callbacks:
+                callback(sent)
+
+        logging.info("DigestAggregator: Sending digest of " + str(window.count) + " kills for feed: " + window.feed_name)
+        self.statistics['digests']+=1
+        metrics.inc("zkillmon_alerts_total", {"feed": window.feed_name, "relationship": "Digest"})
+        if self.discord_delivery is not None:
+            self.discord_delivery.submit(window.webhook, rendered, delivered)
+        else:
+            response = discordPost(window.webhook, [rendered])
+            self.discord_webhook_stats.increment_execution()
+            logging.info("DigestAggregator: Discord Response: " + str(response))
+            delivered(response is not None and response.ok)
+
+    def close(self):
+        # Send whatever is buffered rather than losing it on shutdown
+        with self.condition:
+            self.is_running = False
+            windows = list(self.windows.values())
+            self.windows.clear()
+            self.condition.notify()
+        for window in windows:
+            self._send(window)
+        if self.thread is not None:
+            self.thread.join(5)
+        logging.info("DigestAggregator: Closed")
+
+    def get_statistics(self):
+        return self.statistics
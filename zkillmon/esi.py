@@ -0,0 +1,889 @@
+# zKillboardMonitor - ESI lookups and the ESI cache
+import email.utils
+import os
+import queue
+import json
+import logging
+import random
+import requests
+import sqlite3
+import threading
+import time
+
+from collections import OrderedDict
+
+from zkillmon.metrics import metrics
+from zkillmon.transport import transport
+
+# ESI Cache Database Class
+class ESICacheDatabase(object):
+    schema_version = 2
+    # Query types of the ID ranges EVE keeps distinct, used when migrating the untyped version 1 cache
+    migration_query_types = """
+        CASE
+            WHEN ID BETWEEN 500000 AND 599999 THEN 'faction'
+            WHEN ID BETWEEN 10000000 AND 19999999 THEN 'region_id'
+            WHEN ID BETWEEN 20000000 AND 29999999 THEN 'constellation_id'
+            WHEN ID BETWEEN 30000000 AND 39999999 THEN 'system_id'
+            WHEN ID BETWEEN 90000000 AND 97999999 OR ID >= 2100000000 THEN 'character_id'
+            WHEN ID BETWEEN 98000000 AND 98999999 THEN 'corporation_id'
+            WHEN ID BETWEEN 99000000 AND 99999999 THEN 'alliance_id'
+            ELSE ''
+        END
+    """
+
+    def __init__(self, sqlitePath, writeBatchSize: int = 50, writeFlushInterval: float = 5, maxEntries: int = 500000, evictionInterval: float = 300):
+        self.path = sqlitePath
+        # Inserts are buffered and flushed in a single transaction once either threshold is reached
+        self.write_batch_size = writeBatchSize
+        self.write_flush_interval = writeFlushInterval
+        # Entries fetched longest ago are evicted beyond max_entries, checked at most every eviction_interval seconds
+        self.max_entries = maxEntries
+        self.eviction_interval = evictionInterval
+        self.evicted = time.monotonic()
+        self.pending = {}
+        self.pending_since = None
+        self.lock = threading.RLock()
+        # One long lived connection per thread
+        self.local = threading.local()
+        self.connections = []
+        self.statistics = {
+            'flush_count': 0,
+            'rows_written': 0,
+            'rows_evicted': 0
+        }
+        logging.info("ESICacheDatabase: SQLite path is: " + self.path)
+        if os.path.exists(self.path):
+            logging.info("ESICacheDatabase: SQLite database present")
+            self._migrate()
+        else:
+            logging.warning("ESICacheDatabase: SQLite database missing, will be created and initialized")
+            self._initialize()
+
+    def _connection(self):
+        sqlite_connection = getattr(self.local, 'connection', None)
+        if sqlite_connection is None:
+            sqlite_connection = sqlite3.connect(self.path, check_same_thread=False, cached_statements=64)
+            sqlite_connection.execute("PRAGMA journal_mode=WAL")
+            sqlite_connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = sqlite_connection
+            with self.lock:
+                self.connections.append(sqlite_connection)
+        return sqlite_connection
+
+    def _create_schema(self, sqlite_connection):
+        # Entries are keyed by query type as IDs of different types can collide, a query type of '' matches any type
+        sqlite_connection.execute("""
+            CREATE TABLE esi_cache (
+                QueryType            VARCHAR(20) NOT NULL,
+                ID                   INTEGER NOT NULL,
+                Name                 VARCHAR(100) NOT NULL,
+                ParentID             INTEGER,
+                FetchedAt            REAL NOT NULL,
+                Expires              REAL NOT NULL,
+                ETag                 VARCHAR(100),
+                PRIMARY KEY ( QueryType, ID ),
+                CHECK ( ID >= 0 ),
+                CHECK ( ID <= 2147483647 )
+            )
+        """)
+        sqlite_connection.execute("CREATE INDEX esi_cache_fetched ON esi_cache ( FetchedAt )")
+        sqlite_connection.execute("PRAGMA user_version = " + str(self.schema_version))
+
+    def _initialize(self):
+        sqlite_connection = self._connection()
+        with sqlite_connection:
+            self._create_schema(sqlite_connection)
+        logging.warning("ESICacheDatabase: Database created and initialized")
+
+    def _migrate(self):
+        sqlite_connection = self._connection()
+        version = sqlite_connection.execute("PRAGMA user_version").fetchone()[0]
+        if version >= self.schema_version:
+            return
+        logging.warning("ESICacheDatabase: Migrating cache from schema version " + str(version or 1) + " to " + str(self.schema_version))
+        with sqlite_connection:
+            self._create_schema(sqlite_connection)
+            if sqlite_connection.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'cache_data'").fetchone() is not None:
+                # Version 1 entries have no query type or expiry, they are kept but revalidated when next used
+                migrated = sqlite_connection.execute(
+                    "INSERT INTO esi_cache SELECT " + self.migration_query_types + ", ID, Name, ParentID, ?, 0, NULL FROM cache_data",
+                    (time.time(),)
+                ).rowcount
+                sqlite_connection.execute("DROP TABLE cache_data")
+                logging.warning("ESICacheDatabase: Migrated " + str(migrated) + " entries")
+
+    def _row_to_entry(self, row):
+        return {
+            "id": row[1],
+            "name": row[2],
+            "parent": row[3],
+            "expires": row[5],
+            "etag": row[6]
+        }
+
+    def create(self, id: int, name: str, parentID: int = None, queryType: str = None, expires: float = 0, etag: str = None):
+        with self.lock:
+            if not self.pending:
+                self.pending_since = time.monotonic()
+            self.pending[(queryType or "", id)] = (queryType or "", id, name, parentID, time.time(), expires, etag)
+            if len(self.pending) >= self.write_batch_size:
+                self.flush()
+            else:
+                self._flush_if_due()
+        return True
+
+    def _flush_if_due(self):
+        if self.pending and time.monotonic() - self.pending_since >= self.write_flush_interval:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            if not self.pending:
+                return 0
+            rows = list(self.pending.values())
+            sqlite_connection = self._connection()
+            try:
+                with sqlite_connection:
+                    # Idempotent upsert so two paths caching the same entry cannot raise IntegrityError
+                    sqlite_connection.executemany(
+                        "INSERT INTO esi_cache VALUES(?, ?, ?, ?, ?, ?, ?) ON CONFLICT(QueryType, ID) DO UPDATE SET "
+                        "Name = excluded.Name, ParentID = excluded.ParentID, FetchedAt = excluded.FetchedAt, Expires = excluded.Expires, ETag = excluded.ETag",
+                        rows
+                    )
+            except sqlite3.Error:
+                logging.error("ESICacheDatabase: Failed to flush " + str(len(rows)) + " entries, will retry.")
+                logging.exception("ESICacheDatabase:")
+                return 0
+            self.pending.clear()
+            self.pending_since = None
+            self.statistics['flush_count']+=1
+            self.statistics['rows_written']+=len(rows)
+            logging.debug("ESICacheDatabase: Flushed " + str(len(rows)) + " entries")
+            if time.monotonic() - self.evicted >= self.eviction_interval:
+                self.evict()
+            return len(rows)
+
+    def evict(self):
+        # Keep the file bounded, evicting down to 90% of max_entries so eviction does not run on every flush
+        with self.lock:
+            self.evicted = time.monotonic()
+            sqlite_connection = self._connection()
+            count = sqlite_connection.execute("SELECT COUNT(*) FROM esi_cache").fetchone()[0]
+            if count <= self.max_entries:
+                return 0
+            with sqlite_connection:
+                evicted = sqlite_connection.execute(
+                    "DELETE FROM esi_cache WHERE (QueryType, ID) IN (SELECT QueryType, ID FROM esi_cache ORDER BY FetchedAt LIMIT ?)",
+                    (count - int(self.max_entries * 0.9),)
+                ).rowcount
+            self.statistics['rows_evicted']+=evicted
+            logging.info("ESICacheDatabase: Evicted " + str(evicted) + " entries")
+            return evicted
+
+    def get(self, id: int, queryType: str = None):
+        with self.lock:
+            if (queryType or "", id) in self.pending:
+                return self._row_to_entry(self.pending[(queryType or "", id)])
+            self._flush_if_due()
+        # Typed entries sort before untyped ones migrated from version 1
+        rawdata = self._connection().execute(
+            "SELECT QueryType, ID, Name, ParentID, FetchedAt, Expires, ETag FROM esi_cache WHERE ID = ? AND QueryType IN (?, '') ORDER BY QueryType DESC LIMIT 1",
+            (id, queryType or "")
+        ).fetchone()
+        logging.debug("ESICacheDatabase: Get " + str(queryType) + " " + str(id) + " Returned: " + str(rawdata))
+        returndata = None
+        if rawdata is not None:
+            returndata = self._row_to_entry(rawdata)
+        return returndata
+
+    def get_many(self, ids, queryType: str = None):
+        # Fetch several IDs of one query type in as few queries as possible, returns a dict of ID -> entry for the IDs found
+        returndata = {}
+        remaining = []
+        with self.lock:
+            self._flush_if_due()
+            for id in set(ids):
+                if (queryType or "", id) in self.pending:
+                    returndata[id] = self._row_to_entry(self.pending[(queryType or "", id)])
+                else:
+                    remaining.append(id)
+        sqlite_connection = self._connection()
+        # Stay below the default SQLite bound parameter limit
+        for offset in range(0, len(remaining), 500):
+            chunk = remaining[offset:offset + 500]
+            query = "SELECT QueryType, ID, Name, ParentID, FetchedAt, Expires, ETag FROM esi_cache WHERE QueryType IN (?, '') AND ID IN ({})".format(", ".join("?" * len(chunk)))
+            for row in sqlite_connection.execute(query, [queryType or ""] + chunk):
+                if row[0] or row[1] not in returndata:
+                    returndata[row[1]] = self._row_to_entry(row)
+        return returndata
+
+    def get_recent(self, limit: int):
+        # Returns up to limit (query type, entry) pairs for warming, most recently fetched last
+        rawdata = self._connection().execute(
+            "SELECT QueryType, ID, Name, ParentID, FetchedAt, Expires, ETag FROM esi_cache WHERE QueryType != '' ORDER BY FetchedAt DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        returndata = []
+        for row in reversed(rawdata):
+            returndata.append((row[0], self._row_to_entry(row)))
+        return returndata
+
+    def export_snapshot(self, snapshotPath: str):
+        # Write every entry to a gzipped JSON snapshot, returns the number of entries written
+        import gzip
+        self.flush()
+        started = time.monotonic()
+        rows = self._connection().execute("SELECT QueryType, ID, Name, ParentID, FetchedAt, Expires, ETag FROM esi_cache").fetchall()
+        snapshot = {
+            "version": self.schema_version,
+            "entries": rows
+        }
+        with gzip.open(snapshotPath + ".tmp", "wt") as snapshotFile:
+            json.dump(snapshot, snapshotFile, separators=(",", ":"))
+        os.replace(snapshotPath + ".tmp", snapshotPath)
+        logging.info("ESICacheDatabase: Exported " + str(len(rows)) + " entries to " + snapshotPath + " in " + str(round(time.monotonic() - started, 2)) + "s")
+        return len(rows)
+
+    def import_snapshot(self, snapshotPath: str):
+        # Merge a snapshot written by export_snapshot, entries already held are kept unless the snapshot fetched them more recently
+        import gzip
+        started = time.monotonic()
+        with gzip.open(snapshotPath, "rt") as snapshotFile:
+            snapshot = json.load(snapshotFile)
+        if snapshot.get("version") != self.schema_version:
+            raise Exception("Cache snapshot version " + str(snapshot.get("version")) + " is not supported")
+        self.flush()
+        sqlite_connection = self._connection()
+        with self.lock:
+            with sqlite_connection:
+                sqlite_connection.executemany(
+                    "INSERT INTO esi_cache VALUES(?, ?, ?, ?, ?, ?, ?) ON CONFLICT(QueryType, ID) DO UPDATE SET "
+                    "Name = excluded.Name, ParentID = excluded.ParentID, FetchedAt = excluded.FetchedAt, Expires = excluded.Expires, ETag = excluded.ETag "
+                    "WHERE excluded.FetchedAt > esi_cache.FetchedAt",
+                    snapshot['entries']
+                )
+        elapsed = time.monotonic() - started
+        logging.info("ESICacheDatabase: Imported " + str(len(snapshot['entries'])) + " entries from " + snapshotPath + " in " + str(round(elapsed, 2)) + "s")
+        self.evict()
+        return len(snapshot['entries'])
+
+    def update(self, id: int, name: str, parentID: int = None, queryType: str = None, expires: float = 0, etag: str = None):
+        return self.create(id, name, parentID, queryType, expires, etag)
+
+    def delete(self, id: int, queryType: str = None):
+        with self.lock:
+            self.pending.pop((queryType or "", id), None)
+            sqlite_connection = self._connection()
+            with sqlite_connection:
+                sqlite_connection.execute("DELETE FROM esi_cache WHERE QueryType = ? AND ID = ?", (queryType or "", id))
+        return True
+
+    def close(self):
+        self.flush()
+        with self.lock:
+            for sqlite_connection in self.connections:
+                sqlite_connection.close()
+            self.connections = []
+            self.local = threading.local()
+        logging.info("ESICacheDatabase: Closed")
+
+    def get_statistics(self):
+        return self.statistics
+
+# ESI Memory Cache Class - Bounded in-process LRU tier in front of ESICacheDatabase
+class ESIMemoryCache(object):
+    def __init__(self, esiCacheDatabase, maxEntries: int = 10000, ttls: dict = None):
+        self.database = esiCacheDatabase
+        self.max_entries = maxEntries
+        # Optional time to live in seconds keyed by query type, entries of other types live until evicted
+        self.ttls = ttls or {}
+        # (queryType, id) -> [entry, monotonic expiry]
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.statistics = {
+            'memory_hit': 0,
+            'memory_miss': 0,
+            'memory_eviction': 0,
+            'memory_expired': 0
+        }
+
+    def warm(self):
+        # Populate the memory tier from the SQLite store
+        for queryType, entry in self.database.get_recent(self.max_entries):
+            self.entries[(queryType, entry['id'])] = [entry, None]
+        logging.info("ESIMemoryCache: Warmed with " + str(len(self.entries)) + " entries")
+
+    def _put(self, id: int, entry, queryType: str = None):
+        ttl = self.ttls.get(queryType)
+        with self.lock:
+            self.entries[(queryType, id)] = [entry, time.monotonic() + ttl if ttl else None]
+            self.entries.move_to_end((queryType, id))
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+                self.statistics['memory_eviction']+=1
+
+    def _get_memory(self, id: int, queryType: str = None):
+        with self.lock:
+            cached = self.entries.get((queryType, id))
+            if cached is not None:
+                ttl = self.ttls.get(queryType)
+                if ttl:
+                    now = time.monotonic()
+                    if cached[1] is None:
+                        # Warmed entries start their time to live on first use
+                        cached[1] = now + ttl
+                    elif cached[1] <= now:
+                        del self.entries[(queryType, id)]
+                        self.statistics['memory_expired']+=1
+                        cached = None
+            if cached is not None:
+                self.entries.move_to_end((queryType, id))
+                self.statistics['memory_hit']+=1
+                return cached[0]
+            self.statistics['memory_miss']+=1
+            return None
+
+    def get(self, id: int, queryType: str = None):
+        entry = self._get_memory(id, queryType)
+        if entry is None:
+            entry = self.database.get(id, queryType)
+            if entry is not None:
+                self._put(id, entry, queryType)
+        return entry
+
+    def get_many(self, ids, queryType: str = None):
+        returndata = {}
+        misses = []
+        for id in set(ids):
+            entry = self._get_memory(id, queryType)
+            if entry is None:
+                misses.append(id)
+            else:
+                returndata[id] = entry
+        if misses:
+            for id, entry in self.database.get_many(misses, queryType).items():
+                self._put(id, entry, queryType)
+                returndata[id] = entry
+        return returndata
+
+    def create(self, id: int, name: str, parentID: int = None, queryType: str = None, expires: float = 0, etag: str = None):
+        result = self.database.create(id, name, parentID, queryType, expires, etag)
+        self._put(id, {"id": id, "name": name, "parent": parentID, "expires": expires, "etag": etag}, queryType)
+        return result
+
+    def get_statistics(self):
+        return self.statistics
+
+# Raised when ESI cannot answer a lookup, the id is invalid or the endpoint is failing
+class ESILookupError(Exception):
+    pass
+
+# Class CircuitBreaker - Stops requests to a failing ESI endpoint for a growing, jittered interval
+class CircuitBreaker(object):
+    def __init__(self, failureThreshold: int = 5, resetTimeout: float = 30, maxResetTimeout: float = 600):
+        self.failure_threshold = failureThreshold
+        self.reset_timeout = resetTimeout
+        self.max_reset_timeout = maxResetTimeout
+        self.failures = 0
+        # Consecutive times the breaker opened, each doubles the time before the next trial request
+        self.opened = 0
+        self.open_until = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        # Closed allows every request, once open a single trial request is allowed after the reset timeout
+        with self.lock:
+            if self.failures < self.failure_threshold:
+                return True
+            if time.monotonic() < self.open_until or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened = 0
+            self.probing = False
+
+    def record_failure(self):
+        # Returns the seconds the breaker is now open for, 0 while it stays closed
+        with self.lock:
+            self.failures+=1
+            self.probing = False
+            if self.failures < self.failure_threshold:
+                return 0
+            self.opened+=1
+            resetTimeout = min(self.max_reset_timeout, self.reset_timeout * 2 ** (self.opened - 1))
+            # Jitter so many instances do not all retry a recovering ESI at once
+            resetTimeout = random.uniform(resetTimeout / 2, resetTimeout)
+            self.open_until = time.monotonic() + resetTimeout
+            return resetTimeout
+
+# ESI Class
+class ESILookup(object):
+    # Query types which only need a name and can be resolved in bulk through /universe/names/
+    names_query_types = {"character_id", "corporation_id", "alliance_id", "type_id", "faction"}
+    names_chunk_size = 1000
+    # Names of these never change, they are kept for default_ttl['static'] whatever ESI's Expires header says
+    static_query_types = {"type_id", "faction", "system_id", "constellation_id", "region_id"}
+    default_ttl = {
+        'static': 30 * 86400,
+        'mutable': 86400
+    }
+
+    def __init__(self, esiBaseURL: str, esiDataSource: str, esiIdentifier: str, esiCacheDatabase, negativeCacheTTL: float = 300, failureThreshold: int = 5, resetTimeout: float = 30, placeholderNames: bool = True, minTTL: float = 3600):
+        self.config = {
+            'baseurl': esiBaseURL,
+            'datasource': esiDataSource,
+            'identity': esiIdentifier
+        }
+        self.statistics = {
+            'query_count': 0,
+            'cache_hit': 0,
+            'cache_miss': 0,
+            'negative_hit': 0,
+            'circuit_rejected': 0,
+            'placeholders': 0,
+            'stale_hit': 0,
+            'revalidated': 0,
+            'not_modified': 0
+        }
+        # Invalid or missing ids, (queryType, queryValue) -> monotonic time the entry expires
+        self.negative_cache = OrderedDict()
+        self.negative_cache_ttl = negativeCacheTTL
+        self.negative_cache_entries = 10000
+        self.negative_lock = threading.Lock()
+        # Endpoint, the query type or names, -> CircuitBreaker
+        self.breakers = {}
+        self.failure_threshold = failureThreshold
+        self.reset_timeout = resetTimeout
+        # Substitute placeholder names rather than failing enrichment while ESI cannot answer
+        self.placeholder_names = placeholderNames
+        self.cache = esiCacheDatabase
+        # Optional UniverseMap answering location lookups without ESI
+        self.universe_map = None
+        # Lookups currently being fetched, keyed by (queryType, queryValue), so concurrent callers share one request
+        self.inflight = {}
+        self.inflight_lock = threading.Lock()
+        # Shortest time an alliance, corporation or character name is cached for
+        self.min_ttl = minTTL
+        # Expired entries are still served, and revalidated with If-None-Match by a background thread
+        self.revalidation_queue = queue.Queue(1000)
+        self.revalidating = set()
+        self.revalidation_thread = None
+
+    def _updateStatistics(self, queryType: str = "other", seconds: float = None):
+        self.statistics['query_count']+=1
+        metrics.inc("zkillmon_esi_requests_total", {"query_type": queryType})
+        if seconds is not None:
+            metrics.observe("zkillmon_esi_request_seconds", seconds, {"query_type": queryType})
+
+    def get_statistics(self):
+        return self.statistics
+
+    def set_baseurl(self, esiBaseURL: str):
+        self.config['baseurl'] = esiBaseURL
+
+    def set_datasource(self, esiDataSource: str):
+        self.config['datasource'] = esiDataSource
+
+    def set_baseurl(self, esiIdentifier: str):
+        self.config['identity'] = esiIdentifier
+    
+    def _request(self, fullURL: str, headers: str, queryType: str = "other"):
+        try:
+            started = time.monotonic()
+            response = transport.get(fullURL, headers=headers)
+            self._updateStatistics(queryType, time.monotonic() - started)
+            return response
+        except requests.exceptions.RequestException:
+            logging.error("ESILookup: ESI request error.")
+            logging.exception("ESILookup:")
+
+    def _post(self, fullURL: str, headers: str, body, queryType: str = "names"):
+        try:
+            started = time.monotonic()
+            response = transport.post(fullURL, headers=headers, json=body)
+            self._updateStatistics(queryType, time.monotonic() - started)
+            return response
+        except requests.exceptions.RequestException:
+            logging.error("ESILookup: ESI request error.")
+            logging.exception("ESILookup:")
+
+    def _claim(self, keys):
+        # Split keys into those this caller must fetch and events for those another caller is already fetching
+        claimed = []
+        waiting = []
+        with self.inflight_lock:
+            for key in keys:
+                if key in self.inflight:
+                    waiting.append((key, self.inflight[key]))
+                else:
+                    self.inflight[key] = threading.Event()
+                    claimed.append(key)
+        return claimed, waiting
+
+    def _release(self, keys):
+        with self.inflight_lock:
+            for key in keys:
+                self.inflight.pop(key).set()
+
+    def _breaker(self, endpoint: str):
+        breaker = self.breakers.get(endpoint)
+        if breaker is None:
+            breaker = self.breakers.setdefault(endpoint, CircuitBreaker(self.failure_threshold, self.reset_timeout))
+        return breaker
+
+    def _record_failure(self, endpoint: str):
+        resetTimeout = self._breaker(endpoint).record_failure()
+        if resetTimeout:
+            metrics.inc("zkillmon_esi_circuit_open_total", {"endpoint": endpoint})
+            logging.warning("ESILookup: Circuit open for " + endpoint + ", next attempt in " + str(round(resetTimeout, 1)) + "s")
+
+    def _is_negative(self, queryType: str, queryValue: int):
+        with self.negative_lock:
+            expires = self.negative_cache.get((queryType, queryValue))
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self.negative_cache[(queryType, queryValue)]
+                return False
+        self.statistics['negative_hit']+=1
+        return True
+
+    def _add_negative(self, queryType: str, queryValue: int):
+        with self.negative_lock:
+            self.negative_cache[(queryType, queryValue)] = time.monotonic() + self.negative_cache_ttl
+            self.negative_cache.move_to_end((queryType, queryValue))
+            if len(self.negative_cache) > self.negative_cache_entries:
+                self.negative_cache.popitem(last=False)
+
+    def placeholder(self, queryType: str, queryValue: int):
+        # Stand in for data ESI could not provide, never cached
+        self.statistics['placeholders']+=1
+        return {
+            "id": queryValue,
+            "name": "Unknown" if queryValue is None else "Unknown (" + str(queryValue) + ")",
+            "parent": None
+        }
+
+    def lookup(self, queryType: str, queryValue: int):
+        cacheResponse = self._checkcache(queryValue, queryType)
+        if cacheResponse is not None:
+            return cacheResponse
+        return self._fetch_or_placeholder(queryType, queryValue)
+
+    def lookup_parent(self, queryType: str, queryValue: int):
+        # As lookup, but entries cached without their parent, such as types resolved by name only, are fetched again
+        cacheResponse = self._checkcache(queryValue, queryType)
+        if cacheResponse is not None and cacheResponse.get('parent') is not None:
+            return cacheResponse
+        return self._fetch_or_placeholder(queryType, queryValue)
+
+    def _fetch_or_placeholder(self, queryType: str, queryValue: int):
+        try:
+            return self._fetch(queryType, queryValue)
+        except ESILookupError as e:
+            if not self.placeholder_names:
+                raise
+            logging.warning("ESILookup: Using placeholder for " + queryType + " " + str(queryValue) + ": " + str(e))
+            return self.placeholder(queryType, queryValue)
+
+    def _fetch(self, queryType: str, queryValue: int):
+        # Known bad ids and failing endpoints are answered at once rather than waiting on ESI again
+        if self._is_negative(queryType, queryValue):
+            raise ESILookupError("ESI previously found no " + queryType + " " + str(queryValue))
+        if not self._breaker(queryType).allow():
+            self.statistics['circuit_rejected']+=1
+            raise ESILookupError("ESI circuit open for " + queryType)
+        claimed, waiting = self._claim([(queryType, queryValue)])
+        if waiting:
+            waiting[0][1].wait()
+            cacheResponse = self.cache.get(queryValue, queryType)
+            if cacheResponse is not None:
+                return cacheResponse
+            # The other fetch failed, try again ourselves
+            return self._fetch(queryType, queryValue)
+        try:
+            esiData = self._esilookup(queryType, queryValue)
+            self._addtocache(esiData, queryType)
+        finally:
+            self._release(claimed)
+        return esiData
+
+    def resolve_many(self, queries):
+        # Resolve a set of (queryType, queryValue) pairs, answering from cache where possible and
+        # sending all name only misses to ESI as chunked POST /universe/names/ requests.
+        # Returns a dict of (queryType, queryValue) -> data
+        results = {}
+        byType = {}
+        for queryType, queryValue in set(queries):
+            byType.setdefault(queryType, []).append(queryValue)
+        misses = []
+        for queryType, queryValues in byType.items():
+            cached = self.cache.get_many(queryValues, queryType)
+            for queryValue in queryValues:
+                if queryValue in cached:
+                    self.statistics['cache_hit']+=1
+                    metrics.inc("zkillmon_esi_cache_total", {"query_type": queryType, "result": "hit"})
+                    self._revalidate_if_stale(queryType, cached[queryValue])
+                    results[(queryType, queryValue)] = cached[queryValue]
+                else:
+                    self.statistics['cache_miss']+=1
+                    metrics.inc("zkillmon_esi_cache_total", {"query_type": queryType, "result": "miss"})
+                    misses.append((queryType, queryValue))
+        if not misses:
+            return results
+
+        claimed, waiting = self._claim([miss for miss in misses if miss[0] in self.names_query_types])
+        try:
+            if claimed:
+                results.update(self._esinames(claimed))
+        finally:
+            self._release(claimed)
+        for key, event in waiting:
+            event.wait()
+            cacheResponse = self.cache.get(key[1], key[0])
+            if cacheResponse is not None:
+                results[key] = cacheResponse
+        for queryType, queryValue in misses:
+            if (queryType, queryValue) not in results:
+                # Locations need their parent IDs, these and anything that failed in bulk are looked up one at a time
+                results[(queryType, queryValue)] = self._fetch_or_placeholder(queryType, queryValue)
+        return results
+
+    def fetch_json(self, path: str, queryType: str = "other"):
+        # GET an ESI path which is not cached itself, such as a listing, returns the parsed JSON or raises ESILookupError
+        esiResponse = self._request(self.config['baseurl'] + path + self.config['datasource'], {'User-Agent': self.config['identity']}, queryType)
+        if esiResponse is None or esiResponse.status_code != 200:
+            raise ESILookupError("ESI Response was not valid for: " + path)
+        return json.loads(esiResponse.text)
+
+    def store(self, queryType: str, queryValue: int, name: str, parent: int = None):
+        # Cache an entry resolved outside a lookup, such as from an ESI listing, expiring as a lookup of queryType would
+        with self.negative_lock:
+            self.negative_cache.pop((queryType, queryValue), None)
+        self._addtocache({"id": queryValue, "name": name, "parent": parent, "expires": self._expiry(queryType)}, queryType)
+
+    def prefetch_names(self, queries):
+        # Resolve name only (queryType, queryValue) pairs ahead of need in bulk POST /universe/names/ requests.
+        # Pairs another caller is already fetching are skipped and failures are not retried one at a time.
+        # Returns a dict of (queryType, queryValue) -> data, or None where ESI did not resolve it
+        claimed, waiting = self._claim([query for query in set(queries) if query[0] in self.names_query_types])
+        try:
+            results = self._esinames(claimed) if claimed else {}
+        finally:
+            self._release(claimed)
+        return {query: results.get(query) for query in claimed}
+
+    def prefetch(self, queryType: str, queryValue: int):
+        # Fetch and cache one entry ahead of need, returns its data or None if ESI could not provide it
+        try:
+            return self._fetch(queryType, queryValue)
+        except ESILookupError:
+            return None
+
+    def _esinames(self, queries):
+        headers = {
+            'User-Agent': self.config['identity']
+        }
+        results = {}
+        queryTypes = {}
+        for queryType, queryValue in queries:
+            queryTypes.setdefault(queryValue, []).append(queryType)
+        queryValues = list(queryTypes)
+        fullURL = self.config['baseurl'] + "universe/names/" + self.config['datasource']
+        for offset in range(0, len(queryValues), self.names_chunk_size):
+            chunk = queryValues[offset:offset + self.names_chunk_size]
+            if not self._breaker("names").allow():
+                self.statistics['circuit_rejected']+=1
+                logging.warning("ESILookup: names: Circuit open, falling back to individual lookups")
+                break
+            logging.debug("ESILookup: names: Resolving " + str(len(chunk)) + " IDs")
+            esiResponse = self._post(fullURL, headers, chunk)
+            if esiResponse is None or esiResponse.status_code >= 500 or esiResponse.status_code in (420, 429):
+                self._record_failure("names")
+            else:
+                self._breaker("names").record_success()
+            if esiResponse is None or esiResponse.status_code != 200:
+                # ESI rejects the whole chunk if any ID is invalid, leave these to individual lookups
+                logging.warning("ESILookup: names: Bulk lookup failed for " + str(len(chunk)) + " IDs, falling back to individual lookups")
+                continue
+            for resolved in json.loads(esiResponse.text):
+                for queryType in queryTypes.get(resolved['id'], ()):
+                    cleanData = {
+                        "id": resolved['id'],
+                        "name": resolved['name'],
+                        "expires": self._expiry(queryType)
+                    }
+                    self._addtocache(cleanData, queryType)
+                    results[(queryType, resolved['id'])] = cleanData
+        return results
+
+    def _addtocache(self, esiData, queryType: str = None):
+        self.cache.create(esiData['id'], esiData['name'], esiData.get('parent'), queryType, esiData.get('expires', 0), esiData.get('etag'))
+
+    def _expiry(self, queryType: str, esiResponse=None):
+        # Wall clock time a fresh response stops being used without revalidation
+        now = time.time()
+        if queryType in self.static_query_types:
+            return now + self.default_ttl['static']
+        ttl = self.default_ttl['mutable']
+        expiresHeader = esiResponse.headers.get('Expires') if esiResponse is not None else None
+        if expiresHeader:
+            try:
+                ttl = email.utils.parsedate_to_datetime(expiresHeader).timestamp() - now
+            except (TypeError, ValueError):
+                logging.debug("ESILookup: Ignoring invalid Expires header: " + str(expiresHeader))
+        return now + max(ttl, self.min_ttl)
+
+    def _revalidate_if_stale(self, queryType: str, cacheResponse):
+        # Entries without an expiry, such as placeholders, are never revalidated
+        expires = cacheResponse.get('expires')
+        if expires is None or expires > time.time():
+            return
+        self.statistics['stale_hit']+=1
+        key = (queryType, cacheResponse['id'])
+        with self.inflight_lock:
+            if key in self.revalidating:
+                return
+            if self.revalidation_thread is None:
+                self.revalidation_thread = threading.Thread(target=self._revalidation_worker, name="esi-revalidation", daemon=True)
+                self.revalidation_thread.start()
+            try:
+                self.revalidation_queue.put_nowait((queryType, cacheResponse))
+            except queue.Full:
+                # Dropped entries are queued again the next time they are used
+                return
+            self.revalidating.add(key)
+
+    def _revalidation_worker(self):
+        while True:
+            queryType, cacheResponse = self.revalidation_queue.get()
+            try:
+                # Failing endpoints and known bad ids keep their stale entries until ESI recovers
+                if self._is_negative(queryType, cacheResponse['id']) or not self._breaker(queryType).allow():
+                    continue
+                esiData = self._esilookup(queryType, cacheResponse['id'], cacheResponse)
+                self._addtocache(esiData, queryType)
+                self.statistics['revalidated']+=1
+            except Exception as e:
+                logging.debug("ESILookup: Revalidation of " + queryType + " " + str(cacheResponse['id']) + " failed: " + str(e))
+            finally:
+                with self.inflight_lock:
+                    self.revalidating.discard((queryType, cacheResponse['id']))
+
+    def _checkcache(self, queryValue: int, queryType: str = None):
+        logging.debug("ESILookup: Checking Cache for: " + str(queryValue))
+        cacheResponse = self.cache.get(queryValue, queryType)
+        if cacheResponse is not None:
+            self.statistics['cache_hit']+=1
+            metrics.inc("zkillmon_esi_cache_total", {"query_type": queryType, "result": "hit"})
+            logging.debug("ESILookup: Cache hit for: " + str(queryValue))
+            self._revalidate_if_stale(queryType, cacheResponse)
+            return cacheResponse
+        else:
+            self.statistics['cache_miss']+=1
+            metrics.inc("zkillmon_esi_cache_total", {"query_type": queryType, "result": "miss"})
+            logging.debug("ESILookup: Cache miss for: " + str(queryValue))
+            return None
+
+    def _esilookup(self, queryType: str, queryValue: int = None, cachedEntry=None):
+        headers = {
+            'User-Agent': self.config['identity']
+        }
+        if cachedEntry is not None and cachedEntry.get('etag'):
+            # Revalidating, ESI answers 304 when the cached entry is unchanged
+            headers['If-None-Match'] = cachedEntry['etag']
+        match queryType:
+            case "character_id":
+                logging.debug("ESILookup: lookup: queryType: " + queryType + " queryValue: " + str(queryValue))
+                fullURL = self.config['baseurl'] + "characters/{0}/".format(queryValue) + self.config['datasource']
+                esiResponse =  self._request(fullURL, headers, queryType)
+            case "corporation_id":
+                logging.debug("ESILookup: lookup: queryType: " + queryType + " queryValue: " + str(queryValue))
+                fullURL = self.config['baseurl'] + "corporations/{0}/".format(queryValue) + self.config['datasource']
+                esiResponse =  self._request(fullURL, headers, queryType)
+            case "alliance_id":
+                logging.debug("ESILookup: lookup: queryType: " + queryType + " queryValue: " + str(queryValue))
+                fullURL = self.config['baseurl'] + "alliances/{0}/".format(queryValue) + self.config['datasource']
+                esiResponse =  self._request(fullURL, headers, queryType)
+            case "type_id":
+                logging.debug("ESILookup: lookup: queryType: " + queryType + " queryValue: " + str(queryValue))
+                fullURL = self.config['baseurl'] + "universe/types/{0}/".format(queryValue) + self.config['datasource']
+                esiResponse =  self._request(fullURL, headers, queryType)
+            case "faction":
+                logging.debug("ESILookup: lookup: queryType: " + queryType)
+                fullURL = self.config['baseurl'] + "universe/factions/" + self.config['datasource']
+                esiResponse =  self._request(fullURL, headers, queryType)
+            case "system_id":
+                logging.debug("ESILookup: lookup: queryType: " + queryType + " queryValue: " + str(queryValue))
+                fullURL = self.config['baseurl'] + "universe/systems/{0}/".format(queryValue) + self.config['datasource']
+                esiResponse =  self._request(fullURL, headers, queryType)
+            case "constellation_id":
+                logging.debug("ESILookup: lookup: queryType: " + queryType + " queryValue: " + str(queryValue))
+                fullURL = self.config['baseurl'] + "universe/constellations/{0}/".format(queryValue) + self.config['datasource']
+                esiResponse =  self._request(fullURL, headers, queryType)
+            case "region_id":
+                logging.debug("ESILookup: lookup: queryType: " + queryType + " queryValue: " + str(queryValue))
+                fullURL = self.config['baseurl'] + "universe/regions/{0}/".format(queryValue) + self.config['datasource']
+                esiResponse =  self._request(fullURL, headers, queryType)
+            case _:
+                raise Exception("queryType was not a valid query type")
+
+        if esiResponse is None:
+            self._record_failure(queryType)
+            raise ESILookupError("ESI request failed")
+        match esiResponse.status_code :
+            case 200:
+                self._breaker(queryType).record_success()
+                responseJson = json.loads(esiResponse.text)
+                # Sanitize response
+                if queryType == "faction":
+                    faction = next((faction for faction in responseJson if faction['faction_id'] == queryValue), None)
+                    if faction is None:
+                        self._add_negative(queryType, queryValue)
+                        raise ESILookupError("ESI has no faction " + str(queryValue))
+                    cleanData = {
+                        "id": queryValue,
+                        "name": faction['name']
+                    }
+                else:
+                    cleanData = {
+                        "id": queryValue,
+                        "name": responseJson['name']
+                    }
+                if queryType == "system_id":
+                    cleanData.update({"parent": responseJson['constellation_id']})
+                elif queryType == "constellation_id":
+                    cleanData.update({"parent": responseJson['region_id']})
+                elif queryType == "type_id":
+                    cleanData.update({"parent": responseJson.get('group_id')})
+                cleanData.update({
+                    "expires": self._expiry(queryType, esiResponse),
+                    "etag": esiResponse.headers.get('ETag')
+                })
+                return cleanData
+
+            case 304 if cachedEntry is not None:
+                self._breaker(queryType).record_success()
+                self.statistics['not_modified']+=1
+                return dict(cachedEntry, expires=self._expiry(queryType, esiResponse))
+
+            case 400 | 404:
+                # The id is invalid or does not exist, remembered for a while so later kills do not ask again
+                logging.error("ESI Query returned " + str(esiResponse.status_code) + " for " + queryType + " " + str(queryValue))
+                self._breaker(queryType).record_success()
+                self._add_negative(queryType, queryValue)
+                raise ESILookupError("ESI Response was not valid")
+
+            case _:
+                if esiResponse.text:
+                    logging.error("ESI Query returned non 200 response: " + str(esiResponse.status_code) + " Data: " + str(esiResponse.text))
+                else:
+                    logging.error("ESI Query returned non 200 response: " + str(esiResponse.status_code))
+                self._record_failure(queryType)
+                raise ESILookupError("ESI Response was not valid")
@@ -0,0 +1,276 @@
+# zKillboardMonitor - Feed filters and the compiled feed index
+import json
+import logging
+
+# Class FeedFilter - Filter expression of a filter feed, compiled once into short-circuiting predicates
+class FeedFilter(object):
+    # Relative cost of each condition, all and any evaluate their cheapest conditions first so those needing ESI run last
+    costs = {
+        'value': 0,
+        'attackers': 0,
+        'solo': 0,
+        'victim_ship_type': 0,
+        'label': 1,
+        'entity': 1,
+        'location': 1,
+        'security': 5,
+        'victim_ship_group': 10
+    }
+    location_costs = {"system_id": 1, "constellation_id": 10, "region_id": 10}
+
+    def __init__(self, expression):
+        # Entity conditions not under a not, used to decide between Loss and Kill
+        self.entities = []
+        # Every entity type read, and whether any condition needs ESI or the universe map rather than the killmail alone
+        self.entity_types = set()
+        self.lookups = False
+        self.predicate, self.cost = self._compile(expression, False)
+
+    @classmethod
+    def from_feed(cls, feed):
+        # Filter equivalent to an entity, location or label feed
+        match feed['feed_type']:
+            case "entity":
+                return cls({"entity": feed['entity']})
+            case "location":
+                return cls({"location": feed['location']})
+            case "label":
+                return cls({"label": feed['label']['zkb_label']})
+            case "filter":
+                return cls(feed['filter'])
+        raise ValueError("unknown feed_type " + str(feed['feed_type']))
+
+    def _range(self, name: str, value):
+        if not isinstance(value, dict) or not value.keys() <= {"min", "max"} or not all(isinstance(bound, (int, float)) and not isinstance(bound, bool) for bound in value.values()):
+            raise ValueError(name + " requires a min and/or max number")
+        return value.get('min', float("-inf")), value.get('max', float("inf"))
+
+    def _ids(self, name: str, value):
+        if not isinstance(value, list) or not all(isinstance(id, int) for id in value):
+            raise ValueError(name + " requires a list of integer IDs")
+        return frozenset(value)
+
+    def _compile(self, node, negated: bool):
+        # Returns (predicate(killmail, esiLookup), cost)
+        if not isinstance(node, dict) or len(node) != 1:
+            raise ValueError("each filter condition must be an object with exactly one key, got " + json.dumps(node))
+        operator, value = next(iter(node.items()))
+        match operator:
+            case "all" | "any":
+                if not isinstance(value, list) or not value:
+                    raise ValueError(operator + " requires a non empty list of conditions")
+                compiled = sorted((self._compile(child, negated) for child in value), key=lambda child: child[1])
+                predicates = tuple(predicate for predicate, cost in compiled)
+                return (self._all(predicates) if operator == "all" else self._any(predicates)), sum(cost for predicate, cost in compiled)
+            case "not":
+                predicate, cost = self._compile(value, not negated)
+                return (lambda killmail, esiLookup: not predicate(killmail, esiLookup)), cost
+            case "entity":
+                if not isinstance(value, dict) or not isinstance(value.get('entity_type'), str) or not isinstance(value.get('entity_id'), int):
+                    raise ValueError("entity requires an entity_type and an integer entity_id")
+                role = value.get('role')
+                if role not in (None, "victim", "attacker"):
+                    raise ValueError("entity role must be one of [victim, attacker]")
+                entityType = value['entity_type']
+                entityID = value['entity_id']
+                self.entity_types.add(entityType)
+                if not negated:
+                    self.entities.append((entityType, entityID, role))
+                if role == "victim":
+                    predicate = lambda killmail, esiLookup: self._victim_is(killmail, entityType, entityID)
+                elif role == "attacker":
+                    predicate = lambda killmail, esiLookup: self._attacker_is(killmail, entityType, entityID)
+                else:
+                    predicate = lambda killmail, esiLookup: self._victim_is(killmail, entityType, entityID) or self._attacker_is(killmail, entityType, entityID)
+                return predicate, self.costs['entity']
+            case "location":
+                if not isinstance(value, dict) or value.get('location_type') not in self.location_costs or not isinstance(value.get('location_id'), int):
+                    raise ValueError("location requires a location_type of [system_id, constellation_id, region_id] and an integer location_id")
+                locationID = value['location_id']
+                if value['location_type'] != "system_id":
+                    self.lookups = True
+                match value['location_type']:
+                    case "system_id":
+                        predicate = lambda killmail, esiLookup: killmail.system_id == locationID
+                    case "constellation_id":
+                        predicate = lambda killmail, esiLookup: killmail.get_location_data(esiLookup) and killmail.kill_location_data['locationConstellationID'] == locationID
+                    case "region_id":
+                        predicate = lambda killmail, esiLookup: killmail.get_location_data(esiLookup) and killmail.kill_location_data['locationRegionID'] == locationID
+                return predicate, self.location_costs[value['location_type']]
+            case "label":
+                if not isinstance(value, str):
+                    raise ValueError("label requires a zKillboard label")
+                return (lambda killmail, esiLookup: value in killmail.labels), self.costs['label']
+            case "value":
+                minimum, maximum = self._range(operator, value)
+                return (lambda killmail, esiLookup: minimum <= killmail.total_value <= maximum), self.costs['value']
+            case "attackers":
+                minimum, maximum = self._range(operator, value)
+                return (lambda killmail, esiLookup: minimum <= len(killmail.kill_raw_data['attackers']) <= maximum), self.costs['attackers']
+            case "security":
+                minimum, maximum = self._range(operator, value)
+                self.lookups = True
+                return (lambda killmail, esiLookup: self._security_between(killmail, esiLookup, minimum, maximum)), self.costs['security']
+            case "solo":
+                if not isinstance(value, bool):
+                    raise ValueError("solo requires true or false")
+                return (lambda killmail, esiLookup: bool(killmail.kill_zkill_data.get('solo', False)) == value), self.costs['solo']
+            case "victim_ship_type":
+                typeIDs = self._ids(operator, value)
+                return (lambda killmail, esiLookup: killmail.victim_ship_type_id in typeIDs), self.costs['victim_ship_type']
+            case "victim_ship_group":
+                groupIDs = self._ids(operator, value)
+                self.lookups = True
+                return (lambda killmail, esiLookup: esiLookup.lookup_parent("type_id", killmail.victim_ship_type_id).get('parent') in groupIDs), self.costs['victim_ship_group']
+            case _:
+                raise ValueError("unknown filter condition " + str(operator))
+
+    @staticmethod
+    def _all(predicates):
+        def predicate(killmail, esiLookup):
+            for condition in predicates:
+                if not condition(killmail, esiLookup):
+                    return False
+            return True
+        return predicate
+
+    @staticmethod
+    def _any(predicates):
+        def predicate(killmail, esiLookup):
+            for condition in predicates:
+                if condition(killmail, esiLookup):
+                    return True
+            return False
+        return predicate
+
+    @staticmethod
+    def _victim_is(killmail, entityType: str, entityID: int):
+        if entityType in killmail.victim_ids:
+            return killmail.victim_ids[entityType] == entityID
+        return killmail.kill_raw_data['victim'].get(entityType) == entityID
+
+    @staticmethod
+    def _attacker_is(killmail, entityType: str, entityID: int):
+        attackerIDs = killmail.attacker_ids.get(entityType)
+        if attackerIDs is None:
+            return any(attacker.get(entityType) == entityID for attacker in killmail.kill_raw_data['attackers'])
+        return entityID in attackerIDs
+
+    @staticmethod
+    def _security_between(killmail, esiLookup, minimum: float, maximum: float):
+        # Security status is only held by the universe map, kills in systems it does not know never match
+        universeMap = esiLookup.universe_map
+        if universeMap is None or not universeMap.has_system(killmail.system_id):
+            return False
+        return minimum <= universeMap.get(killmail.system_id)[2] <= maximum
+
+    def relationship(self, killmail, esiLookup):
+        # Returns "None" if the killmail does not match, otherwise "Loss" when a filtered entity is the victim
+        # and no filtered entity is among the attackers, as entity feeds do, else "Kill"
+        if not self.predicate(killmail, esiLookup):
+            return "None"
+        loss = False
+        for entityType, entityID, role in self.entities:
+            if role != "victim" and self._attacker_is(killmail, entityType, entityID):
+                return "Kill"
+            if role != "attacker" and self._victim_is(killmail, entityType, entityID):
+                loss = True
+        return "Loss" if loss else "Kill"
+
+# Class FeedIndex - Feeds compiled into hash indexes so a killmail can be matched against all feeds in one pass over its ids
+class FeedIndex(object):
+    def __init__(self, feeds):
+        self.feeds = feeds
+        # Entity type -> entity id -> feed positions
+        self.entity_index = {}
+        self.system_index = {}
+        self.constellation_index = {}
+        self.region_index = {}
+        self.label_index = {}
+        # (position, FeedFilter) for filter feeds, these cannot be indexed and are evaluated in turn
+        self.filter_feeds = []
+        self.pod_excluded = set()
+        self.location_lookup_required = False
+        self.location_lookup_required_for_pods = False
+        self._compile()
+
+    def _add(self, index, key, position):
+        if key is not None:
+            index.setdefault(key, []).append(position)
+
+    def _compile(self):
+        for position, feed in enumerate(self.feeds):
+            if feed['include_empty_pods'] == False:
+                self.pod_excluded.add(position)
+            match feed['feed_type']:
+                case "entity":
+                    self._add(self.entity_index.setdefault(feed['entity']['entity_type'], {}), feed['entity']['entity_id'], position)
+                case "location":
+                    match feed['location']['location_type']:
+                        case "system_id":
+                            self._add(self.system_index, feed['location']['location_id'], position)
+                        case "constellation_id":
+                            self._add(self.constellation_index, feed['location']['location_id'], position)
+                        case "region_id":
+                            self._add(self.region_index, feed['location']['location_id'], position)
+                        case _:
+                            logging.warning("FeedIndex: Invalid location_type for feed: " + feed['name'])
+                            continue
+                    if feed['location']['location_type'] != "system_id":
+                        self.location_lookup_required = True
+                        if position not in self.pod_excluded:
+                            self.location_lookup_required_for_pods = True
+                case "label":
+                    self._add(self.label_index, feed['label']['zkb_label'], position)
+                case "filter":
+                    self.filter_feeds.append((position, FeedFilter(feed['filter'])))
+                case _:
+                    logging.warning("FeedIndex: Invalid feed_type for feed: " + feed['name'])
+        logging.info("FeedIndex: Compiled " + str(len(self.feeds)) + " feeds.")
+
+    def match(self, killmail, esiLookup):
+        # Returns a dict of feed position -> relationship for every feed relevant to the killmail
+        matches = {}
+        emptyPod = killmail.is_empty_pod()
+
+        if self.entity_index:
+            victim = killmail.kill_raw_data['victim']
+            for entityType, entityIndex in self.entity_index.items():
+                entityID = killmail.victim_ids[entityType] if entityType in killmail.victim_ids else victim.get(entityType)
+                for position in entityIndex.get(entityID, ()):
+                    matches[position] = "Loss"
+            # Yes even if both the attacker and victim are the feed tracked entity we class this as a kill for simplicity.
+            for entityType, entityIndex in self.entity_index.items():
+                attackerIDs = killmail.attacker_ids.get(entityType)
+                if attackerIDs is None:
+                    attackerIDs = {attacker.get(entityType) for attacker in killmail.kill_raw_data['attackers']}
+                for entityID in entityIndex.keys() & attackerIDs:
+                    for position in entityIndex[entityID]:
+                        matches[position] = "Kill"
+
+        for position in self.system_index.get(killmail.system_id, ()):
+            matches[position] = "Kill"
+
+        if self.location_lookup_required and (not emptyPod or self.location_lookup_required_for_pods):
+            killmail.get_location_data(esiLookup)
+            for position in self.constellation_index.get(killmail.kill_location_data['locationConstellationID'], ()):
+                matches[position] = "Kill"
+            for position in self.region_index.get(killmail.kill_location_data['locationRegionID'], ()):
+                matches[position] = "Kill"
+
+        if self.label_index:
+            for label in killmail.labels:
+                for position in self.label_index.get(label, ()):
+                    matches[position] = "Kill"
+
+        for position, feedFilter in self.filter_feeds:
+            if emptyPod and position in self.pod_excluded:
+                continue
+            relationship = feedFilter.relationship(killmail, esiLookup)
+            if relationship != "None":
+                matches[position] = relationship
+
+        if emptyPod:
+            for position in self.pod_excluded.intersection(matches):
+                del matches[position]
+        return matches
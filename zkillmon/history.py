@@ -0,0 +1,202 @@
+# zKillboardMonitor - Local history of processed killmails
+import calendar
+import json
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+import zlib
+
+from zkillmon.killmail import Killmail
+
+# Class KillmailHistory - Compact SQLite store of recent killmails indexed by entity, system and time, written in batches off the hot path
+class KillmailHistory(object):
+    # Entity types are stored as their position in Killmail.entity_types
+    entity_types = {entityType: number for number, entityType in enumerate(Killmail.entity_types)}
+    roles = {"victim": 0, "attacker": 1}
+
+    def __init__(self, sqlitePath, retentionHours: float = 72, writeBatchSize: int = 100, writeFlushInterval: float = 5, compactInterval: float = 3600, queueSize: int = 10000):
+        self.path = sqlitePath
+        self.retention = retentionHours * 3600
+        self.write_batch_size = writeBatchSize
+        self.write_flush_interval = writeFlushInterval
+        self.compact_interval = compactInterval
+        # Killmails waiting for the writer, recording drops killmails rather than blocking processing when full
+        self.queue = queue.Queue(queueSize)
+        self.local = threading.local()
+        self.statistics = {
+            'recorded': 0,
+            'written': 0,
+            'dropped': 0,
+            'expired': 0
+        }
+        initialize = not os.path.exists(self.path)
+        sqlite_connection = self._connection()
+        if initialize:
+            with sqlite_connection:
+                # auto_vacuum has to be set before the first table is created
+                sqlite_connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                sqlite_connection.execute("""
+                    CREATE TABLE kills (
+                        KillID               INTEGER NOT NULL  PRIMARY KEY,
+                        Recieved             REAL NOT NULL,
+                        KillTime             REAL NOT NULL,
+                        SystemID             INTEGER NOT NULL,
+                        Value                REAL NOT NULL,
+                        Labels               TEXT NOT NULL,
+                        Package              BLOB NOT NULL
+                    )
+                """)
+                sqlite_connection.execute("CREATE INDEX kills_recieved ON kills ( Recieved )")
+                sqlite_connection.execute("CREATE INDEX kills_system ON kills ( SystemID, Recieved )")
+                # One row per distinct entity on each side of a kill
+                sqlite_connection.execute("""
+                    CREATE TABLE kill_entities (
+                        EntityID             INTEGER NOT NULL,
+                        EntityType           INTEGER NOT NULL,
+                        Role                 INTEGER NOT NULL,
+                        KillID               INTEGER NOT NULL,
+                        PRIMARY KEY ( EntityID, EntityType, Role, KillID )
+                    ) WITHOUT ROWID
+                """)
+                sqlite_connection.execute("CREATE INDEX kill_entities_kill ON kill_entities ( KillID )")
+            logging.warning("KillmailHistory: History created at " + self.path)
+        self.writer = threading.Thread(target=self._writer, name="history-writer", daemon=True)
+        self.writer.start()
+        logging.info("KillmailHistory: Initialized at " + self.path)
+
+    def _connection(self):
+        # The writer thread and queries each use their own connection
+        sqlite_connection = getattr(self.local, 'connection', None)
+        if sqlite_connection is None:
+            sqlite_connection = sqlite3.connect(self.path)
+            sqlite_connection.execute("PRAGMA journal_mode=WAL")
+            sqlite_connection.execute("PRAGMA synchronous=NORMAL")
+            self.local.connection = sqlite_connection
+        return sqlite_connection
+
+    def record(self, killmail, responseJson):
+        # Called for every processed killmail, all encoding is left to the writer thread
+        try:
+            self.queue.put_nowait((killmail, responseJson['package'], time.time()))
+            self.statistics['recorded']+=1
+        except queue.Full:
+            self.statistics['dropped']+=1
+
+    def _rows(self, killmail, package, recieved: float):
+        killTime = calendar.timegm(killmail.kill_timestamp)
+        labels = ",".join(killmail.labels)
+        compressed = zlib.compress(json.dumps(package, separators=(",", ":")).encode("utf-8"))
+        killRow = (killmail.kill_id, recieved, killTime, killmail.system_id, killmail.total_value or 0, labels, compressed)
+        entityRows = []
+        for entityType, number in self.entity_types.items():
+            if killmail.victim_ids.get(entityType) is not None:
+                entityRows.append((killmail.victim_ids[entityType], number, self.roles['victim'], killmail.kill_id))
+            for entityID in killmail.attacker_ids[entityType]:
+                entityRows.append((entityID, number, self.roles['attacker'], killmail.kill_id))
+        return killRow, entityRows
+
+    def _writer(self):
+        # None on the queue flushes what is buffered and stops the writer
+        pending = []
+        flushDue = None
+        expireDue = time.monotonic()
+        while True:
+            timeout = max(0, min(expireDue, flushDue or expireDue) - time.monotonic())
+            try:
+                item = self.queue.get(timeout=timeout)
+            except queue.Empty:
+                item = ()
+            if item:
+                if flushDue is None:
+                    flushDue = time.monotonic() + self.write_flush_interval
+                try:
+                    pending.append(self._rows(*item))
+                except (KeyError, TypeError, ValueError):
+                    logging.error("KillmailHistory: Could not record kill " + str(item[0].kill_id))
+            # Written once the batch is full, the oldest has waited write_flush_interval, or on close
+            if pending and (not item or len(pending) >= self.write_batch_size or time.monotonic() >= flushDue):
+                self._flush(pending)
+                pending = []
+                flushDue = None
+            if time.monotonic() >= expireDue:
+                self._expire()
+                expireDue = time.monotonic() + self.compact_interval
+            if item is None:
+                return
+
+    def _flush(self, pending):
+        sqlite_connection = self._connection()
+        try:
+            with sqlite_connection:
+                # Replayed killmails are already held and ignored
+                sqlite_connection.executemany("INSERT OR IGNORE INTO kills VALUES(?, ?, ?, ?, ?, ?, ?)", [killRow for killRow, entityRows in pending])
+                sqlite_connection.executemany("INSERT OR IGNORE INTO kill_entities VALUES(?, ?, ?, ?)", [entityRow for killRow, entityRows in pending for entityRow in entityRows])
+        except sqlite3.Error:
+            logging.error("KillmailHistory: Failed to write " + str(len(pending)) + " kills.")
+            logging.exception("KillmailHistory:")
+            return
+        self.statistics['written']+=len(pending)
+        logging.debug("KillmailHistory: Wrote " + str(len(pending)) + " kills")
+
+    def _expire(self):
+        # Remove kills older than the retention period, then return the freed pages and truncate the write ahead log
+        sqlite_connection = self._connection()
+        cutoff = time.time() - self.retention
+        with sqlite_connection:
+            sqlite_connection.execute("DELETE FROM kill_entities WHERE KillID IN (SELECT KillID FROM kills WHERE Recieved < ?)", (cutoff,))
+            expired = sqlite_connection.execute("DELETE FROM kills WHERE Recieved < ?", (cutoff,)).rowcount
+        sqlite_connection.execute("PRAGMA incremental_vacuum")
+        sqlite_connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.statistics['expired']+=expired
+        logging.info("KillmailHistory: Expired " + str(expired) + " kills")
+
+    def candidates(self, feeds, since: float):
+        # Yields RedisQ style responses recieved since the given time which could match any of the feeds, oldest first.
+        # Entity and system feeds are narrowed through the indexes, any other feed needs every kill in the period.
+        if not feeds:
+            return
+        conditions = []
+        parameters = [since]
+        for feed in feeds:
+            match feed['feed_type']:
+                case "entity" if feed['entity']['entity_type'] in self.entity_types:
+                    conditions.append("KillID IN (SELECT KillID FROM kill_entities WHERE EntityID = ? AND EntityType = ?)")
+                    parameters.extend((feed['entity']['entity_id'], self.entity_types[feed['entity']['entity_type']]))
+                case "location" if feed['location']['location_type'] == "system_id":
+                    conditions.append("SystemID = ?")
+                    parameters.append(feed['location']['location_id'])
+                case _:
+                    conditions = None
+                    break
+        query = "SELECT Package FROM kills WHERE Recieved >= ?"
+        if conditions is not None:
+            query+=" AND (" + " OR ".join(conditions) + ")"
+        else:
+            parameters = [since]
+        for (compressed,) in self._connection().execute(query + " ORDER BY Recieved", parameters):
+            yield {"package": json.loads(zlib.decompress(compressed))}
+
+    def matches(self, feedIndex, since: float, esiLookup, batchSize: int = 1000):
+        # Evaluates a compiled feed index against the kills recieved since the given time, yields each relevant Killmail.
+        # Kills are matched in columnar blocks of batchSize, 1 matches each kill in turn.
+        if batchSize > 1:
+            from zkillmon.batch import BatchFeedMatcher, killmailBlocks
+            batchFeedMatcher = BatchFeedMatcher(feedIndex)
+            for killmails in killmailBlocks(self.candidates(feedIndex.feeds, since), batchSize):
+                yield from batchFeedMatcher.add_relevant_feeds(killmails, esiLookup)
+            return
+        for responseJson in self.candidates(feedIndex.feeds, since):
+            killmail = Killmail(responseJson)
+            if killmail.add_relevant_feeds(feedIndex, esiLookup):
+                yield killmail
+
+    def close(self):
+        self.queue.put(None)
+        self.writer.join(30)
+        logging.info("KillmailHistory: Closed")
+
+    def get_statistics(self):
+        return self.statistics
@@ -0,0 +1,295 @@
+# zKillboardMonitor - Killmails and their enrichment
+import logging
+import time
+
+# Class Killmail - Used to store recieved killmails and functionality to retrieve further information and relevance for processing
+class Killmail(object):
+    # Every RedisQ package becomes a Killmail and most are discarded as irrelevant, so only the ids filtering
+    # needs are extracted up front. The timestamp and dictionaries used for enrichment are created on first use.
+    __slots__ = (
+        'kill_id',
+        'kill_raw_data',
+        'kill_zkill_data',
+        'system_id',
+        'victim_ship_type_id',
+        'victim_ids',
+        'attacker_ids',
+        'labels',
+        'total_value',
+        'kill_additional_data_pulled',
+        'kill_location_data_pulled',
+        'kill_feeds_relevant',
+        'kill_feeds_to_alert',
+        'kill_webhooks_to_alert',
+        '_kill_timestamp',
+        '_kill_additional_data',
+        '_kill_location_data'
+    )
+    capsule_ship_ids = (670, 33328)
+    # Entity id fields extracted from the victim and attackers
+    entity_types = ("character_id", "corporation_id", "alliance_id", "faction_id")
+
+    def __init__(self, responseJson):
+        # ToDo: Include logic here to determine if package is valid
+        # Populate class variables from recieved data, the raw dicts are referenced rather than copied
+        package = responseJson['package']
+        self.kill_id = package['killID']
+        self.kill_raw_data = package['killmail']
+        self.kill_zkill_data = package['zkb']
+        victim = self.kill_raw_data['victim']
+        self.system_id = self.kill_raw_data['solar_system_id']
+        self.victim_ship_type_id = victim['ship_type_id']
+        # Entity type -> id for the victim and entity type -> set of ids for the attackers
+        self.victim_ids = {entityType: victim.get(entityType) for entityType in self.entity_types}
+        attackers = self.kill_raw_data['attackers']
+        self.attacker_ids = {}
+        for entityType in self.entity_types:
+            entityIDs = {attacker.get(entityType) for attacker in attackers}
+            entityIDs.discard(None)
+            self.attacker_ids[entityType] = entityIDs
+        self.labels = self.kill_zkill_data.get('labels') or ()
+        self.total_value = self.kill_zkill_data['totalValue']
+        self.kill_additional_data_pulled = False
+        self.kill_location_data_pulled = False
+        self.kill_feeds_relevant = False
+        self.kill_feeds_to_alert = ()
+        self.kill_webhooks_to_alert = None
+        self._kill_timestamp = None
+        self._kill_additional_data = None
+        self._kill_location_data = None
+
+    @property
+    def kill_timestamp(self):
+        if self._kill_timestamp is None:
+            self._kill_timestamp = time.strptime(self.kill_raw_data['killmail_time'],"%Y-%m-%dT%H:%M:%S%z")
+        return self._kill_timestamp
+
+    @property
+    def kill_additional_data(self):
+        if self._kill_additional_data is None:
+            self._kill_additional_data = {}
+        return self._kill_additional_data
+
+    @property
+    def kill_location_data(self):
+        if self._kill_location_data is None:
+            self._kill_location_data = {}
+        return self._kill_location_data
+
+    def get_additional_data(self, esiLookup):
+        # Method to determine what data to request from ESI, construct URL and Parameters and call
+        # Returned data will populate self.kill_additional_data
+        if self.kill_additional_data_pulled:
+            return True
+        else:
+            # ESI Data
+            logging.debug("get_additional_data: Fetching Additional Data from ESI for: " + str(self.kill_id))
+            victim = self.kill_raw_data['victim']
+            killer = next(
+                attacker for attacker in self.kill_raw_data['attackers'] if attacker['final_blow'] == True
+            )
+
+            # Collect every name this killmail needs and resolve them together
+            victimShipQuery = ("type_id", victim['ship_type_id'])
+            # If victim is not a character it must be a corporation (for structure and corporation anchored object lossmails)
+            if "character_id" in victim.keys():
+                self.kill_additional_data['victimType'] = "Character"
+                self.kill_additional_data['victimID'] = victim['character_id']
+                victimQuery = ("character_id", victim['character_id'])
+            else:
+                self.kill_additional_data['victimType'] = "Corporation"
+                self.kill_additional_data['victimID'] = victim['corporation_id']
+                victimQuery = ("corporation_id", victim['corporation_id'])
+
+            if "alliance_id" in victim.keys():
+                self.kill_additional_data['victimGroupType'] = "Alliance"
+                self.kill_additional_data['victimGroupID'] = victim['alliance_id']
+                victimGroupQuery = ("alliance_id", victim['alliance_id'])
+            else:
+                self.kill_additional_data['victimGroupType'] = "Corporation"
+                self.kill_additional_data['victimGroupID'] = victim['corporation_id']
+                victimGroupQuery = ("corporation_id", victim['corporation_id'])
+
+            killerCharacterQuery = None
+            if "character_id" in killer.keys():
+                killerCharacterQuery = ("character_id", killer['character_id'])
+
+            killerShipQuery = None
+            if "ship_type_id" in killer.keys():
+                killerShipQuery = ("type_id", killer['ship_type_id'])
+
+            killerGroupQuery = None
+            if "alliance_id" in killer.keys():
+                killerGroupQuery = ("alliance_id", killer['alliance_id'])
+            elif "corporation_id" in killer.keys():
+                killerGroupQuery = ("corporation_id", killer['corporation_id'])
+            elif "faction_id" in killer.keys():
+                killerGroupQuery = ("faction", killer['faction_id'])
+
+            queries = {victimShipQuery, victimQuery, victimGroupQuery, killerCharacterQuery, killerShipQuery, killerGroupQuery}
+            queries.discard(None)
+            names = esiLookup.resolve_many(queries)
+
+            self.kill_additional_data['victim_ship_name'] = names[victimShipQuery]['name']
+            self.kill_additional_data['victim_name'] = names[victimQuery]['name']
+            self.kill_additional_data['victim_group_name'] = names[victimGroupQuery]['name']
+
+            if killerCharacterQuery is not None:
+                self.kill_additional_data['killerCharacterID'] = killer['character_id']
+                self.kill_additional_data['killer_character_name'] = names[killerCharacterQuery]['name']
+                self.kill_additional_data['killer_zkillboard_URL']  = "https://zkillboard.com/character/{}/".format(
+                    str(self.kill_additional_data['killerCharacterID'])
+                )
+            elif self.kill_zkill_data['npc'] == True:
+                self.kill_additional_data['killer_character_name'] = "NPC"
+                self.kill_additional_data['killer_zkillboard_URL']  = None
+            else:
+                self.kill_additional_data['killer_character_name'] = None
+                self.kill_additional_data['killer_zkillboard_URL']  = None
+
+            if killerShipQuery is not None:
+                self.kill_additional_data['killer_ship_name'] = names[killerShipQuery]['name']
+            else:
+                self.kill_additional_data['killer_ship_name'] = None
+
+            if killerGroupQuery is not None:
+                self.kill_additional_data['killer_group_name'] = names[killerGroupQuery]['name']
+            else:
+                self.kill_additional_data['killer_group_name'] = None
+
+            # Get Location Data
+            self.get_location_data(esiLookup)
+
+            # Other Data
+            self.kill_additional_data['zKillboardURL'] = "https://zkillboard.com/kill/{}/".format(
+                str(self.kill_id)
+            )
+
+            self.kill_additional_data['victim_zkillboard_URL'] = "https://zkillboard.com/{}/{}/".format(
+                self.kill_additional_data['victimType'].lower(),
+                str(self.kill_additional_data['victimID'])
+            )
+
+            self.kill_additional_data['victim_ship_image_URL'] = "https://images.evetech.net/types/{}/render?size=64".format(
+                str(self.kill_raw_data['victim']['ship_type_id'])
+            )
+
+            if self.kill_additional_data['victimGroupType'] == "Alliance":
+                self.kill_additional_data['victim_group_image_URL'] = "https://images.evetech.net/alliances/{}/logo".format(
+                    str(self.kill_additional_data['victimGroupID'])
+                )
+            elif self.kill_additional_data['victimGroupType'] == "Corporation":
+                self.kill_additional_data['victim_group_image_URL'] = "https://images.evetech.net/corporations/{}/logo".format(
+                    str(self.kill_additional_data['victimGroupID'])
+                )
+            else:
+                self.kill_additional_data['victim_group_image_URL'] = "https://images.evetech.net/alliances/1/logo"
+            self.kill_additional_data['killer_count'] = len(self.kill_raw_data['attackers'])
+
+            self.kill_additional_data_pulled = True
+            return True
+
+    def get_location_data(self, esiLookup):
+        if self.kill_location_data_pulled:
+            return True
+        else:
+            systemID = self.kill_raw_data['solar_system_id']
+            universeMap = esiLookup.universe_map
+            if universeMap is not None and universeMap.has_system(systemID):
+                # Static universe data needs no I/O
+                constellationID, regionID, security = universeMap.get(systemID)
+                self.kill_location_data['location_system_id'] = systemID
+                self.kill_location_data['location_system'] = universeMap.get_name(systemID)
+                self.kill_location_data['locationConstellationID'] = constellationID
+                self.kill_location_data['locationConstellation'] = universeMap.get_name(constellationID)
+                self.kill_location_data['locationRegionID'] = regionID
+                self.kill_location_data['locationRegion'] = universeMap.get_name(regionID)
+                self.kill_location_data['location_security'] = security
+                self.kill_location_data_pulled = True
+                return True
+            logging.debug("get_location_data: Fetching Location Data from ESI for: " +str(self.kill_id))
+            system = esiLookup.lookup(
+                "system_id",
+                self.kill_raw_data['solar_system_id']
+            )
+
+            constellation = esiLookup.lookup(
+                "constellation_id",
+                system['parent']
+            ) if system.get('parent') is not None else esiLookup.placeholder("constellation_id", None)
+
+            region = self.kill_location_data['locationRegion'] = esiLookup.lookup(
+                "region_id",
+                constellation['parent']
+            ) if constellation.get('parent') is not None else esiLookup.placeholder("region_id", None)
+
+            self.kill_location_data['location_system_id'] = self.kill_raw_data['solar_system_id']
+            self.kill_location_data['location_system'] = system['name']
+            self.kill_location_data['locationConstellationID'] = system['parent']
+            self.kill_location_data['locationConstellation'] = constellation['name']
+            self.kill_location_data['locationRegionID'] = constellation['parent']
+            self.kill_location_data['locationRegion'] = region['name']
+            self.kill_location_data_pulled = True
+            return True
+
+    def is_empty_pod(self):
+        return self.victim_ship_type_id in self.capsule_ship_ids and self.total_value == 10000
+
+    def _add_relevant_feed(self, feed, relationship):
+        # Uniqueness check
+        # Prevents a webhook from recieving multiple instances of the same killmail
+        if self.kill_webhooks_to_alert is None:
+            self.kill_feeds_to_alert = []
+            self.kill_webhooks_to_alert = set()
+        elif feed['webhook'] in self.kill_webhooks_to_alert:
+            logging.debug("add_relevant_feeds: Kill: " + str(self.kill_id) + " is relevant to feed: " + feed['name'] + " but considered duplicate.")
+            return False
+        relevantFeed = {}
+        relevantFeed['name'] = feed['name']
+        relevantFeed['webhook'] = feed['webhook']
+        relevantFeed['relationship'] = relationship
+        if feed.get('digest') is not None:
+            relevantFeed['digest'] = feed['digest']
+        self.kill_feeds_to_alert.append(relevantFeed)
+        self.kill_webhooks_to_alert.add(feed['webhook'])
+        self.kill_feeds_relevant = True
+        logging.debug("add_relevant_feeds: Kill: " + str(self.kill_id) + " is relevant to feed: " + feed['name'])
+        return True
+
+    def add_relevant_feeds(self, feedIndex, esiLookup):
+        # Probe the compiled feed index with the ids of this killmail rather than checking every feed in turn.
+        # Matches are applied in configuration order so the first matching feed for each webhook is the one alerted.
+        logging.debug("add_relevant_feeds: Checking relevance for Kill: " + str(self.kill_id))
+        return self.add_matched_feeds(feedIndex.feeds, sorted(feedIndex.match(self, esiLookup).items()))
+
+    def add_matched_feeds(self, feeds, matches):
+        # Applies (feed position, relationship) pairs, which must be in feed position order
+        for position, relationship in matches:
+            self._add_relevant_feed(feeds[position], relationship)
+        return self.kill_feeds_relevant
+
+    def get_discord_alert_data(self):
+        # If relevant feeds are found, process alerts
+        if self.kill_additional_data_pulled == True:
+            alertData = {
+                'victim_name': self.kill_additional_data['victim_name'],
+                'victim_zkillboard_URL': self.kill_additional_data['victim_zkillboard_URL'],
+                'victim_ship_name': self.kill_additional_data['victim_ship_name'],
+                'victim_ship_image_URL': self.kill_additional_data['victim_ship_image_URL'],
+                'victim_group_name': self.kill_additional_data['victim_group_name'],
+                'victim_group_image_URL': self.kill_additional_data['victim_group_image_URL'],
+                'killer_character_name': self.kill_additional_data['killer_character_name'],
+                'killer_zkillboard_URL': self.kill_additional_data['killer_zkillboard_URL'],
+                'killer_ship_name': self.kill_additional_data['killer_ship_name'],
+                'killer_group_name': self.kill_additional_data['killer_group_name'],
+                'kill_location_system': self.kill_location_data['location_system'],
+                'kill_location_region': self.kill_location_data['locationRegion'],
+                'kill_zkillboard_URL': self.kill_additional_data['zKillboardURL'],
+                'killer_count': self.kill_additional_data['killer_count'],
+                'kill_zkillboard_value': self.kill_zkill_data['totalValue']
+            }
+            return alertData
+        # Else Error or automatically attempt fetch?
+    def get_relevant_feed_information(self):
+        if self.kill_feeds_relevant == True:
+            return self.kill_feeds_to_alert
@@ -0,0 +1,131 @@
+# zKillboardMonitor - Prometheus metrics registry and HTTP endpoint
+import logging
+import threading
+
+# Class Metrics - Registry of counters and histograms exposed in the Prometheus text format
+class Metrics(object):
+    default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}
+        self.histograms = {}
+        # Callables returning (name, labels, value) gauges read at scrape time
+        self.collectors = []
+
+    def describe(self, name: str, text: str):
+        self.help[name] = text
+
+    def _key(self, name: str, labels):
+        return name, tuple(sorted(labels.items())) if labels else ()
+
+    def inc(self, name: str, labels: dict = None, value: float = 1):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, seconds: float, labels: dict = None):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = [[0] * len(self.default_buckets), 0.0, 0]
+            for bucket, bound in enumerate(self.default_buckets):
+                if seconds <= bound:
+                    histogram[0][bucket]+=1
+            histogram[1]+=seconds
+            histogram[2]+=1
+
+    def register_collector(self, collector):
+        self.collectors.append(collector)
+
+    def _labels(self, labels, extra: tuple = ()):
+        labels = labels + extra
+        if not labels:
+            return ""
+        return "{" + ",".join('{}="{}"'.format(key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels) + "}"
+
+    def render(self):
+        lines = []
+        described = set()
+
+        def header(name: str, metricType: str):
+            if name not in described:
+                described.add(name)
+                if name in self.help:
+                    lines.append("# HELP " + name + " " + self.help[name])
+                lines.append("# TYPE " + name + " " + metricType)
+
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, [list(value[0]), value[1], value[2]]) for key, value in self.histograms.items())
+        for (name, labels), value in counters:
+            header(name, "counter")
+            lines.append(name + self._labels(labels) + " " + str(value))
+        for (name, labels), (buckets, total, count) in histograms:
+            header(name, "histogram")
+            for bucket, bound in enumerate(self.default_buckets):
+                lines.append(name + "_bucket" + self._labels(labels, (("le", str(bound)),)) + " " + str(buckets[bucket]))
+            lines.append(name + "_bucket" + self._labels(labels, (("le", "+Inf"),)) + " " + str(count))
+            lines.append(name + "_sum" + self._labels(labels) + " " + str(total))
+            lines.append(name + "_count" + self._labels(labels) + " " + str(count))
+        for collector in self.collectors:
+            try:
+                gauges = collector()
+            except Exception:
+                logging.exception("Metrics: Collector failed")
+                continue
+            for name, labels, value in gauges:
+                header(name, "gauge")
+                lines.append(name + self._labels(tuple(sorted(labels.items())) if labels else ()) + " " + str(value))
+        return "\n".join(lines) + "\n"
+
+# Class MetricsServer - Serves the metrics registry over HTTP for Prometheus to scrape
+class MetricsServer(object):
+    def __init__(self, metricsRegistry, host: str = "127.0.0.1", port: int = 9150):
+        # Only imported when metrics are enabled
+        import http.server
+        registry = metricsRegistry
+
+        class MetricsHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.render().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                logging.debug("MetricsServer: " + format % args)
+
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+        self.server.daemon_threads = True
+        logging.info("MetricsServer: Listening on http://" + host + ":" + str(port) + "/metrics")
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, name="metrics-server", daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+metrics = Metrics()
+metrics.describe("zkillmon_redisq_polls_total", "RedisQ polls by result")
+metrics.describe("zkillmon_redisq_poll_seconds", "RedisQ long poll duration")
+metrics.describe("zkillmon_killmails_total", "Killmails processed by relevance")
+metrics.describe("zkillmon_killmails_duplicate_total", "Killmails recieved from more than one source")
+metrics.describe("zkillmon_kill_stage_seconds", "Time spent per killmail in each processing stage")
+metrics.describe("zkillmon_esi_requests_total", "ESI requests by query type")
+metrics.describe("zkillmon_esi_request_seconds", "ESI request duration by query type")
+metrics.describe("zkillmon_esi_cache_total", "ESI cache lookups by query type and result")
+metrics.describe("zkillmon_esi_circuit_open_total", "Times the circuit breaker for an ESI endpoint opened")
+metrics.describe("zkillmon_alerts_total", "Alerts queued or sent by feed")
+metrics.describe("zkillmon_discord_responses_total", "Discord webhook responses by webhook and status")
+metrics.describe("zkillmon_discord_send_seconds", "Discord webhook call duration by webhook")
+metrics.describe("zkillmon_http_requests_total", "HTTP requests by host and whether a pooled connection was reused")
+metrics.describe("zkillmon_http_phase_seconds", "HTTP connect, TLS handshake and time to first byte by host")
@@ -0,0 +1,149 @@
+# zKillboardMonitor - asyncio pipeline mode
+import asyncio
+import logging
+import time
+
+# Class AsyncPipeline - asyncio mode where RedisQ polling, enrichment and Discord delivery run as stages joined by bounded queues
+class AsyncPipeline(object):
+    def __init__(self, poller, killmailProcessor, enrichmentWorkers: int = 4, deliveryWorkers: int = 1, ingestQueueSize: int = 100, deliveryQueueSize: int = 100, backpressure: str = "block", statsInterval: float = 300):
+        self.poller = poller
+        self.killmail_processor = killmailProcessor
+        self.enrichment_workers = enrichmentWorkers
+        self.delivery_workers = deliveryWorkers
+        self.ingest_queue_size = ingestQueueSize
+        self.delivery_queue_size = deliveryQueueSize
+        # block: a full queue holds up the stage feeding it, drop_oldest: the oldest queued item is discarded
+        self.backpressure = backpressure
+        self.stats_interval = statsInterval
+        self.ingest_queue = None
+        self.delivery_queue = None
+        self.statistics = {
+            'ingest_dropped': 0,
+            'delivery_dropped': 0,
+            'enrichment_errors': 0,
+            'delivery_errors': 0,
+            'ingest_queue_depth_max': 0,
+            'delivery_queue_depth_max': 0
+        }
+        # Stage -> [count, total seconds, max seconds]
+        self.latency = {
+            'poll': [0, 0.0, 0.0],
+            'ingest_wait': [0, 0.0, 0.0],
+            'enrich': [0, 0.0, 0.0],
+            'delivery_wait': [0, 0.0, 0.0],
+            'deliver': [0, 0.0, 0.0]
+        }
+        if self.backpressure not in ("block", "drop_oldest"):
+            logging.warning("AsyncPipeline: Unknown backpressure mode " + str(self.backpressure) + ", using block")
+            self.backpressure = "block"
+
+    def _record(self, stage: str, started: float):
+        elapsed = time.monotonic() - started
+        latency = self.latency[stage]
+        latency[0]+=1
+        latency[1]+=elapsed
+        if elapsed > latency[2]:
+            latency[2] = elapsed
+
+    async def _put(self, queue, item, queueName: str):
+        if self.backpressure == "drop_oldest" and queue.full():
+            queue.get_nowait()
+            queue.task_done()
+            self.statistics[queueName + '_dropped']+=1
+            logging.warning("AsyncPipeline: " + queueName + " queue full, dropped oldest item")
+        await queue.put((time.monotonic(), item))
+        depth = queue.qsize()
+        if depth > self.statistics[queueName + '_queue_depth_max']:
+            self.statistics[queueName + '_queue_depth_max'] = depth
+
+    async def _poll(self):
+        # Killmails left unacknowledged in the spool by a previous run go first
+        for sequence, responseJson in await asyncio.to_thread(self.killmail_processor.recover):
+            await self._put(self.ingest_queue, (sequence, responseJson), 'ingest')
+        while self.poller.is_running:
+            started = time.monotonic()
+            responseJson, delay = await asyncio.to_thread(self.poller.poll_once)
+            self._record('poll', started)
+            if responseJson is not None:
+                sequence = await asyncio.to_thread(self.killmail_processor.accept, responseJson)
+                await self._put(self.ingest_queue, (sequence, responseJson), 'ingest')
+            elif delay:
+                await asyncio.sleep(delay)
+
+    async def _enrich(self):
+        while True:
+            queued, (sequence, responseJson) = await self.ingest_queue.get()
+            self._record('ingest_wait', queued)
+            try:
+                started = time.monotonic()
+                killmail = await asyncio.to_thread(self.killmail_processor.enrich, responseJson)
+                self._record('enrich', started)
+                if killmail.kill_feeds_relevant:
+                    await self._put(self.delivery_queue, (sequence, killmail), 'delivery')
+                elif sequence is not None:
+                    await asyncio.to_thread(self.killmail_processor.acknowledge, sequence)
+            except Exception:
+                self.statistics['enrichment_errors']+=1
+                logging.error("AsyncPipeline: Enrichment failed for killmail, skipping.")
+                logging.exception("AsyncPipeline:")
+            finally:
+                self.ingest_queue.task_done()
+
+    async def _deliver(self):
+        while True:
+            queued, (sequence, killmail) = await self.delivery_queue.get()
+            self._record('delivery_wait', queued)
+            try:
+                started = time.monotonic()
+                await asyncio.to_thread(self.killmail_processor.deliver, killmail, sequence)
+                self._record('deliver', started)
+            except Exception:
+                self.statistics['delivery_errors']+=1
+                logging.error("AsyncPipeline: Delivery failed for Kill: " + str(killmail.kill_id))
+                logging.exception("AsyncPipeline:")
+            finally:
+                self.delivery_queue.task_done()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.stats_interval)
+            logging.info("AsyncPipeline: Statistics: " + self.get_statistics_line())
+
+    async def _run(self):
+        self.ingest_queue = asyncio.Queue(self.ingest_queue_size)
+        self.delivery_queue = asyncio.Queue(self.delivery_queue_size)
+        tasks = []
+        for worker in range(self.enrichment_workers):
+            tasks.append(asyncio.create_task(self._enrich()))
+        for worker in range(self.delivery_workers):
+            tasks.append(asyncio.create_task(self._deliver()))
+        tasks.append(asyncio.create_task(self._report()))
+        try:
+            await self._poll()
+            # Finish any killmails already recieved before shutting down
+            logging.info("AsyncPipeline: Draining queues")
+            await self.ingest_queue.join()
+            await self.delivery_queue.join()
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    def run(self):
+        logging.info("AsyncPipeline: Starting with " + str(self.enrichment_workers) + " enrichment workers")
+        self.poller.is_running = True
+        asyncio.run(self._run())
+
+    def get_statistics(self):
+        statistics = dict(self.statistics)
+        if self.ingest_queue is not None:
+            statistics['ingest_queue_depth'] = self.ingest_queue.qsize()
+            statistics['delivery_queue_depth'] = self.delivery_queue.qsize()
+        for stage, latency in self.latency.items():
+            statistics[stage + '_count'] = latency[0]
+            statistics[stage + '_avg_ms'] = round(latency[1] / latency[0] * 1000, 1) if latency[0] else 0
+            statistics[stage + '_max_ms'] = round(latency[2] * 1000, 1)
+        return statistics
+
+    def get_statistics_line(self):
+        return ", ".join("{}: {}".format(key, value) for key, value in self.get_statistics().items())
@@ -0,0 +1,178 @@
+# zKillboardMonitor - Background prefetching of ESI names ahead of the alerts needing them
+import logging
+import threading
+import time
+
+from collections import OrderedDict, deque
+
+from zkillmon.warming import CacheWarmer
+
+# Class ESIPrefetcher - Resolves names likely to be needed by upcoming alerts within a budget of ESI calls per minute.
+# Feed entities and locations are queued at startup, the ids around recently relevant kills only while the killmail source is idle.
+class ESIPrefetcher(object):
+    # Queries checked against the cache, and resolved in one bulk names request, at a time
+    chunk_size = 100
+    # Seconds after an idle poll during which the ids of recent kills are prefetched
+    idle_window = 10
+
+    def __init__(self, esiLookup, callsPerMinute: float = 30, maxRecent: int = 2000):
+        self.esi_lookup = esiLookup
+        # Token bucket holding up to ten seconds of the budget
+        self.rate = callsPerMinute / 60
+        self.capacity = max(1.0, self.rate * 10)
+        self.tokens = self.capacity
+        self.refilled = time.monotonic()
+        # Queries fetched whenever the budget allows, and (queryType, queryValue) -> None for recent kills, newest last
+        self.queries = deque()
+        self.recent = OrderedDict()
+        self.max_recent = maxRecent
+        self.idle_until = 0.0
+        self.condition = threading.Condition()
+        self.thread = None
+        self.is_running = True
+        self.statistics = {
+            'queued': 0,
+            'already_cached': 0,
+            'prefetched': 0,
+            'esi_calls': 0,
+            'failed': 0
+        }
+
+    def _start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._worker, name="esi-prefetch", daemon=True)
+            self.thread.start()
+
+    def prefetch_feeds(self, feeds):
+        # Entities and locations named by the feeds, as cache warming uses
+        queries = CacheWarmer(self.esi_lookup).feed_queries(feeds)
+        with self.condition:
+            self.queries.extend(sorted(queries))
+            self.statistics['queued']+=len(queries)
+            self._start()
+            self.condition.notify()
+        logging.info("ESIPrefetcher: Queued " + str(len(queries)) + " feed entities and locations")
+
+    def observe(self, killmail):
+        # Every attacker and ship and the system of a relevant kill are likely to appear in the next kills nearby
+        killmailData = killmail.kill_raw_data
+        queries = [("system_id", killmail.system_id)]
+        for entity in [killmailData['victim']] + killmailData['attackers']:
+            for entityType in ("character_id", "corporation_id", "alliance_id"):
+                if entity.get(entityType) is not None:
+                    queries.append((entityType, entity[entityType]))
+            if entity.get('faction_id') is not None:
+                queries.append(("faction", entity['faction_id']))
+            if entity.get('ship_type_id') is not None:
+                queries.append(("type_id", entity['ship_type_id']))
+        with self.condition:
+            for query in queries:
+                self.recent[query] = None
+                self.recent.move_to_end(query)
+            while len(self.recent) > self.max_recent:
+                self.recent.popitem(last=False)
+            self._start()
+
+    def idle(self):
+        # Called by the killmail source after a poll returned no killmail
+        with self.condition:
+            self.idle_until = time.monotonic() + self.idle_window
+            if self.recent:
+                self.condition.notify()
+
+    def _take(self):
+        # Returns the next chunk of queries, feed queries first then the newest recent ones, or None once closed
+        with self.condition:
+            while self.is_running:
+                if self.queries:
+                    return [self.queries.popleft() for _ in range(min(self.chunk_size, len(self.queries)))]
+                now = time.monotonic()
+                if self.recent and now < self.idle_until:
+                    self.statistics['queued']+=min(self.chunk_size, len(self.recent))
+                    return [self.recent.popitem()[0] for _ in range(min(self.chunk_size, len(self.recent)))]
+                self.condition.wait()
+            return None
+
+    def _spend(self):
+        # Waits for one call of the budget, returns False if closed while waiting
+        with self.condition:
+            while self.is_running:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.refilled) * self.rate)
+                self.refilled = now
+                if self.tokens >= 1:
+                    self.tokens-=1
+                    self.statistics['esi_calls']+=1
+                    return True
+                self.condition.wait((1 - self.tokens) / self.rate)
+            return False
+
+    def _is_static_location(self, queryType: str, queryValue: int):
+        # Locations the universe map holds need no ESI at all
+        universeMap = self.esi_lookup.universe_map
+        if universeMap is None:
+            return False
+        if queryType == "system_id":
+            return universeMap.has_system(queryValue)
+        return universeMap.get_name(queryValue) is not None
+
+    def _resolve(self, chunk):
+        misses = []
+        byType = {}
+        for queryType, queryValue in chunk:
+            byType.setdefault(queryType, []).append(queryValue)
+        for queryType, queryValues in byType.items():
+            cached = self.esi_lookup.cache.get_many(queryValues, queryType)
+            misses.extend((queryType, queryValue) for queryValue in queryValues if queryValue not in cached)
+        self.statistics['already_cached']+=len(chunk) - len(misses)
+        names = [miss for miss in misses if miss[0] in self.esi_lookup.names_query_types]
+        # One bulk request resolves every name, failures in bulk are left for the hot path rather than retried one at a time
+        if names and self._spend():
+            # Names the hot path is already fetching are left to it
+            resolved = self.esi_lookup.prefetch_names(names)
+            failed = sum(1 for data in resolved.values() if data is None)
+            self.statistics['prefetched']+=len(resolved) - failed
+            self.statistics['failed']+=failed
+        for queryType, queryValue in misses:
+            if queryType in self.esi_lookup.names_query_types or self._is_static_location(queryType, queryValue):
+                continue
+            if not self._spend():
+                return
+            resolved = self.esi_lookup.prefetch(queryType, queryValue)
+            if resolved is None:
+                self.statistics['failed']+=1
+                continue
+            self.statistics['prefetched']+=1
+            # Alerts need the constellation and region of a system too
+            match queryType:
+                case "system_id":
+                    parentQuery = ("constellation_id", resolved.get('parent'))
+                case "constellation_id":
+                    parentQuery = ("region_id", resolved.get('parent'))
+                case _:
+                    continue
+            if parentQuery[1] is not None:
+                with self.condition:
+                    self.queries.append(parentQuery)
+                    self.statistics['queued']+=1
+
+    def _worker(self):
+        while True:
+            chunk = self._take()
+            if chunk is None:
+                return
+            try:
+                self._resolve(chunk)
+            except Exception:
+                logging.exception("ESIPrefetcher:")
+
+    def close(self):
+        with self.condition:
+            self.is_running = False
+            self.condition.notify_all()
+        if self.thread is not None:
+            self.thread.join(5)
+        logging.info("ESIPrefetcher: Closed")
+
+    def get_statistics(self):
+        return self.statistics
@@ -0,0 +1,114 @@
+# zKillboardMonitor - Filtering, enrichment and alerting of each killmail
+import logging
+import time
+
+from zkillmon.alerts import AlertPayload, discordAlert
+from zkillmon.digest import DigestAggregator
+from zkillmon.killmail import Killmail
+from zkillmon.metrics import metrics
+from zkillmon.spool import SpoolAcknowledgement
+
+# Class KillmailProcessor - Filters killmails against the feed index, enriches relevant ones and sends their alerts
+class KillmailProcessor(object):
+    def __init__(self, feedIndex, esiLookup, discordWebhookStatsTracker, discordDelivery=None, killmailSpool=None, killmailHistory=None, esiPrefetcher=None):
+        self.feed_index = feedIndex
+        self.esi_lookup = esiLookup
+        self.discord_webhook_stats = discordWebhookStatsTracker
+        self.discord_delivery = discordDelivery
+        # Optional durable spool, killmails are journaled on receipt and acknowledged once delivered
+        self.spool = killmailSpool
+        # Optional local history every processed killmail is recorded to
+        self.history = killmailHistory
+        # Optional prefetcher told about relevant kills, whose attackers, ships and system are likely to be seen again
+        self.prefetcher = esiPrefetcher
+        # Kills for feeds with a digest are buffered here instead of alerted one at a time
+        self.digest = DigestAggregator(discordWebhookStatsTracker, discordDelivery)
+
+    def accept(self, responseJson):
+        # Journal a recieved killmail before any processing, returns its spool sequence or None without a spool
+        if self.spool is None:
+            return None
+        return self.spool.append(responseJson)
+
+    def acknowledge(self, sequence):
+        # Used for killmails with nothing to deliver
+        if sequence is not None:
+            self.spool.acknowledge(sequence)
+
+    def recover(self):
+        # Returns (sequence, response) for killmails a previous run recieved but did not finish delivering
+        if self.spool is None:
+            return []
+        return self.spool.replay()
+
+    def enrich(self, responseJson):
+        # Returns the killmail with additional data pulled if it was relevant
+        killmail = Killmail(responseJson)
+        if self.history is not None:
+            self.history.record(killmail, responseJson)
+
+        logging.debug("onMessage: Started for Kill: " + str(killmail.kill_id))
+        logging.info("onMessage: Processing Killmail: " + str(killmail.kill_id))
+
+        started = time.monotonic()
+        killmail.add_relevant_feeds(self.feed_index, self.esi_lookup)
+        metrics.observe("zkillmon_kill_stage_seconds", time.monotonic() - started, {"stage": "filter"})
+
+        if killmail.kill_feeds_relevant:
+            metrics.inc("zkillmon_killmails_total", {"relevant": "true"})
+            logging.info("onMessage: Obtaining Additional Data for Relevant Kill: " + str(killmail.kill_id))
+            started = time.monotonic()
+            killmail.get_additional_data(self.esi_lookup)
+            metrics.observe("zkillmon_kill_stage_seconds", time.monotonic() - started, {"stage": "enrich"})
+            if self.prefetcher is not None:
+                self.prefetcher.observe(killmail)
+        else:
+            metrics.inc("zkillmon_killmails_total", {"relevant": "false"})
+            logging.info("onMessage: End for Non-Relevant Kill: " + str(killmail.kill_id))
+        return killmail
+
+    def deliver(self, killmail, sequence=None):
+        if killmail.kill_additional_data_pulled:
+            logging.info("onMessage: Triggering Alerting for Relevant Kill: " + str(killmail.kill_id))
+            started = time.monotonic()
+            alertData = killmail.get_discord_alert_data()
+            alertPayload = None
+            relevantFeedsToAlert = killmail.get_relevant_feed_information()
+            callback = None
+            # Direct alerts are sent here, the killmail is only acknowledged if every one was
+            allSent = True
+            hasDigest = any(relevantFeed.get('digest') is not None for relevantFeed in relevantFeedsToAlert)
+            if sequence is not None and relevantFeedsToAlert and (self.discord_delivery is not None or hasDigest):
+                # Queued alerts and digests are sent later, the last alert or digest to be sent acknowledges the killmail
+                callback = SpoolAcknowledgement(self.spool, sequence, len(relevantFeedsToAlert)).delivered
+                sequence = None
+            for relevantFeed in relevantFeedsToAlert:
+                if relevantFeed.get('digest') is not None:
+                    self.digest.add(relevantFeed, alertData, callback)
+                    continue
+                if alertPayload is None:
+                    alertPayload = AlertPayload(alertData)
+                if not discordAlert(alertData, relevantFeed, self.discord_webhook_stats, self.discord_delivery, callback, alertPayload):
+                    allSent = False
+                metrics.inc("zkillmon_alerts_total", {"feed": relevantFeed['name'], "relationship": relevantFeed['relationship']})
+            metrics.observe("zkillmon_kill_stage_seconds", time.monotonic() - started, {"stage": "render_send"})
+            if not allSent:
+                # Left in the spool to be replayed on the next start
+                logging.warning("onMessage: Alerts failed for Kill: " + str(killmail.kill_id))
+                sequence = None
+        self.acknowledge(sequence)
+        logging.info("onMessage: Ending processing of Kill: " + str(killmail.kill_id))
+
+    def close(self):
+        self.digest.close()
+
+    def process(self, responseJson, sequence=None):
+        # sequence is given when replaying from the spool, otherwise the killmail is journaled here first
+        if sequence is None:
+            sequence = self.accept(responseJson)
+        killmail = self.enrich(responseJson)
+        if killmail.kill_feeds_relevant:
+            self.deliver(killmail, sequence)
+        else:
+            self.acknowledge(sequence)
+        return killmail
@@ -0,0 +1,157 @@
+# zKillboardMonitor - Feed matching split across worker processes
+import logging
+import multiprocessing
+import pickle
+import signal
+import threading
+
+from zkillmon.feeds import FeedFilter, FeedIndex
+
+# Class ShardKillmail - The parts of a killmail FeedIndex.match reads, rebuilt in a feed shard worker process
+class ShardKillmail(object):
+    __slots__ = ('kill_raw_data', 'kill_zkill_data', 'victim_ids', 'attacker_ids', 'system_id', 'labels', 'empty_pod', 'kill_location_data', 'total_value', 'victim_ship_type_id')
+
+    def __init__(self, request):
+        self.system_id, self.victim_ids, self.attacker_ids, self.labels, self.empty_pod, constellationID, regionID, self.total_value, attackerCount, solo, self.victim_ship_type_id = request
+        # Every entity type the shard reads is sent in victim_ids and attacker_ids, so attackers are only counted
+        self.kill_raw_data = {'victim': {}, 'attackers': [{}] * attackerCount}
+        self.kill_zkill_data = {'solo': solo}
+        self.kill_location_data = {'locationConstellationID': constellationID, 'locationRegionID': regionID}
+
+    def is_empty_pod(self):
+        return self.empty_pod
+
+    def get_location_data(self, esiLookup):
+        # Resolved by the ingest process before the killmail is sent
+        return self.kill_location_data
+
+# Feed shard worker process, compiles its share of the feeds and answers match requests until its pipe is closed
+def feedShardWorker(connection, feeds):
+    # Shutdown is driven by the ingest process closing the pipe
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    feedIndex = FeedIndex(feeds)
+    entityTypes = set(feedIndex.entity_index)
+    for position, feedFilter in feedIndex.filter_feeds:
+        entityTypes.update(feedFilter.entity_types)
+    connection.send((feedIndex.location_lookup_required, feedIndex.location_lookup_required_for_pods, list(entityTypes)))
+    while True:
+        try:
+            request = connection.recv_bytes()
+        except (EOFError, OSError):
+            return
+        connection.send(feedIndex.match(ShardKillmail(pickle.loads(request)), None))
+
+# Class ShardedFeedIndex - FeedIndex split across worker processes, each matching its share of the feeds
+class ShardedFeedIndex(object):
+    def __init__(self, feeds, shards: int = 2):
+        self.feeds = feeds
+        # Filter feeds needing ESI or the universe map, which the workers do not have, are matched in this process.
+        # Every other filter feed is evaluated in turn for each kill, so it is these the workers share to match in parallel.
+        self.local_positions = [position for position, feed in enumerate(feeds) if feed['feed_type'] == "filter" and FeedFilter(feed['filter']).lookups]
+        self.local_index = FeedIndex([feeds[position] for position in self.local_positions])
+        localPositions = set(self.local_positions)
+        filterPositions = [position for position, feed in enumerate(feeds) if feed['feed_type'] == "filter" and position not in localPositions]
+        indexedPositions = [position for position, feed in enumerate(feeds) if feed['feed_type'] != "filter"]
+        self.shards = max(1, min(shards, len(filterPositions) + len(indexedPositions)))
+        # Filter and indexed feeds are each dealt round robin so every shard has an even share of filters,
+        # shard -> local position -> position in feeds
+        self.positions = [filterPositions[shard::self.shards] + indexedPositions[shard::self.shards] for shard in range(self.shards)]
+        self.context = multiprocessing.get_context("spawn")
+        self.connections = [None] * self.shards
+        self.processes = [None] * self.shards
+        self.location_lookup_required = False
+        self.location_lookup_required_for_pods = False
+        self.entity_types = set()
+        # One request is in flight across the shards at a time
+        self.lock = threading.Lock()
+        for shard in range(self.shards):
+            self._start(shard)
+        logging.info("ShardedFeedIndex: Compiled " + str(len(self.feeds)) + " feeds across " + str(self.shards) + " worker processes.")
+
+    def _start(self, shard: int):
+        connection, workerConnection = self.context.Pipe()
+        process = self.context.Process(
+            target=feedShardWorker,
+            args=(workerConnection, [self.feeds[position] for position in self.positions[shard]]),
+            name="feed-shard-" + str(shard),
+            daemon=True
+        )
+        process.start()
+        workerConnection.close()
+        locationLookupRequired, locationLookupRequiredForPods, entityTypes = connection.recv()
+        self.location_lookup_required|=locationLookupRequired
+        self.location_lookup_required_for_pods|=locationLookupRequiredForPods
+        self.entity_types.update(entityTypes)
+        self.connections[shard] = connection
+        self.processes[shard] = process
+
+    def _request(self, killmail, esiLookup):
+        # Compact request holding only what the shards match on, serialized once and sent to every shard
+        emptyPod = killmail.is_empty_pod()
+        constellationID = None
+        regionID = None
+        if self.location_lookup_required and (not emptyPod or self.location_lookup_required_for_pods):
+            killmail.get_location_data(esiLookup)
+            constellationID = killmail.kill_location_data['locationConstellationID']
+            regionID = killmail.kill_location_data['locationRegionID']
+        victimIDs = {}
+        attackerIDs = {}
+        for entityType in self.entity_types:
+            if entityType in killmail.victim_ids:
+                victimIDs[entityType] = killmail.victim_ids[entityType]
+            else:
+                victimIDs[entityType] = killmail.kill_raw_data['victim'].get(entityType)
+            if entityType in killmail.attacker_ids:
+                attackerIDs[entityType] = killmail.attacker_ids[entityType]
+            else:
+                attackerIDs[entityType] = {attacker.get(entityType) for attacker in killmail.kill_raw_data['attackers']}
+        return pickle.dumps((
+            killmail.system_id, victimIDs, attackerIDs, killmail.labels, emptyPod, constellationID, regionID,
+            killmail.total_value, len(killmail.kill_raw_data['attackers']), bool(killmail.kill_zkill_data.get('solo', False)), killmail.victim_ship_type_id
+        ), pickle.HIGHEST_PROTOCOL)
+
+    def match(self, killmail, esiLookup):
+        # Returns a dict of feed position -> relationship, as FeedIndex.match
+        request = self._request(killmail, esiLookup)
+        matches = {}
+        with self.lock:
+            for shard in range(self.shards):
+                try:
+                    self.connections[shard].send_bytes(request)
+                except OSError:
+                    self._restart(shard)
+                    self.connections[shard].send_bytes(request)
+            try:
+                # Feeds needing lookups are matched here while the shards work
+                localMatches = self.local_index.match(killmail, esiLookup)
+            finally:
+                # Every shard is answered even if local matching failed, so the next request is not read a stale answer
+                for shard, positions in enumerate(self.positions):
+                    try:
+                        shardMatches = self.connections[shard].recv()
+                    except (EOFError, OSError):
+                        self._restart(shard)
+                        self.connections[shard].send_bytes(request)
+                        shardMatches = self.connections[shard].recv()
+                    for position, relationship in shardMatches.items():
+                        matches[positions[position]] = relationship
+        for position, relationship in localMatches.items():
+            matches[self.local_positions[position]] = relationship
+        return matches
+
+    def _restart(self, shard: int):
+        logging.error("ShardedFeedIndex: Worker for shard " + str(shard) + " failed, restarting.")
+        self.connections[shard].close()
+        self.processes[shard].join(1)
+        self._start(shard)
+
+    def close(self):
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            for process in self.processes:
+                process.join(5)
+                if process.is_alive():
+                    process.terminate()
+        logging.info("ShardedFeedIndex: Closed")
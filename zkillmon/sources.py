@@ -0,0 +1,286 @@
+# zKillboardMonitor - Killmail sources, RedisQ, the zKillboard websocket and the merged stream
+import queue
+import sys
+import json
+import logging
+import requests
+import signal
+import threading
+import time
+
+from collections import OrderedDict
+
+from zkillmon.metrics import metrics
+from zkillmon.transport import transport
+
+# Class Poller - Functionality to read from zKillboard RedisQ interface
+class Poller(object):
+    def __init__(self, redisqURL, recordPath: str = None, idleBackoffMax: float = 10):
+        self.is_running = False
+        self.url = redisqURL
+        # Optional JSONL file every recieved package is appended to, for offline replay and benchmarking
+        self.record_path = recordPath
+        # RedisQ already holds an empty poll open, so the first empty poll is retried at once and later ones back off up to idle_backoff_max
+        self.idle_backoff_max = idleBackoffMax
+        self.idle_polls = 0
+        # Optional callback made after each empty poll, used to do background work while no killmails are arriving
+        self.on_idle = None
+        self.statistics = {
+            'killmails_recieved': 0,
+            'empty_polls': 0
+        }
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+        logging.info("Poller: Initialized.")
+    def run(self):
+        self.is_running = True
+        while self.is_running:
+            responseJson, delay = self.poll_once()
+            if responseJson is not None:
+                yield responseJson
+            elif delay:
+                time.sleep(delay)
+
+    def poll_once(self):
+        # Poll RedisQ once, returns the response if it included a killmail and the delay in seconds before polling again
+        started = time.monotonic()
+        killmailsRecieved = self.statistics['killmails_recieved']
+        emptyPolls = self.statistics['empty_polls']
+        responseJson, delay = self._poll()
+        metrics.observe("zkillmon_redisq_poll_seconds", time.monotonic() - started)
+        if self.statistics['killmails_recieved'] != killmailsRecieved:
+            metrics.inc("zkillmon_redisq_polls_total", {"result": "killmail"})
+        elif self.statistics['empty_polls'] != emptyPolls:
+            metrics.inc("zkillmon_redisq_polls_total", {"result": "empty"})
+            if self.on_idle is not None:
+                self.on_idle()
+        else:
+            metrics.inc("zkillmon_redisq_polls_total", {"result": "error"})
+        return responseJson, delay
+
+    def _poll(self):
+        logging.info("Poller: Polling RedisQ for Killmails.")
+        try:
+            response = transport.get(self.url,allow_redirects=False)
+            if response.status_code == 200:
+                responseJson = json.loads(response.text)
+                logging.info("Poller: Recieved response.")
+                if responseJson['package'] != None:
+                    logging.info("Poller: Response included killmail, yield for processing.")
+                    # Run onMessage process for each recieved killmail
+                    self.statistics['killmails_recieved']+=1
+                    self.idle_polls = 0
+                    if self.record_path is not None:
+                        self._record(responseJson)
+                    return responseJson, 0
+                else:
+                    self.statistics['empty_polls']+=1
+                    self.idle_polls+=1
+                    delay = min(self.idle_backoff_max, 2 ** (self.idle_polls - 2)) if self.idle_polls > 1 else 0
+                    logging.info("Poller: Response Package was None, retrying in " + str(delay) + "s.")
+                    return None, delay
+            else:
+                logging.error("Poller: Attempt to contact redisq was not successful")
+                if response.status_code == 302:
+                    logging.critical("Poller: Redisq attempted 302 redirect, likely banned. Exiting!")
+                    sys.exit(1)
+                elif response.status_code == 400:
+                    logging.error("Poller: RedisQ Returned 400 sack was null")
+                    return None, 10
+                elif response.status_code == 401:
+                    logging.error("Poller: RedisQ returned 401 Unauthorized!")
+                    return None, 10
+                elif response.status_code == 429:
+                    logging.critical("Poller: RedisQ returned 429 Rate Limited!")
+                    logging.critical(response.raise_for_status())
+                    logging.critical("Poller: Exiting to prevent Ban!")
+                    sys.exit(1)
+                elif response.status_code == 502:
+                    logging.error("Poller: Requests returned 502 Server Error Bad Gateway!")
+                    return None, 60
+                elif response.status_code == 521:
+                    logging.error("Poller: Requests returned 521 Server Error!")
+                    return None, 60
+                else:
+                    logging.error("Poller: Unknown or null response code: " + str(response.status_code) + " " + str(response.reason))
+                    return None, 10
+        except requests.exceptions.Timeout:
+            logging.error("Poller: Connection Timeout. Retrying in 60s.")
+            return None, 60
+        except requests.exceptions.ConnectionError:
+            logging.error("Poller: Connection Error. Retrying in 10s.")
+            return None, 10
+        except requests.exceptions.RequestException:
+            logging.critical("Poller: Unhandled Request Exception. Closing gracefully.")
+            logging.exception("Poller:")
+            self.exit_gracefully()
+            return None, 0
+
+    def _record(self, responseJson):
+        try:
+            with open(self.record_path, "a") as recordFile:
+                recordFile.write(json.dumps(responseJson) + "\n")
+        except OSError:
+            logging.error("Poller: Unable to record killmail to " + self.record_path)
+
+    def handle_sigterm(self, signum, frame):
+        logging.info("Poller: SIGTERM recieved")
+        self.exit_gracefully()
+    def exit_gracefully(self):
+        logging.info("Poller: Shutting down")
+        self.is_running = False
+    def get_statistics(self):
+        return self.statistics
+
+# Class ZKillboardWebsocket - Killmail source reading the zKillboard websocket killstream, polled like Poller
+class ZKillboardWebsocket(object):
+    def __init__(self, websocketURL: str, timeout: float = 30):
+        self.is_running = False
+        self.url = websocketURL
+        self.timeout = timeout
+        self.connection = None
+        self.statistics = {
+            'killmails_recieved': 0,
+            'reconnects': 0
+        }
+        logging.info("ZKillboardWebsocket: Initialized.")
+
+    def _connect(self):
+        # websocket-client is only needed when a websocket source is configured
+        import websocket
+        self.connection = websocket.create_connection(self.url, timeout=self.timeout)
+        self.connection.send(json.dumps({"action": "sub", "channel": "killstream"}))
+        logging.info("ZKillboardWebsocket: Subscribed to killstream at " + self.url)
+
+    def poll_once(self):
+        # Returns a RedisQ style response for the next killmail on the stream and the delay in seconds before polling again
+        import websocket
+        try:
+            if self.connection is None:
+                self._connect()
+            message = self.connection.recv()
+        except websocket.WebSocketTimeoutException:
+            return None, 0
+        except (websocket.WebSocketException, OSError):
+            logging.error("ZKillboardWebsocket: Connection lost, reconnecting in 10s.")
+            self.statistics['reconnects']+=1
+            self.close()
+            return None, 10
+        try:
+            killmail = json.loads(message)
+            zkb = killmail.pop('zkb')
+            responseJson = {"package": {"killID": killmail['killmail_id'], "killmail": killmail, "zkb": zkb}}
+        except (ValueError, KeyError, AttributeError):
+            logging.warning("ZKillboardWebsocket: Ignoring unrecognised message")
+            return None, 0
+        self.statistics['killmails_recieved']+=1
+        return responseJson, 0
+
+    def close(self):
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except Exception:
+                pass
+            self.connection = None
+
+    def exit_gracefully(self):
+        logging.info("ZKillboardWebsocket: Shutting down")
+        self.is_running = False
+
+    def get_statistics(self):
+        return self.statistics
+
+# Class KillmailStream - Merges several killmail sources into one de-duplicated stream, used in place of a single Poller
+class KillmailStream(object):
+    def __init__(self, sources, dedupWindow: int = 10000, recordPath: str = None):
+        self.is_running = False
+        self.sources = sources
+        # Bounded set of recently seen kill IDs, oldest are forgotten first
+        self.dedup_window = dedupWindow
+        self.recent = OrderedDict()
+        self.record_path = recordPath
+        self.queue = queue.Queue(1000)
+        self.lock = threading.Lock()
+        self.threads = []
+        # Optional callback made when no killmail arrived from any source for a second
+        self.on_idle = None
+        self.statistics = {
+            'killmails_recieved': 0,
+            'duplicates': 0
+        }
+        # Each Poller installs its own handler, replace it with one stopping every source
+        signal.signal(signal.SIGTERM, self.handle_sigterm)
+        logging.info("KillmailStream: Initialized with " + str(len(self.sources)) + " sources.")
+
+    def _start(self):
+        if self.threads:
+            return
+        for number, source in enumerate(self.sources):
+            source.is_running = True
+            thread = threading.Thread(target=self._read, args=(source,), name="killmail-source-" + str(number), daemon=True)
+            self.threads.append(thread)
+            thread.start()
+
+    def _read(self, source):
+        while self.is_running and source.is_running:
+            responseJson, delay = source.poll_once()
+            if responseJson is not None:
+                self.queue.put(responseJson)
+            elif delay:
+                time.sleep(delay)
+
+    def _is_new(self, responseJson):
+        killID = responseJson['package'].get('killID')
+        with self.lock:
+            if killID in self.recent:
+                self.recent.move_to_end(killID)
+                self.statistics['duplicates']+=1
+                metrics.inc("zkillmon_killmails_duplicate_total")
+                return False
+            self.recent[killID] = None
+            if len(self.recent) > self.dedup_window:
+                self.recent.popitem(last=False)
+            self.statistics['killmails_recieved']+=1
+        return True
+
+    def run(self):
+        self.is_running = True
+        while self.is_running:
+            responseJson, delay = self.poll_once()
+            if responseJson is not None:
+                yield responseJson
+
+    def poll_once(self):
+        # Returns the next killmail not already seen from any source, waiting up to a second
+        self._start()
+        try:
+            responseJson = self.queue.get(timeout=1)
+        except queue.Empty:
+            if self.on_idle is not None:
+                self.on_idle()
+            return None, 0
+        if not self._is_new(responseJson):
+            return None, 0
+        if self.record_path is not None:
+            self._record(responseJson)
+        return responseJson, 0
+
+    def _record(self, responseJson):
+        try:
+            with open(self.record_path, "a") as recordFile:
+                recordFile.write(json.dumps(responseJson) + "\n")
+        except OSError:
+            logging.error("KillmailStream: Unable to record killmail to " + self.record_path)
+
+    def handle_sigterm(self, signum, frame):
+        logging.info("KillmailStream: SIGTERM recieved")
+        self.exit_gracefully()
+
+    def exit_gracefully(self):
+        logging.info("KillmailStream: Shutting down")
+        self.is_running = False
+        for source in self.sources:
+            source.exit_gracefully()
+
+    def get_statistics(self):
+        return self.statistics
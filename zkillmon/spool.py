@@ -0,0 +1,127 @@
+# zKillboardMonitor - Durable journal of recieved killmails
+import os
+import json
+import logging
+import sqlite3
+import threading
+import time
+
+# Class KillmailSpool - Durable SQLite journal of recieved killmails, each is removed once its alerts are delivered
+class KillmailSpool(object):
+    def __init__(self, sqlitePath, maxPending: int = 10000, maxAttempts: int = 5, compactInterval: float = 300):
+        self.path = sqlitePath
+        # Oldest unacknowledged killmails are discarded beyond max_pending to bound disk use
+        self.max_pending = maxPending
+        # Killmails replayed this many times without being acknowledged are discarded
+        self.max_attempts = maxAttempts
+        self.compact_interval = compactInterval
+        self.compacted = time.monotonic()
+        self.lock = threading.Lock()
+        self.statistics = {
+            'appended': 0,
+            'acknowledged': 0,
+            'replayed': 0,
+            'discarded': 0
+        }
+        initialize = not os.path.exists(self.path)
+        # Shared between the poller and Discord delivery workers, all access is serialized by the lock
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        if initialize:
+            # auto_vacuum has to be set before the first table is created
+            self.connection.execute("PRAGMA auto_vacuum=INCREMENTAL")
+            self.connection.execute("""
+                CREATE TABLE spool (
+                    Sequence             INTEGER NOT NULL  PRIMARY KEY AUTOINCREMENT,
+                    KillID               INTEGER,
+                    Package              TEXT NOT NULL,
+                    Recieved             REAL NOT NULL,
+                    Attempts             INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            self.connection.commit()
+            logging.warning("KillmailSpool: Spool created at " + self.path)
+        self.pending = self.connection.execute("SELECT COUNT(*) FROM spool").fetchone()[0]
+        logging.info("KillmailSpool: Initialized with " + str(self.pending) + " unacknowledged killmails")
+
+    def append(self, responseJson):
+        # Written and committed before processing so a crash or restart cannot lose the killmail, returns its sequence
+        killID = (responseJson.get('package') or {}).get('killID')
+        with self.lock:
+            with self.connection:
+                cursor = self.connection.execute(
+                    "INSERT INTO spool (KillID, Package, Recieved) VALUES(?, ?, ?)",
+                    (killID, json.dumps(responseJson), time.time())
+                )
+                self.pending+=1
+                if self.pending > self.max_pending:
+                    discarded = self.connection.execute(
+                        "DELETE FROM spool WHERE Sequence IN (SELECT Sequence FROM spool ORDER BY Sequence LIMIT ?)",
+                        (self.pending - self.max_pending,)
+                    ).rowcount
+                    self.pending-=discarded
+                    self.statistics['discarded']+=discarded
+                    logging.error("KillmailSpool: Spool full, discarded " + str(discarded) + " oldest unacknowledged killmails")
+            self.statistics['appended']+=1
+            return cursor.lastrowid
+
+    def acknowledge(self, sequence: int):
+        with self.lock:
+            with self.connection:
+                deleted = self.connection.execute("DELETE FROM spool WHERE Sequence = ?", (sequence,)).rowcount
+            self.pending-=deleted
+            self.statistics['acknowledged']+=deleted
+            if time.monotonic() - self.compacted >= self.compact_interval:
+                self._compact()
+
+    def replay(self):
+        # Returns (sequence, response) for every unacknowledged killmail, oldest first, counting the attempt
+        with self.lock:
+            with self.connection:
+                discarded = self.connection.execute("DELETE FROM spool WHERE Attempts >= ?", (self.max_attempts,)).rowcount
+                if discarded:
+                    self.pending-=discarded
+                    self.statistics['discarded']+=discarded
+                    logging.error("KillmailSpool: Discarded " + str(discarded) + " killmails after " + str(self.max_attempts) + " attempts")
+                self.connection.execute("UPDATE spool SET Attempts = Attempts + 1")
+                rows = self.connection.execute("SELECT Sequence, Package FROM spool ORDER BY Sequence").fetchall()
+            self.statistics['replayed']+=len(rows)
+        if rows:
+            logging.warning("KillmailSpool: Replaying " + str(len(rows)) + " unacknowledged killmails")
+        return [(sequence, json.loads(package)) for sequence, package in rows]
+
+    def _compact(self):
+        # Return the pages freed by acknowledged killmails and truncate the write ahead log
+        self.connection.execute("PRAGMA incremental_vacuum")
+        self.connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        self.compacted = time.monotonic()
+        logging.debug("KillmailSpool: Compacted")
+
+    def close(self):
+        with self.lock:
+            self._compact()
+            self.connection.close()
+        logging.info("KillmailSpool: Closed with " + str(self.pending) + " unacknowledged killmails")
+
+    def get_statistics(self):
+        return dict(self.statistics, pending=self.pending)
+
+# Class SpoolAcknowledgement - Acknowledges a spooled killmail once every one of its queued alerts has been sent
+class SpoolAcknowledgement(object):
+    def __init__(self, killmailSpool, sequence: int, alerts: int):
+        self.spool = killmailSpool
+        self.sequence = sequence
+        self.remaining = alerts
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def delivered(self, sent: bool):
+        # Called by the Discord delivery worker, a failed alert leaves the killmail in the spool for replay
+        with self.lock:
+            self.remaining-=1
+            if not sent:
+                self.failed = True
+            complete = self.remaining == 0 and not self.failed
+        if complete:
+            self.spool.acknowledge(self.sequence)
@@ -0,0 +1,183 @@
+# zKillboardMonitor - Shared HTTP transport, one pooled keep-alive session per host
+import logging
+import threading
+import time
+
+from urllib.parse import urlsplit
+
+import requests
+import requests.adapters
+import urllib3
+
+from zkillmon.metrics import metrics
+
+# Set by the timed connections in the thread making a request, None when a pooled connection was reused
+connectionTimings = threading.local()
+
+# Class TimedHTTPConnection - urllib3 connection recording how long the TCP connect took
+class TimedHTTPConnection(urllib3.connection.HTTPConnection):
+    def _new_conn(self):
+        started = time.perf_counter()
+        connection = super()._new_conn()
+        connectionTimings.connect = time.perf_counter() - started
+        return connection
+
+# Class TimedHTTPSConnection - urllib3 connection recording how long the TCP connect and TLS handshake took
+class TimedHTTPSConnection(urllib3.connection.HTTPSConnection):
+    def _new_conn(self):
+        started = time.perf_counter()
+        connection = super()._new_conn()
+        connectionTimings.connect = time.perf_counter() - started
+        return connection
+
+    def connect(self):
+        started = time.perf_counter()
+        super().connect()
+        connectionTimings.tls = time.perf_counter() - started - (connectionTimings.connect or 0)
+
+class TimedHTTPConnectionPool(urllib3.HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+class TimedHTTPSConnectionPool(urllib3.HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+# Class TimedHTTPAdapter - requests adapter whose pools create timed connections
+class TimedHTTPAdapter(requests.adapters.HTTPAdapter):
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+# Class HTTPTransport - Pooled keep-alive requests sessions per host with per host pool size, timeout and retry policy.
+# Records new and reused connections and the connect, TLS and first byte time of each request. Responses are gzip compressed
+# through requests' default Accept-Encoding and decoded transparently.
+class HTTPTransport(object):
+    default_policy = {
+        'pool_size': 10,
+        'timeout': 10,
+        'retries': 0,
+        'backoff_factor': 0.5,
+        'retry_statuses': [],
+        # Methods retried after a read error or a retry_statuses response, None for urllib3's idempotent methods.
+        # Connection errors are retried for every method as the request never reached the host.
+        'retry_methods': None
+    }
+    host_policies = {
+        # RedisQ holds polls open for up to 10s, the poller backs off on error responses itself.
+        # Each poll removes a killmail from the queue, so one whose response was lost is never sent again.
+        "redisq.zkillboard.com": {'pool_size': 4, 'timeout': 30, 'retries': 1, 'retry_methods': []},
+        # Lookups are idempotent, including POST /universe/names/, gateway errors are retried before the circuit breaker counts a failure
+        "esi.evetech.net": {'pool_size': 16, 'timeout': 10, 'retries': 2, 'retry_statuses': [502, 503, 504], 'retry_methods': ["GET", "POST"]},
+        # DiscordDelivery retries and honours rate limits itself
+        "discord.com": {'pool_size': 10, 'timeout': 10, 'retries': 0}
+    }
+
+    def __init__(self):
+        # host -> policy overrides from the configuration
+        self.overrides = {}
+        # host -> (requests.Session, policy)
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.statistics = {}
+
+    def configure(self, hostPolicies):
+        # Overrides are merged over the defaults of each host, sessions already open are replaced
+        with self.lock:
+            for host, policy in hostPolicies.items():
+                self.overrides.setdefault(host, {}).update(policy)
+                session = self.sessions.pop(host, None)
+                if session is not None:
+                    session[0].close()
+
+    def policy(self, host: str):
+        return dict(self.default_policy, **self.host_policies.get(host, {}), **self.overrides.get(host, {}))
+
+    def _session(self, host: str):
+        with self.lock:
+            session = self.sessions.get(host)
+            if session is None:
+                policy = self.policy(host)
+                retryMethods = policy['retry_methods']
+                retryLimits = {}
+                if retryMethods is None:
+                    retryMethods = urllib3.util.Retry.DEFAULT_ALLOWED_METHODS
+                elif not retryMethods:
+                    # urllib3 treats no methods as every method, only connection errors are retried instead
+                    retryMethods = urllib3.util.Retry.DEFAULT_ALLOWED_METHODS
+                    retryLimits = {'read': 0, 'status': 0, 'other': 0}
+                retry = urllib3.util.Retry(
+                    total=policy['retries'],
+                    backoff_factor=policy['backoff_factor'],
+                    status_forcelist=policy['retry_statuses'],
+                    allowed_methods=frozenset(method.upper() for method in retryMethods),
+                    raise_on_status=False,
+                    **retryLimits
+                )
+                adapter = TimedHTTPAdapter(pool_connections=1, pool_maxsize=policy['pool_size'], max_retries=retry)
+                requestsSession = requests.Session()
+                requestsSession.mount("https://", adapter)
+                requestsSession.mount("http://", adapter)
+                session = self.sessions[host] = (requestsSession, policy)
+                self.statistics[host] = {
+                    'requests': 0,
+                    'errors': 0,
+                    'new_connections': 0,
+                    'reused_connections': 0
+                }
+                logging.info("HTTPTransport: Opened session for " + host + " with a pool of " + str(policy['pool_size']))
+            return session
+
+    def request(self, method: str, url: str, **kwargs):
+        # As requests.request, the host's timeout is used unless one is given
+        host = urlsplit(url).hostname or ""
+        session, policy = self._session(host)
+        kwargs.setdefault('timeout', policy['timeout'])
+        connectionTimings.connect = None
+        connectionTimings.tls = None
+        self._count(host, 'requests')
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.exceptions.RequestException:
+            self._count(host, 'errors')
+            metrics.inc("zkillmon_http_requests_total", {"host": host, "connection": "error"})
+            raise
+        connect = connectionTimings.connect
+        if connect is None:
+            self._count(host, 'reused_connections')
+            metrics.inc("zkillmon_http_requests_total", {"host": host, "connection": "reused"})
+            firstByte = response.elapsed.total_seconds()
+        else:
+            tls = connectionTimings.tls
+            self._count(host, 'new_connections')
+            metrics.inc("zkillmon_http_requests_total", {"host": host, "connection": "new"})
+            metrics.observe("zkillmon_http_phase_seconds", connect, {"host": host, "phase": "connect"})
+            if tls is not None:
+                metrics.observe("zkillmon_http_phase_seconds", tls, {"host": host, "phase": "tls"})
+            firstByte = max(0.0, response.elapsed.total_seconds() - connect - (tls or 0))
+        # Time from the request being sent to the response headers arriving
+        metrics.observe("zkillmon_http_phase_seconds", firstByte, {"host": host, "phase": "first_byte"})
+        return response
+
+    def _count(self, host: str, counter: str):
+        # Requests to a host are made from the poller, delivery and revalidation threads at once
+        with self.lock:
+            self.statistics[host][counter]+=1
+
+    def get(self, url: str, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def close(self):
+        with self.lock:
+            for session, policy in self.sessions.values():
+                session.close()
+            self.sessions.clear()
+        logging.info("HTTPTransport: Closed")
+
+    def get_statistics(self):
+        with self.lock:
+            return {host: dict(statistics) for host, statistics in self.statistics.items()}
+
+# Shared by every RedisQ, ESI and Discord request in the process
+transport = HTTPTransport()
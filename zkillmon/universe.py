@@ -0,0 +1,121 @@
+# zKillboardMonitor - Static universe map
+import os
+import json
+import logging
+
+from array import array
+
+# Class UniverseMap - Static solar system -> constellation -> region map held in parallel arrays
+class UniverseMap(object):
+    format_version = 1
+
+    def __init__(self):
+        self.system_ids = array('i')
+        self.constellation_ids = array('i')
+        self.region_ids = array('i')
+        self.security = array('d')
+        self.names = {}
+        self.positions = {}
+
+    def _index(self):
+        self.positions = {systemID: position for position, systemID in enumerate(self.system_ids)}
+
+    def add_system(self, systemID: int, constellationID: int, regionID: int, security: float, name: str = None):
+        self.system_ids.append(systemID)
+        self.constellation_ids.append(constellationID)
+        self.region_ids.append(regionID)
+        self.security.append(security)
+        if name is not None:
+            self.names[systemID] = name
+
+    def has_system(self, systemID: int):
+        return systemID in self.positions
+
+    def get(self, systemID: int):
+        # Returns (constellation ID, region ID, security status) or None for unknown systems
+        position = self.positions.get(systemID)
+        if position is None:
+            return None
+        return self.constellation_ids[position], self.region_ids[position], self.security[position]
+
+    def get_name(self, id: int):
+        return self.names.get(id)
+
+    def save(self, mapPath: str):
+        data = {
+            "version": self.format_version,
+            "system_ids": self.system_ids.tolist(),
+            "constellation_ids": self.constellation_ids.tolist(),
+            "region_ids": self.region_ids.tolist(),
+            "security": [round(security, 3) for security in self.security.tolist()],
+            "names": self.names
+        }
+        with open(mapPath + ".tmp", "w") as mapFile:
+            json.dump(data, mapFile, separators=(",", ":"))
+        os.replace(mapPath + ".tmp", mapPath)
+        logging.info("UniverseMap: Saved " + str(len(self.system_ids)) + " systems to " + mapPath)
+
+    @classmethod
+    def load(cls, mapPath: str):
+        with open(mapPath) as mapFile:
+            data = json.load(mapFile)
+        if data.get("version") != cls.format_version:
+            raise Exception("Universe map version " + str(data.get("version")) + " is not supported")
+        universeMap = cls()
+        universeMap.system_ids = array('i', data['system_ids'])
+        universeMap.constellation_ids = array('i', data['constellation_ids'])
+        universeMap.region_ids = array('i', data['region_ids'])
+        universeMap.security = array('d', data['security'])
+        universeMap.names = {int(id): name for id, name in data['names'].items()}
+        universeMap._index()
+        logging.info("UniverseMap: Loaded " + str(len(universeMap.system_ids)) + " systems from " + mapPath)
+        return universeMap
+
+    @classmethod
+    def import_sde(cls, sdePath: str):
+        # Build the map from the Fuzzwork SDE CSV dump (mapSolarSystems.csv, mapConstellations.csv and mapRegions.csv)
+        import csv
+        universeMap = cls()
+        with open(os.path.join(sdePath, "mapSolarSystems.csv"), newline="") as csvFile:
+            for row in csv.DictReader(csvFile):
+                universeMap.add_system(
+                    int(row['solarSystemID']),
+                    int(row['constellationID']),
+                    int(row['regionID']),
+                    float(row['security']),
+                    row['solarSystemName']
+                )
+        with open(os.path.join(sdePath, "mapConstellations.csv"), newline="") as csvFile:
+            for row in csv.DictReader(csvFile):
+                universeMap.names[int(row['constellationID'])] = row['constellationName']
+        with open(os.path.join(sdePath, "mapRegions.csv"), newline="") as csvFile:
+            for row in csv.DictReader(csvFile):
+                universeMap.names[int(row['regionID'])] = row['regionName']
+        universeMap._index()
+        logging.info("UniverseMap: Imported " + str(len(universeMap.system_ids)) + " systems from SDE")
+        return universeMap
+
+    @classmethod
+    def import_esi(cls, esiLookup):
+        # Build the map from ESI, this makes one request per system, constellation and region so is slow but only needed once
+        universeMap = cls()
+        constellations = {}
+        regions = {}
+        systemIDs = esiLookup.fetch_json("universe/systems/", "universe_import")
+        for count, systemID in enumerate(systemIDs, 1):
+            system = esiLookup.fetch_json("universe/systems/{0}/".format(systemID), "universe_import")
+            constellationID = system['constellation_id']
+            if constellationID not in constellations:
+                constellation = esiLookup.fetch_json("universe/constellations/{0}/".format(constellationID), "universe_import")
+                constellations[constellationID] = constellation['region_id']
+                universeMap.names[constellationID] = constellation['name']
+            regionID = constellations[constellationID]
+            if regionID not in regions:
+                regions[regionID] = esiLookup.fetch_json("universe/regions/{0}/".format(regionID), "universe_import")['name']
+                universeMap.names[regionID] = regions[regionID]
+            universeMap.add_system(systemID, constellationID, regionID, system['security_status'], system['name'])
+            if count % 500 == 0:
+                logging.info("UniverseMap: Imported " + str(count) + " of " + str(len(systemIDs)) + " systems")
+        universeMap._index()
+        logging.info("UniverseMap: Imported " + str(len(universeMap.system_ids)) + " systems from ESI")
+        return universeMap
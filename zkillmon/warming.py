@@ -0,0 +1,135 @@
+# zKillboardMonitor - Bulk ESI cache warming
+import concurrent.futures
+import json
+import logging
+import time
+
+# Class CacheWarmer - Fills the ESI cache in bulk ahead of live traffic, from feeds, ship types, factions and recorded kills
+class CacheWarmer(object):
+    # ESI category of ships
+    ship_category_id = 6
+    chunk_size = 100
+
+    def __init__(self, esiLookup, workers: int = 8):
+        self.esi_lookup = esiLookup
+        self.workers = workers
+        self.statistics = {
+            'queries': 0,
+            'resolved': 0,
+            'placeholders': 0
+        }
+
+    def feed_queries(self, feeds):
+        # Entities and locations named by entity, location and filter feeds
+        queries = set()
+
+        def walk(node):
+            if isinstance(node, list):
+                for child in node:
+                    walk(child)
+            elif isinstance(node, dict):
+                for operator, value in node.items():
+                    match operator:
+                        case "entity":
+                            queries.add(("faction" if value['entity_type'] == "faction_id" else value['entity_type'], value['entity_id']))
+                        case "location":
+                            queries.add((value['location_type'], value['location_id']))
+                        case "victim_ship_type":
+                            queries.update(("type_id", typeID) for typeID in value)
+                        case _:
+                            walk(value)
+
+        for feed in feeds:
+            match feed['feed_type']:
+                case "entity":
+                    walk({"entity": feed['entity']})
+                case "location":
+                    walk({"location": feed['location']})
+                case "filter":
+                    walk(feed['filter'])
+        return queries
+
+    def recording_queries(self, recordPath: str):
+        # Every name an alert would need for the kills in a JSONL recording of RedisQ responses
+        queries = set()
+        kills = 0
+        with open(recordPath) as recordFile:
+            for line in recordFile:
+                line = line.strip()
+                if not line:
+                    continue
+                package = json.loads(line).get('package')
+                if package is None:
+                    continue
+                kills+=1
+                killmail = package['killmail']
+                queries.add(("system_id", killmail['solar_system_id']))
+                entities = [killmail['victim']] + [attacker for attacker in killmail['attackers'] if attacker.get('final_blow')]
+                for entity in entities:
+                    for entityType in ("character_id", "corporation_id", "alliance_id"):
+                        if entity.get(entityType) is not None:
+                            queries.add((entityType, entity[entityType]))
+                    if entity.get('faction_id') is not None:
+                        queries.add(("faction", entity['faction_id']))
+                    if entity.get('ship_type_id') is not None:
+                        queries.add(("type_id", entity['ship_type_id']))
+        logging.info("CacheWarmer: Found " + str(len(queries)) + " IDs in " + str(kills) + " recorded kills")
+        return queries
+
+    def warm_factions(self):
+        factions = self.esi_lookup.fetch_json("universe/factions/", "cache_warm")
+        for faction in factions:
+            self.esi_lookup.store("faction", faction['faction_id'], faction['name'])
+        logging.info("CacheWarmer: Cached " + str(len(factions)) + " factions")
+        return len(factions)
+
+    def warm_ship_types(self):
+        # Group listings give each type's group, so types are cached with their parent without one request per type
+        typeGroups = {}
+        for groupID in self.esi_lookup.fetch_json("universe/categories/{0}/".format(self.ship_category_id), "cache_warm")['groups']:
+            for typeID in self.esi_lookup.fetch_json("universe/groups/{0}/".format(groupID), "cache_warm")['types']:
+                typeGroups[typeID] = groupID
+        logging.info("CacheWarmer: Found " + str(len(typeGroups)) + " ship types")
+        for (queryType, typeID), resolved in self.warm(("type_id", typeID) for typeID in typeGroups).items():
+            if resolved.get('parent') is None and resolved.get('expires') is not None:
+                self.esi_lookup.store("type_id", typeID, resolved['name'], typeGroups[typeID])
+        return len(typeGroups)
+
+    def warm(self, queries):
+        # Resolve queries in concurrent chunks, then the constellations and regions of any systems, returns (queryType, id) -> data
+        results = {}
+        queries = set(queries)
+        while queries:
+            pending = sorted(queries)
+            started = time.monotonic()
+            done = 0
+            self.statistics['queries']+=len(pending)
+            with concurrent.futures.ThreadPoolExecutor(self.workers) as executor:
+                chunks = [executor.submit(self.esi_lookup.resolve_many, pending[offset:offset + self.chunk_size]) for offset in range(0, len(pending), self.chunk_size)]
+                for chunk in concurrent.futures.as_completed(chunks):
+                    resolved = chunk.result()
+                    results.update(resolved)
+                    done+=len(resolved)
+                    elapsed = time.monotonic() - started
+                    logging.info("CacheWarmer: Resolved " + str(done) + " of " + str(len(pending)) + " (" + str(round(done / elapsed if elapsed else 0.0, 1)) + "/s)")
+            queries = set()
+            for (queryType, queryValue), resolved in results.items():
+                parent = resolved.get('parent')
+                if parent is None:
+                    continue
+                match queryType:
+                    case "system_id":
+                        parentQuery = ("constellation_id", parent)
+                    case "constellation_id":
+                        parentQuery = ("region_id", parent)
+                    case _:
+                        continue
+                if parentQuery not in results:
+                    queries.add(parentQuery)
+        placeholders = sum(1 for resolved in results.values() if resolved.get('expires') is None)
+        self.statistics['resolved']+=len(results) - placeholders
+        self.statistics['placeholders']+=placeholders
+        return results
+
+    def get_statistics(self):
+        return self.statistics